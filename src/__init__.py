@@ -4,6 +4,9 @@ import logging
 import time
 import os
 import re
+
+STARTUP_TIME = time.perf_counter() # when the package started loading, used by --profile-startup
+
 from telegram.ext import Application 
 
 from aiohttp import ClientSession
@@ -92,10 +95,39 @@ else:
     LOGGER.error("There is no environment variables section in the config file.")
     raise Exception("There is no environment variables section in the config file.")
 
+def get_optional_value(name, default):
+    # optional settings can be left out of the config file, in which case the default is used
+    item = ENV.get(name) or {}
+    value = item.get('value')
+    if value is None or value == "":
+        return default
+    
+    return type(default)(value)
+
+ADMIN_CACHE_TTL = get_optional_value('ADMIN_CACHE_TTL', 600)
+DATABASE_WORKERS = get_optional_value('DATABASE_WORKERS', 4)
+RAID_JOIN_THRESHOLD = get_optional_value('RAID_JOIN_THRESHOLD', 10)
+RAID_JOIN_WINDOW = get_optional_value('RAID_JOIN_WINDOW', 1.0)
+RAID_BATCH_DELAY = get_optional_value('RAID_BATCH_DELAY', 3.0)
+METRICS_HOST = get_optional_value('METRICS_HOST', "127.0.0.1")
+METRICS_PORT = get_optional_value('METRICS_PORT', 9464)
+
+DATABASE_URL = get_optional_value('DATABASE_URL', DATABASE_URL)
+if DATABASE_URL.startswith("postgres://"): # sqlalchemy only accepts the postgresql:// scheme
+    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
 # Load the application
 
+from src.core.application import InstrumentedApplication, TimedRequest, BOT_API_POOL_SIZE
+
 try:
-    dispatcher = Application.builder().token(BOT_TOKEN).build()
+    dispatcher = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .application_class(InstrumentedApplication)
+        .request(TimedRequest(connection_pool_size=BOT_API_POOL_SIZE))
+        .build()
+    )
 except ValueError:
     LOGGER.error("There is no token value for the bot token that can be used to create the bot application.")
     raise Exception("Unable to create the bot application as there is no defined bot token value.")
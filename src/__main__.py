@@ -1,5 +1,7 @@
 import importlib # for dynamically importing modules
 import re
+import sys
+import time
 from typing import Optional
 
 from src import (
@@ -8,8 +10,12 @@ from src import (
     REPOSITORY,
     BOT_NAME,
     BOT_USERNAME,
+    STARTUP_TIME,
 )
 from src.modules import ALL_MODULES
+from src.core.sql import run_in_db_executor
+from src.core.sql.migrations import run_migrations
+from src.core.chat_context import CHAT_CONTEXT_HANDLER, CHAT_CONTEXT_GROUP
 from src.utils.performance import sys_status
 from src.core.commands_menu.help_menu import paginate_modules, paginate_info
 
@@ -24,6 +30,10 @@ STATS = []
 CHAT_SETTINGS = {}
 USER_SETTINGS = {}
 
+# python3 -m src --profile-startup prints how long each part of startup took instead of running the bot
+PROFILE_STARTUP = "--profile-startup" in sys.argv
+MODULE_IMPORT_TIMES = {} # module name -> seconds spent importing it
+
 PM_START_TEXT = f"""
 Hello, nice to meet you! My name is {BOT_NAME}
 
@@ -82,8 +92,12 @@ HELP_KEYBOARD = InlineKeyboardMarkup(
 )
 
 # dynamically load the modules
+MODULES_START_TIME = time.perf_counter()
 for module_name in ALL_MODULES:
+    import_start = time.perf_counter()
     imported_module = importlib.import_module("src.modules." + module_name)
+    MODULE_IMPORT_TIMES[module_name] = time.perf_counter() - import_start
+
     if not hasattr(imported_module, "__module_name__"):
         imported_module.__module_name__ = imported_module.__name__
     
@@ -365,7 +379,7 @@ async def stats_callback(update: Update, context: CallbackContext):
     text = await sys_status()
     await dispatcher.bot.answer_callback_query(query.id, text=text, show_alert=True)
 
-def migrate_chats(update: Update, context: CallbackContext):
+async def migrate_chats(update: Update, context: CallbackContext):
     message: Optional[Message] = update.effective_message
 
     if message.migrate_to_chat_id:
@@ -379,9 +393,11 @@ def migrate_chats(update: Update, context: CallbackContext):
     
     LOGGER.info("Migrating from %s, to %s", str(old_chat), str(new_chat))
     for mod in MIGRATEABLE_MODULES:
-        mod.__migrate__(old_chat, new_chat)
+        await run_in_db_executor(mod.__migrate__, old_chat, new_chat)
 
 def main():
+    run_migrations()
+
     start_handler = CommandHandler("start", start)
     help_handler = CommandHandler("help", show_module_commands)
     
@@ -401,9 +417,33 @@ def main():
     dispatcher.add_handler(commands_callback_handler)
     dispatcher.add_handler(stats_callback_handler)
     dispatcher.add_handler(migrate_handler)
+    dispatcher.add_handler(CHAT_CONTEXT_HANDLER, group=CHAT_CONTEXT_GROUP)
 
     dispatcher.run_polling(allowed_updates=Update.ALL_TYPES)
 
+def print_startup_profile():
+    # each module's time includes the first import of anything it shares with the modules after it
+    migrations_start = time.perf_counter()
+    run_migrations()
+    migrations_time = time.perf_counter() - migrations_start
+
+    timings = [("core (config, application, database)", MODULES_START_TIME - STARTUP_TIME)]
+    timings += sorted(
+        ((f"modules/{module_name}", import_time) for module_name, import_time in MODULE_IMPORT_TIMES.items()),
+        key=lambda timing: timing[1],
+        reverse=True,
+    )
+    timings.append(("migrations", migrations_time))
+
+    width = max(len(name) for name, _ in timings)
+    print("Startup profile:")
+    for name, seconds in timings:
+        print(f"    {name.ljust(width)}  {seconds * 1000:8.1f} ms")
+    print(f"    {'total'.ljust(width)}  {(time.perf_counter() - STARTUP_TIME) * 1000:8.1f} ms")
+
 if __name__ == '__main__':
     LOGGER.info("Successfully loaded modules: " + str(ALL_MODULES))
-    main()
\ No newline at end of file
+    if PROFILE_STARTUP:
+        print_startup_profile()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import time
+
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+from src.core.metrics import instrument_handler, record_api_time
+from src.core.sql import UPDATE_SCOPE, UPDATE_SCOPES, close_update_sessions
+
+BOT_API_POOL_SIZE = 256 # the pool size the application builder gives its own request
+
+
+class SessionScopedApplication(Application):
+    """
+    An Application that gives every update its own database sessions, which are closed
+    as soon as the update has been handled instead of living as long as the thread.
+    """
+
+    async def process_update(self, update: object) -> None:
+        scope = next(UPDATE_SCOPES)
+        token = UPDATE_SCOPE.set(scope)
+        try:
+            await super().process_update(update)
+        finally:
+            UPDATE_SCOPE.reset(token)
+            close_update_sessions(scope)
+
+
+class InstrumentedApplication(SessionScopedApplication):
+    """
+    Records the latency, exceptions and database and bot api time of every handler added to it,
+    see src/core/metrics.py.
+    """
+
+    def add_handler(self, handler, group: int = 0) -> None:
+        instrument_handler(handler, group)
+        super().add_handler(handler, group)
+
+
+class TimedRequest(HTTPXRequest):
+    # charges the time spent on each bot api call to the handler that made it
+    async def do_request(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            record_api_time(time.perf_counter() - start)
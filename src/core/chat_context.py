@@ -0,0 +1,77 @@
+from typing import Optional
+
+from src.core.sql import (
+    run_in_db_executor,
+    CHAT_SETTINGS_CACHE,
+    CHAT_SETTINGS_GENERATIONS,
+    CHAT_SETTINGS_LOCK,
+    antiflood_sql,
+    blacklist_sql,
+    warns_sql,
+    welcome_sql,
+)
+
+from telegram import Update, Chat
+from telegram.ext import CallbackContext, TypeHandler
+
+# runs before every other handler group so the modules can share one settings lookup per update
+CHAT_CONTEXT_GROUP = -1
+CHAT_SETTINGS_KEY = "chat_settings"
+
+
+def load_chat_settings(chat_id) -> dict:
+    # blocking, only ever called on the database executor
+    return {
+        "flood": antiflood_sql.get_flood_setting(chat_id),
+        "blacklist": blacklist_sql.get_blacklist_setting(chat_id),
+        "blacklist_matcher": blacklist_sql.get_chat_blacklist_matcher(chat_id),
+        "warn_filters": warns_sql.get_chat_warn_matcher(chat_id),
+        "welcome": welcome_sql.get_welc_pref(chat_id),
+        "goodbye": welcome_sql.get_gdbye_pref(chat_id),
+        "welcome_mutes": welcome_sql.welcome_mutes(chat_id),
+        "clean_service": welcome_sql.clean_service(chat_id),
+    }
+
+
+async def get_chat_settings(chat_id) -> dict:
+    """
+    Returns the flood, blacklist, warn filter and welcome settings of a chat, loading them from the database on a cache miss.
+    :param chat_id: The chat to get the settings for.
+    :return: A dictionary of the chat's settings.
+    """
+    key = int(chat_id)
+    settings = CHAT_SETTINGS_CACHE.get(key)
+    if settings is not None:
+        return settings
+
+    generation = CHAT_SETTINGS_GENERATIONS.get(key, 0)
+    settings = await run_in_db_executor(load_chat_settings, chat_id)
+
+    # a setter ran while we were loading, so what we have may already be out of date.
+    # checked and stored under the lock so a setter can't slip in between the two
+    with CHAT_SETTINGS_LOCK:
+        if CHAT_SETTINGS_GENERATIONS.get(key, 0) == generation:
+            CHAT_SETTINGS_CACHE.set(key, settings)
+
+    return settings
+
+
+async def current_chat_settings(update: Update, context: CallbackContext) -> dict:
+    # the settings attached by the chat context stage, or a fresh lookup if it didn't run for this update
+    settings = context.chat_data.get(CHAT_SETTINGS_KEY) if context.chat_data is not None else None
+    if settings is None:
+        settings = await get_chat_settings(update.effective_chat.id)
+
+    return settings
+
+
+async def attach_chat_settings(update: Update, context: CallbackContext) -> None:
+    chat: Optional[Chat] = update.effective_chat
+
+    if not chat or chat.type == "private":
+        return
+
+    context.chat_data[CHAT_SETTINGS_KEY] = await get_chat_settings(chat.id)
+
+
+CHAT_CONTEXT_HANDLER = TypeHandler(Update, attach_chat_settings)
@@ -1,20 +1,62 @@
+import asyncio
 from functools import wraps
-from typing import Optional
+from typing import Optional, Dict
 
-from src import LOGGER
+from src import LOGGER, ADMIN_CACHE_TTL
 from src.core.sql import blacklistusers_sql as blacklistusers_sql
+from src.utils.cache import TTLCache
 
 from telegram import Update, Chat, User, Message, ChatMember
 from telegram.constants import ParseMode
 from telegram.ext import CallbackContext
 
+# chat_id -> {user_id: ChatMember} for every admin in the chat, the least recently used chats are dropped past the limit
+ADMIN_CACHE = TTLCache(ADMIN_CACHE_TTL, maxsize=10000)
+ADMIN_CACHE_LOCKS = {} # chat_id -> [lock, handlers using it], only kept while a fetch is in progress
+
+
+async def get_admin_roster(chat: Chat) -> Dict[int, ChatMember]:
+    """
+    Returns the admins of a chat, fetching them with a single get_chat_administrators call when the cache is empty or stale.
+    :param chat: The chat to get the admins of.
+    :return: A dictionary mapping each admin's user id to their chat member object.
+    """
+    roster = ADMIN_CACHE.get(chat.id)
+    if roster is not None:
+        return roster
+
+    # only let one handler per chat hit the API, the rest wait and read the fresh roster
+    entry = ADMIN_CACHE_LOCKS.setdefault(chat.id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            roster = ADMIN_CACHE.get(chat.id)
+            if roster is None:
+                admins = await chat.get_administrators()
+                roster = {member.user.id: member for member in admins}
+                ADMIN_CACHE.set(chat.id, roster)
+    finally:
+        # the last one out drops the lock, so there's only ever one per chat that's being fetched right now
+        entry[1] -= 1
+        if not entry[1]:
+            del ADMIN_CACHE_LOCKS[chat.id]
+
+    return roster
+
+
+def invalidate_admin_cache(chat_id: int) -> None:
+    # drop the cached roster so the next check fetches it again
+    ADMIN_CACHE.pop(chat_id)
+
 
 async def bot_admin_check(chat: Chat, bot_id: int, bot_member: ChatMember = None) -> bool:
     if chat.type == "private":
         return True
     
     if not bot_member:
-        bot_member = await chat.get_member(bot_id)
+        bot_member = (await get_admin_roster(chat)).get(bot_id)
+        if not bot_member:
+            return False
 
     return bot_member.status in ("administrator", "creator")
     
@@ -47,10 +89,10 @@ async def user_admin_check(chat: Chat, user_id: int, member: ChatMember = None)
         return True
     
     if not member:
-        LOGGER.info("User is not a chat member")
-        member = await chat.get_member(user_id)
+        member = (await get_admin_roster(chat)).get(user_id)
+        if not member:
+            return False
     
-    LOGGER.info("member status in admin or creator:")
     return member.status in ("administrator", "creator")
 
 def is_not_blacklisted(func):
@@ -64,7 +106,7 @@ def is_not_blacklisted(func):
         if not user:
             return 
         
-        if not blacklistusers_sql.is_user_blacklisted(chat.id, user.id):
+        if not await blacklistusers_sql.aio.is_user_blacklisted(chat.id, user.id):
             return await func(update, context, *args, **kwargs) 
         else:
             return
@@ -121,7 +163,9 @@ async def user_is_ban_protected(chat: Chat, user_id: int, member: ChatMember = N
         return True 
     
     if not member:
-        member = await chat.get_member(user_id)
+        member = (await get_admin_roster(chat)).get(user_id)
+        if not member:
+            return False
     
     return member.status in ("administrator", "creator")
 
@@ -140,8 +184,8 @@ def can_promote(func):
                 f"I can't promote people in <b>{update_chat_title}</b>!\n"
                 f"Make sure I'm admin and have the correct privileges."
             )
-        member = await chat.get_member(bot.id)
-        if member.can_promote_members:
+        member = (await get_admin_roster(chat)).get(bot.id)
+        if member and member.can_promote_members:
             return await func(update, context, *args, **kwargs)
         else:
             await update.effective_message.reply_text(cant_promote, parse_mode=ParseMode.HTML)
@@ -162,9 +206,9 @@ def can_pin(func):
         else:
             cant_pin = f"I can't pin/unpin messages in <b>{update_chat_title}</b>!\nMake sure I'm admin and have the correct privileges."
 
-        bot_member = await chat.get_member(bot.id)
+        bot_member = (await get_admin_roster(chat)).get(bot.id)
 
-        if bot_member.can_pin_messages:
+        if bot_member and bot_member.can_pin_messages:
             return await func(update, context, *args, **kwargs)
         else:
             await update.effective_message.reply_text(
@@ -188,9 +232,9 @@ def can_change_info(func):
         else:
             cant_change_info = f"I can't change the info in <b>{update_chat_title}</b>!\nMake sure I'm admin and have the correct privileges"
 
-        bot_member = await chat.get_member(bot.id)
+        bot_member = (await get_admin_roster(chat)).get(bot.id)
 
-        if bot_member.can_change_info:
+        if bot_member and bot_member.can_change_info:
             return await func(update, context, *args, **kwargs)
         else:
             await update.effective_message.reply_text(
@@ -214,9 +258,9 @@ def can_invite(func):
         else:
             cant_invite = f"I can't send invite links in <b>{update_chat_title}</b>!\nMake sure I'm admin and can pin/unpin messages there."
 
-        bot_member = await chat.get_member(bot.id)
+        bot_member = (await get_admin_roster(chat)).get(bot.id)
 
-        if bot_member.can_invite_users:
+        if bot_member and bot_member.can_invite_users:
             return await func(update, context, *args, **kwargs)
         else:
             await update.effective_message.reply_text(
@@ -240,9 +284,9 @@ def can_restrict_members(func):
         else:
             cant_restrict = f"I can't restrict members in <b>{update_chat_title}</b>!\nMake sure I'm admin and can restrict members there."
 
-        bot_member = await chat.get_member(bot.id)
+        bot_member = (await get_admin_roster(chat)).get(bot.id)
 
-        if bot_member.can_restrict_members:
+        if bot_member and bot_member.can_restrict_members:
             return await func(update, context, *args, **kwargs)
         else:
             await update.effective_message.reply_text(
@@ -266,9 +310,9 @@ def can_delete_messages(func):
         else:
             cant_delete = f"I can't delete messages in <b>{update_chat_title}</b>!\nMake sure I'm admin and can delete messages here."
 
-        bot_member = await chat.get_member(bot.id)
+        bot_member = (await get_admin_roster(chat)).get(bot.id)
 
-        if bot_member.can_delete_messages:
+        if bot_member and bot_member.can_delete_messages:
             return await func(update, context, *args, **kwargs)
         else:
             await update.effective_message.reply_text(
@@ -0,0 +1,262 @@
+import contextvars
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+# upper bounds in seconds, anything slower lands in the last (+Inf) bucket.
+# every histogram is just these counters, so memory stays the same however many calls are recorded.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    A fixed bucket histogram, quantiles are estimated by interpolating inside the bucket they fall in.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile the same way prometheus' histogram_quantile does.
+        :param q: The quantile, between 0 and 1.
+        :return: The estimated latency in seconds, 0 if nothing has been recorded.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets): # past the last bound, so that's as precise as it gets
+                    return self.buckets[-1]
+
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+
+        return self.buckets[-1]
+
+
+    def cumulative_counts(self) -> list:
+        total, cumulative = 0, []
+        for bucket_count in self.counts:
+            total += bucket_count
+            cumulative.append(total)
+        return cumulative
+
+
+class HandlerStats:
+    def __init__(self) -> None:
+        self.latency = LatencyHistogram()
+        self.exceptions = 0
+        self.db_seconds = 0.0
+        self.api_seconds = 0.0
+
+
+    def record(self, seconds: float, timings: "CallTimings", failed: bool) -> None:
+        self.latency.observe(seconds)
+        self.db_seconds += timings.db
+        self.api_seconds += timings.api
+        if failed:
+            self.exceptions += 1
+
+
+class CallTimings:
+    # filled in by the database executor and the bot's request while a handler is running
+    __slots__ = ("db", "api")
+
+    def __init__(self) -> None:
+        self.db = 0.0
+        self.api = 0.0
+
+
+# the handler call that's running in this task, so time spent waiting on the database or the bot api
+# can be charged to it. None outside of handlers, e.g. in jobs.
+CURRENT_CALL = contextvars.ContextVar("current_call", default=None)
+
+# (handler name, group) -> stats, and group -> stats of every handler in it
+HANDLER_STATS = {}
+GROUP_STATS = {}
+
+# cache name -> function returning its hits, misses, coalesced lookups and size, see register_cache
+CACHE_STATS = {}
+
+
+def record_db_time(seconds: float) -> None:
+    timings = CURRENT_CALL.get()
+    if timings is not None:
+        timings.db += seconds
+
+
+def record_api_time(seconds: float) -> None:
+    timings = CURRENT_CALL.get()
+    if timings is not None:
+        timings.api += seconds
+
+
+def register_cache(name: str, stats) -> None:
+    """
+    Makes a cache's counters show up in /perf and on the metrics endpoint.
+    :param name: The name the cache is shown under.
+    :param stats: A function returning a dictionary with the cache's hits, misses, coalesced and size.
+    """
+    CACHE_STATS[name] = stats
+
+
+def handler_name(callback) -> str:
+    return "{}.{}".format(callback.__module__.rsplit(".", 1)[-1], callback.__qualname__)
+
+
+def instrument_callback(callback, group: int):
+    if getattr(callback, "__instrumented__", False):
+        return callback
+
+    name = handler_name(callback)
+    stats = HANDLER_STATS.setdefault((name, group), HandlerStats())
+    group_stats = GROUP_STATS.setdefault(group, HandlerStats())
+
+    @wraps(callback)
+    async def wrapper(update, context):
+        timings = CallTimings()
+        token = CURRENT_CALL.set(timings)
+        failed = False
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise # stopping the other groups is how a handler says it's done, not a failure
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            CURRENT_CALL.reset(token)
+            stats.record(elapsed, timings, failed)
+            group_stats.record(elapsed, timings, failed)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_handler(handler, group: int) -> None:
+    """
+    Wraps the callback of a handler, and of every handler inside a conversation, so its calls are recorded.
+    :param handler: The handler that is being added to the application.
+    :param group: The group it's being added to.
+    """
+    if isinstance(handler, ConversationHandler):
+        inner_handlers = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            inner_handlers += list(state_handlers)
+
+        for inner_handler in inner_handlers:
+            instrument_handler(inner_handler, group)
+        return
+
+    if getattr(handler, "callback", None) is not None:
+        handler.callback = instrument_callback(handler.callback, group)
+
+
+def __labels(**labels) -> str:
+    return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels.items())
+
+
+def __render_stats(prefix: str, rows: list) -> list:
+    lines = [
+        f"# HELP {prefix}_calls_total Handler calls.",
+        f"# TYPE {prefix}_calls_total counter",
+    ]
+    lines += [f"{prefix}_calls_total{{{labels}}} {stats.latency.count}" for labels, stats in rows]
+
+    lines += [
+        f"# HELP {prefix}_exceptions_total Handler calls that raised an exception.",
+        f"# TYPE {prefix}_exceptions_total counter",
+    ]
+    lines += [f"{prefix}_exceptions_total{{{labels}}} {stats.exceptions}" for labels, stats in rows]
+
+    lines += [
+        f"# HELP {prefix}_db_seconds_total Time handlers spent waiting on the database.",
+        f"# TYPE {prefix}_db_seconds_total counter",
+    ]
+    lines += [f"{prefix}_db_seconds_total{{{labels}}} {stats.db_seconds:.6f}" for labels, stats in rows]
+
+    lines += [
+        f"# HELP {prefix}_api_seconds_total Time handlers spent waiting on the bot api.",
+        f"# TYPE {prefix}_api_seconds_total counter",
+    ]
+    lines += [f"{prefix}_api_seconds_total{{{labels}}} {stats.api_seconds:.6f}" for labels, stats in rows]
+
+    lines += [
+        f"# HELP {prefix}_latency_seconds How long handler calls took.",
+        f"# TYPE {prefix}_latency_seconds histogram",
+    ]
+    for labels, stats in rows:
+        bounds = [str(bucket) for bucket in stats.latency.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, stats.latency.cumulative_counts()):
+            lines.append(f'{prefix}_latency_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f"{prefix}_latency_seconds_sum{{{labels}}} {stats.latency.sum:.6f}")
+        lines.append(f"{prefix}_latency_seconds_count{{{labels}}} {stats.latency.count}")
+
+    lines += [
+        f"# HELP {prefix}_latency_quantile_seconds Estimated latency quantiles.",
+        f"# TYPE {prefix}_latency_quantile_seconds gauge",
+    ]
+    for labels, stats in rows:
+        for q in QUANTILES:
+            lines.append(f'{prefix}_latency_quantile_seconds{{{labels},quantile="{q}"}} {stats.latency.quantile(q):.6f}')
+
+    return lines
+
+
+def __render_caches() -> list:
+    rows = [(__labels(cache=name), stats()) for name, stats in sorted(CACHE_STATS.items())]
+    lines = []
+
+    for counter, description in (
+        ("hits", "Lookups answered from the cache."),
+        ("coalesced", "Lookups that waited on a request already in flight instead of making their own."),
+        ("misses", "Lookups that had to make a new request."),
+    ):
+        lines += [
+            f"# HELP bot_cache_{counter}_total {description}",
+            f"# TYPE bot_cache_{counter}_total counter",
+        ]
+        lines += [f"bot_cache_{counter}_total{{{labels}}} {stats[counter]}" for labels, stats in rows]
+
+    lines += [
+        "# HELP bot_cache_entries Entries currently held by the cache.",
+        "# TYPE bot_cache_entries gauge",
+    ]
+    lines += [f"bot_cache_entries{{{labels}}} {stats['size']}" for labels, stats in rows]
+
+    return lines
+
+
+def render_prometheus() -> str:
+    """
+    Renders every handler and group's stats, and the registered caches' counters, in the prometheus text format.
+    :return: The metrics page.
+    """
+    handler_rows = [
+        (__labels(handler=name, group=group), stats) for (name, group), stats in sorted(HANDLER_STATS.items())
+    ]
+    group_rows = [(__labels(group=group), stats) for group, stats in sorted(GROUP_STATS.items())]
+
+    return "\n".join(
+        __render_stats("bot_handler", handler_rows) + __render_stats("bot_group", group_rows) + __render_caches()
+    ) + "\n"
@@ -1,16 +1,164 @@
-from src import LOGGER, DATABASE_URL
-from sqlalchemy import create_engine
+import asyncio
+import contextvars
+import functools
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+
+from src import LOGGER, DATABASE_URL, DATABASE_WORKERS
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
 from sqlalchemy_utils import database_exists
+from src.utils.cache import TTLCache
+from src.core.metrics import record_db_time
+
+SQLITE_BUSY_TIMEOUT = 5000 # milliseconds a writer waits for a lock before giving up
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024 # bytes of the database file read through mmap
+SQLITE_CACHE_SIZE = 64 * 1024 # KiB of page cache per connection
+POOL_RECYCLE = 30 * 60 # seconds before a server connection is replaced, so idle ones dropped by the server aren't reused
+
+# the update being handled by this task, see src/core/application.py. None outside of updates.
+# tasks copy it from whoever created them, so a background task started by a handler has to set it back to None
+# (or run in a fresh contextvars.Context), otherwise its sessions are closed with the update that started it
+# and the ones it opens afterwards are never closed at all.
+UPDATE_SCOPE = contextvars.ContextVar("update_scope", default=None)
+UPDATE_SCOPES = itertools.count(1)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # run on every new connection, the pragmas other than journal_mode only last as long as the connection does
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL") # readers no longer block the writer and the other way around
+    cursor.execute("PRAGMA synchronous=NORMAL") # safe with WAL, only the last commits can be lost on power failure
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+
+def build_engine(database_url: str) -> Engine:
+    """
+    Creates the engine, with a pool sized for the database executor.
+    SQLite connections get the pragmas above, any other database is reached through a server pool.
+    :param database_url: The sqlalchemy url of the database.
+    :return: The engine.
+    """
+    # one connection per database worker, plus a few for the blocking loads that run on the main thread at startup
+    pool_options = {"pool_size": DATABASE_WORKERS, "max_overflow": DATABASE_WORKERS}
+
+    if database_url.startswith("sqlite"):
+        new_engine = create_engine(database_url, echo=False, **pool_options)
+        event.listen(new_engine, "connect", set_sqlite_pragmas)
+    else:
+        new_engine = create_engine(
+            database_url, echo=False, pool_pre_ping=True, pool_recycle=POOL_RECYCLE, **pool_options,
+        )
+
+    return new_engine
+
+
+def current_session_scope():
+    # every update gets its own sessions, and so does every thread since sessions can't be shared between them.
+    # jobs and startup code run outside of an update and fall back to one session per thread.
+    return UPDATE_SCOPE.get(), threading.get_ident()
 
-LOGGER.info("Database URL: {}".format(DATABASE_URL))
 
 def initialise_engine() -> scoped_session:
     global engine
-    engine = create_engine(DATABASE_URL, echo=False)
+    engine = build_engine(DATABASE_URL)
     BASE.metadata.bind = engine
-    BASE.metadata.create_all(engine)
-    return scoped_session(sessionmaker(bind=engine, autoflush=False))
+    return scoped_session(sessionmaker(bind=engine, autoflush=False), scopefunc=current_session_scope)
+
+
+def close_update_sessions(scope) -> None:
+    # drop the sessions an update opened once it has been handled
+    registry = SESSION.registry.registry
+    for key in [key for key in list(registry) if key[0] == scope]:
+        session = registry.pop(key, None)
+        if session is not None:
+            session.close()
+
 
 BASE = declarative_base()
-SESSION = initialise_engine()
\ No newline at end of file
+SESSION = initialise_engine()
+
+# the tables are only created or changed by src/core/sql/migrations.py at startup, so anything a *_sql module
+# loads into memory has to wait for it through on_schema_ready
+SCHEMA_READY = threading.Event()
+SCHEMA_LOADERS = []
+
+
+def on_schema_ready(loader) -> None:
+    """
+    Runs a function once the migrations have brought the schema up to date, straight away if they already have.
+    :param loader: The function to run, usually the __load_x function of a *_sql module.
+    """
+    if SCHEMA_READY.is_set():
+        loader()
+    else:
+        SCHEMA_LOADERS.append(loader)
+
+LOGGER.info("Database URL: {}".format(engine.url.render_as_string(hide_password=True)))
+
+# every blocking query runs on this pool so the event loop never waits on the database.
+# the context of the caller is copied over, so a query made while handling an update uses that update's session.
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=DATABASE_WORKERS, thread_name_prefix="database")
+
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """
+    Runs a blocking database function on the database executor.
+    :param func: The function to run.
+    :return: Whatever the function returns.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(DB_EXECUTOR, call)
+    finally:
+        record_db_time(time.perf_counter() - start) # includes the wait for a free worker
+
+
+class AsyncSQL:
+    """
+    Exposes the functions of a *_sql module as awaitables that run on the database executor,
+    e.g. `await warns_sql.aio.get_warns(user_id, chat_id)`.
+    """
+
+    def __init__(self, module: ModuleType) -> None:
+        self._module = module
+
+
+    def __getattr__(self, name):
+        func = getattr(self._module, name)
+        if not callable(func):
+            raise AttributeError(f"{self._module.__name__}.{name} is not a function")
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await run_in_db_executor(func, *args, **kwargs)
+
+        setattr(self, name, wrapper) # only build the wrapper once per function
+        return wrapper
+
+
+# chat_id -> the settings every message handler needs, see src/core/chat_context.py.
+# setters call invalidate_chat_settings so the next update loads fresh values.
+CHAT_SETTINGS_CACHE = TTLCache(300, maxsize=10000)
+CHAT_SETTINGS_GENERATIONS = {}
+# the setters run on the database threads, so bumping a generation and storing a load that checked it
+# both happen under this lock
+CHAT_SETTINGS_LOCK = threading.Lock()
+
+
+def invalidate_chat_settings(*chat_ids) -> None:
+    with CHAT_SETTINGS_LOCK:
+        for chat_id in chat_ids:
+            chat_id = int(chat_id)
+            CHAT_SETTINGS_CACHE.pop(chat_id)
+            # bumping the generation stops a load that started before the write from caching stale values
+            CHAT_SETTINGS_GENERATIONS[chat_id] = CHAT_SETTINGS_GENERATIONS.get(chat_id, 0) + 1
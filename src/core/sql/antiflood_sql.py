@@ -1,8 +1,9 @@
 import threading
+import sys
 
-from sqlalchemy import String, Column, Integer, UnicodeText
+from sqlalchemy import BigInteger, Column, Integer, UnicodeText
 from sqlalchemy import inspect
-from src.core.sql import SESSION, BASE, engine as ENGINE
+from src.core.sql import SESSION, BASE, AsyncSQL, invalidate_chat_settings, on_schema_ready
 
 # Flood strength types (the higher the number the lower the severity)
 # 1 = ban
@@ -17,13 +18,13 @@ DEFAULT_OBJECT = (None, DEFAULT_COUNT, DEFAULT_LIMIT)
 
 class FloodControl(BASE):
     __tablename__ = "antiflood"
-    chat_id = Column(String(14), primary_key=True)
-    user_id = Column(Integer)
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger)
     count = Column(Integer, default=DEFAULT_COUNT)
     limit = Column(Integer, default=DEFAULT_LIMIT)
 
     def __init__(self, chat_id, user_id, count, limit):
-        self.chat_id = str(chat_id) # ensure that its in a string format
+        self.chat_id = int(chat_id) # ensure that its in an integer format
         self.user_id = user_id
         self.count = count 
         self.limit = limit
@@ -33,97 +34,80 @@ class FloodControl(BASE):
     
 class FloodSettings(BASE):
     __tablename__ = "antiflood_settings"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     flood_type = Column(Integer, default=1)
     value = Column(UnicodeText, default="0")
 
     def __init__(self, chat_id, flood_type=1, value="0"):
-        self.chat_id = str(chat_id)
+        self.chat_id = int(chat_id)
         self.flood_type = flood_type
         self.value = value
 
     def __repr__(self):
         return f"<{self.chat_id} will be executing {self.flood_type}.>"
 
-def create_tables():
-    FloodControl.__table__.create(bind=ENGINE, checkfirst=True)
-    FloodSettings.__table__.create(bind=ENGINE, checkfirst=True)
-
 INSERTION_FLOOD_LOCK = threading.RLock()
 INSERTION_FLOOD_SETTINGS_LOCK = threading.RLock()
 
+# chat_id -> (user_id, count, limit). The counters only ever live in memory, the
+# limit is the only part of this that is written back to the database.
 CHAT_FLOOD = {}
 
 def set_flood(chat_id, amount):
     with INSERTION_FLOOD_LOCK:
-        flood = SESSION.query(FloodControl).get(str(chat_id))
+        flood = SESSION.query(FloodControl).get(int(chat_id))
         if not flood:
-            flood = FloodControl(str(chat_id), None, DEFAULT_COUNT, amount)
+            flood = FloodControl(int(chat_id), None, DEFAULT_COUNT, amount)
         
         flood.user_id = None
+        flood.count = DEFAULT_COUNT
         flood.limit = amount
 
-        #CHAT_FLOOD[str(chat_id)] = (None, DEFAULT_COUNT, amount)
+        CHAT_FLOOD[int(chat_id)] = (None, DEFAULT_COUNT, amount)
 
         SESSION.merge(flood)
         SESSION.commit()
 
-def update_flood(chat_id: str, user_id) -> None:
-    with INSERTION_FLOOD_LOCK:
-        current_chat_flood = SESSION.query(FloodControl).get(str(chat_id)) #CHAT_FLOOD.get(str(chat_id))
-        if not current_chat_flood:
-            return False 
-        
-        curr_user_id = current_chat_flood.user_id
-        count = current_chat_flood.count 
-        limit = current_chat_flood.limit
+def update_flood(chat_id: int, user_id) -> bool:
+    current_chat_flood = CHAT_FLOOD.get(int(chat_id))
+    if not current_chat_flood:
+        return False 
+    
+    curr_user_id, count, limit = current_chat_flood
 
-        if limit == 0: # no antiflood found
-            return False
-        
-        if user_id != curr_user_id or user_id is None: # other user
-            current_chat_flood.user_id = user_id
-        
-        current_chat_flood.count += 1
-        if current_chat_flood.count > limit: # too many messages, kick
-            current_chat_flood.count = DEFAULT_COUNT
-            SESSION.merge(current_chat_flood)
-            SESSION.commit()
-            return True
-
-        # default -> update
-        SESSION.merge(current_chat_flood)
-        SESSION.commit()
+    if limit == 0: # no antiflood found
         return False
+    
+    if user_id != curr_user_id or user_id is None: # other user
+        curr_user_id = user_id
+    
+    count += 1
+    if count > limit: # too many messages, kick
+        CHAT_FLOOD[int(chat_id)] = (curr_user_id, DEFAULT_COUNT, limit)
+        return True
+
+    # default -> update
+    CHAT_FLOOD[int(chat_id)] = (curr_user_id, count, limit)
+    return False
 
 def reset_flood(chat_id, user_id):
-    with INSERTION_FLOOD_LOCK:
-        current_chat_flood = SESSION.query(FloodControl).get(str(chat_id))
-        if not current_chat_flood:
-            return 
-        
-        curr_user_id = current_chat_flood.user_id
-        if user_id != curr_user_id or user_id is None: # other user
-            current_chat_flood.user_id = user_id
+    current_chat_flood = CHAT_FLOOD.get(int(chat_id))
+    if not current_chat_flood:
+        return 
+    
+    curr_user_id, _, limit = current_chat_flood
+    if user_id != curr_user_id or user_id is None: # other user
+        curr_user_id = user_id
 
-        current_chat_flood.count = DEFAULT_COUNT
-        SESSION.merge(current_chat_flood)
-        SESSION.commit()
+    CHAT_FLOOD[int(chat_id)] = (curr_user_id, DEFAULT_COUNT, limit)
 
 
 def get_flood_limit(chat_id):
-    try:
-        return (
-            SESSION.query(FloodControl.limit)
-            .filter(FloodControl.chat_id == str(chat_id))
-            .first()
-        )[0]
-    finally:
-        SESSION.close()
+    return CHAT_FLOOD.get(int(chat_id), DEFAULT_OBJECT)[2]
 
 def set_flood_severity(chat_id, flood_type, value):
     with INSERTION_FLOOD_SETTINGS_LOCK:
-        current_setting = SESSION.query(FloodSettings).get(str(chat_id))
+        current_setting = SESSION.query(FloodSettings).get(int(chat_id))
         if not current_setting:
             current_setting = FloodSettings(chat_id, flood_type=int(flood_type), value=value)
         
@@ -132,10 +116,11 @@ def set_flood_severity(chat_id, flood_type, value):
 
         SESSION.add(current_setting)
         SESSION.commit()
+        invalidate_chat_settings(chat_id)
 
 def get_flood_setting(chat_id):
     try:
-        settings = SESSION.query(FloodSettings).get(str(chat_id))
+        settings = SESSION.query(FloodSettings).get(int(chat_id))
         if settings:
             return settings.flood_type, settings.value
         else:
@@ -147,11 +132,12 @@ def get_flood_setting(chat_id):
 def migrate_chat(old_chat_id, new_chat_id):
     with INSERTION_FLOOD_LOCK:
         try:
-            flood = SESSION.query(FloodControl).get(str(old_chat_id))
+            flood = SESSION.query(FloodControl).get(int(old_chat_id))
             if flood:
-                CHAT_FLOOD[str(new_chat_id)] = CHAT_FLOOD.get(str(old_chat_id), DEFAULT_OBJECT)
-                flood.chat_id = str(new_chat_id)
+                CHAT_FLOOD[int(new_chat_id)] = CHAT_FLOOD.pop(int(old_chat_id), DEFAULT_OBJECT)
+                flood.chat_id = int(new_chat_id)
                 SESSION.commit()
+                invalidate_chat_settings(old_chat_id, new_chat_id)
         finally:
             SESSION.close()
 
@@ -163,5 +149,6 @@ def __load_flood_settings():
     finally:
         SESSION.close()
 
-#__load_flood_settings()
-create_tables()
\ No newline at end of file
+on_schema_ready(__load_flood_settings)
+
+aio = AsyncSQL(sys.modules[__name__])
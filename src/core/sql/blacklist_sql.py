@@ -1,6 +1,8 @@
 import threading 
-from sqlalchemy import func, distinct, Column, String, UnicodeText, Integer 
-from src.core.sql import SESSION, BASE, engine as ENGINE 
+import sys
+from sqlalchemy import func, distinct, BigInteger, Column, UnicodeText, Integer 
+from src.core.sql import SESSION, BASE, AsyncSQL, invalidate_chat_settings
+from src.utils.string_handling import KeywordMatcher
 
 # Below are the ranked blacklist responses depending on severity
 # 0 -> nothing
@@ -14,11 +16,11 @@ from src.core.sql import SESSION, BASE, engine as ENGINE
 
 class BlacklistFilters(BASE):
     __tablename__ = "blacklist_filters"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     trigger = Column(UnicodeText, primary_key=True, nullable=False)
 
     def __init__(self, chat_id, trigger):
-        self.chat_id = str(chat_id) # Ensure that it's represented as a string
+        self.chat_id = int(chat_id) # Ensure that it's represented as an integer
         self.trigger = trigger 
     
     def __repr__(self):
@@ -33,12 +35,12 @@ class BlacklistFilters(BASE):
     
 class BlacklistSettings(BASE):
     __tablename__ = "blacklist_settings"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     blacklist_type = Column(Integer, default=1) # Default to deleting the message
     value = Column(UnicodeText, default="0") # Default to "0" to indicate that no time is used
 
     def __init__(self, chat_id, blacklist_type = 1, value = "0"):
-        self.chat_id = str(chat_id) # Ensure that it's represented as a string
+        self.chat_id = int(chat_id) # Ensure that it's represented as an integer
         self.blacklist_type = blacklist_type
         self.value = value 
 
@@ -48,31 +50,35 @@ class BlacklistSettings(BASE):
             self.blacklist_type
         )
 
-def create_tables():
-    BlacklistFilters.__table__.create(bind=ENGINE, checkfirst=True)
-    BlacklistSettings.__table__.create(bind=ENGINE, checkfirst=True)
-
 BLACKLIST_FILTER_INSERTION_LOCK = threading.RLock()
 BLACKLIST_FILTER_SETTINGS_INSERTION_LOCK = threading.RLock()
 
+# compiled matcher for each chat -> dropped whenever that chat's blacklist changes
+CHAT_BLACKLIST_MATCHERS = {}
+
 def add_to_blacklist(chat_id, trigger):
     with BLACKLIST_FILTER_INSERTION_LOCK:
-        blacklist_filter = BlacklistFilters(str(chat_id), trigger)
+        blacklist_filter = BlacklistFilters(int(chat_id), trigger)
         SESSION.merge(blacklist_filter)
         SESSION.flush()
         SESSION.commit()
 
+        CHAT_BLACKLIST_MATCHERS.pop(int(chat_id), None)
+        invalidate_chat_settings(chat_id)
+
 def remove_from_blacklist(chat_id, trigger):
     with BLACKLIST_FILTER_INSERTION_LOCK:
         blacklist_filter = (
             SESSION.query(BlacklistFilters)
-            .filter(BlacklistFilters.chat_id == str(chat_id), BlacklistFilters.trigger == trigger)
+            .filter(BlacklistFilters.chat_id == int(chat_id), BlacklistFilters.trigger == trigger)
             .first()
         )
         if blacklist_filter:
             SESSION.delete(blacklist_filter)
             SESSION.commit()
-            
+
+            CHAT_BLACKLIST_MATCHERS.pop(int(chat_id), None)
+            invalidate_chat_settings(chat_id)
             return True 
         
         SESSION.close()
@@ -82,12 +88,31 @@ def get_chat_blacklist(chat_id):
     try:
         return (
             SESSION.query(BlacklistFilters)
-            .filter(BlacklistFilters.chat_id == str(chat_id))
+            .filter(BlacklistFilters.chat_id == int(chat_id))
             .all()
         )
     finally:
         SESSION.close()
 
+def get_chat_blacklist_matcher(chat_id):
+    # only rebuilt from the database after add_to_blacklist/remove_from_blacklist
+    # has changed this chat's triggers
+    matcher = CHAT_BLACKLIST_MATCHERS.get(int(chat_id))
+    if matcher is not None:
+        return matcher
+
+    # read and stored under the setters' lock, otherwise a trigger added in between would pop
+    # the entry before this stores a matcher built from the old triggers
+    with BLACKLIST_FILTER_INSERTION_LOCK:
+        matcher = CHAT_BLACKLIST_MATCHERS.get(int(chat_id))
+        if matcher is None:
+            matcher = KeywordMatcher(
+                blacklist_filter.trigger for blacklist_filter in get_chat_blacklist(chat_id)
+            )
+            CHAT_BLACKLIST_MATCHERS[int(chat_id)] = matcher
+
+    return matcher
+
 def num_blacklist_filters():
     try:
         return SESSION.query(BlacklistFilters).count()
@@ -98,7 +123,7 @@ def get_num_blacklist_chat_filters(chat_id):
     try:
         return (
             SESSION.query(BlacklistFilters.chat_id)
-            .filter(BlacklistFilters.chat_id == str(chat_id))
+            .filter(BlacklistFilters.chat_id == int(chat_id))
             .count()
         )
     finally:
@@ -112,7 +137,7 @@ def get_num_blacklist_filter_chats():
 
 def set_blacklist_severity(chat_id, blacklist_type, value):
     with BLACKLIST_FILTER_SETTINGS_INSERTION_LOCK:
-        current_setting = SESSION.query(BlacklistSettings).get(str(chat_id))
+        current_setting = SESSION.query(BlacklistSettings).get(int(chat_id))
         if not current_setting:
             current_setting = BlacklistSettings(
                 chat_id, blacklist_type=int(blacklist_type), value=str(value),
@@ -122,10 +147,11 @@ def set_blacklist_severity(chat_id, blacklist_type, value):
 
         SESSION.add(current_setting)
         SESSION.commit()
+        invalidate_chat_settings(chat_id)
 
 def get_blacklist_setting(chat_id):
     try:
-        current_setting = SESSION.query(BlacklistSettings).get(str(chat_id))
+        current_setting = SESSION.query(BlacklistSettings).get(int(chat_id))
         if current_setting:
             return current_setting.blacklist_type, current_setting.value
         else:
@@ -137,11 +163,15 @@ def migrate_chat(old_chat_id, new_chat_id):
     with BLACKLIST_FILTER_INSERTION_LOCK:
         chat_filters = (
             SESSION.query(BlacklistFilters)
-            .filter(BlacklistFilters.chat_id == str(old_chat_id))
+            .filter(BlacklistFilters.chat_id == int(old_chat_id))
             .all()
         )
         for filter in chat_filters:
-            filter.chat_id == str(new_chat_id)
+            filter.chat_id = int(new_chat_id)
         SESSION.commit()
 
-create_tables()
\ No newline at end of file
+        CHAT_BLACKLIST_MATCHERS.pop(int(old_chat_id), None)
+        CHAT_BLACKLIST_MATCHERS.pop(int(new_chat_id), None)
+        invalidate_chat_settings(old_chat_id, new_chat_id)
+
+aio = AsyncSQL(sys.modules[__name__])
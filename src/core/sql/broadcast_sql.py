@@ -0,0 +1,91 @@
+import threading
+import sys
+
+from src.core.sql import BASE, SESSION, AsyncSQL
+from sqlalchemy import BigInteger, Boolean, Column, Integer, UnicodeText
+
+# the recipients of a broadcast are sent to in this order, one phase at a time
+PHASES = ("groups", "users")
+
+class BroadcastProgress(BASE):
+    __tablename__ = "broadcast_progress"
+    broadcast_id = Column(Integer, primary_key=True)
+    origin_chat_id = Column(BigInteger, nullable=False) # where the broadcast was started from
+    text = Column(UnicodeText, nullable=False)
+    phases = Column(UnicodeText, nullable=False) # comma separated list of PHASES to run
+    phase = Column(UnicodeText, nullable=False)
+    cursor = Column(UnicodeText) # last recipient id of the current phase that was fully sent to
+    sent = Column(Integer, default=0)
+    failed_groups = Column(Integer, default=0)
+    failed_users = Column(Integer, default=0)
+    finished = Column(Boolean, default=False)
+
+    def __init__(self, origin_chat_id, text, phases):
+        self.origin_chat_id = int(origin_chat_id)
+        self.text = text
+        self.phases = ",".join(phases)
+        self.phase = phases[0]
+        self.cursor = None
+        self.sent = 0
+        self.failed_groups = 0
+        self.failed_users = 0
+        self.finished = False
+
+    def __repr__(self):
+        return "<Broadcast {} in phase {} after {}>".format(self.broadcast_id, self.phase, self.cursor)
+
+BROADCAST_LOCK = threading.RLock()
+
+def start_broadcast(origin_chat_id, text, phases):
+    with BROADCAST_LOCK:
+        try:
+            progress = BroadcastProgress(origin_chat_id, text, [phase for phase in PHASES if phase in phases])
+            SESSION.add(progress)
+            SESSION.commit()
+            return progress.broadcast_id
+        finally:
+            SESSION.close()
+
+def get_broadcast(broadcast_id):
+    try:
+        return SESSION.query(BroadcastProgress).get(broadcast_id)
+    finally:
+        SESSION.close()
+
+def get_unfinished_broadcasts():
+    try:
+        return (
+            SESSION.query(BroadcastProgress.broadcast_id)
+            .filter(BroadcastProgress.finished == False)
+            .all()
+        )
+    finally:
+        SESSION.close()
+
+def save_broadcast_progress(broadcast_id, phase, cursor, sent, failed_groups, failed_users):
+    with BROADCAST_LOCK:
+        try:
+            progress = SESSION.query(BroadcastProgress).get(broadcast_id)
+            if not progress:
+                return
+
+            progress.phase = phase
+            progress.cursor = None if cursor is None else str(cursor)
+            progress.sent = sent
+            progress.failed_groups = failed_groups
+            progress.failed_users = failed_users
+            SESSION.commit()
+        finally:
+            SESSION.close()
+
+def finish_broadcast(broadcast_id):
+    with BROADCAST_LOCK:
+        try:
+            progress = SESSION.query(BroadcastProgress).get(broadcast_id)
+            if progress:
+                progress.finished = True
+                SESSION.commit()
+        finally:
+            SESSION.close()
+
+aio = AsyncSQL(sys.modules[__name__])
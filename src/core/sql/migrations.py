@@ -0,0 +1,229 @@
+"""
+Versioned schema migrations. The schema_version table records every migration that has been applied,
+so a database that is already current costs a single query at startup.
+
+New migrations are appended to MIGRATIONS and must never be edited once they have shipped. Index and column
+changes go through create_index and add_column, which change a live table in place instead of rebuilding it.
+
+    python -m src.core.sql.migrations
+
+applies anything pending without starting the bot.
+"""
+import os
+import time
+
+from sqlalchemy import BigInteger, Column, Integer, MetaData, UnicodeText, func, inspect, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import AddConstraint, CreateColumn, Index, Table
+
+from src import LOGGER
+from src.core.sql import BASE, SCHEMA_LOADERS, SCHEMA_READY, engine as ENGINE
+
+# importing the models registers their tables on BASE
+from src.core.sql import ( # noqa: F401
+    antiflood_sql,
+    blacklist_sql,
+    blacklistusers_sql,
+    broadcast_sql,
+    users_sql,
+    warns_sql,
+    welcome_sql,
+)
+
+
+class SchemaVersion(BASE):
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True)
+    description = Column(UnicodeText)
+    applied_at = Column(Integer, nullable=False) # unix time
+
+    def __repr__(self):
+        return "<Schema version {} ({})>".format(self.version, self.description)
+
+
+def existing_tables(connection: Connection) -> list:
+    return [table for table in BASE.metadata.sorted_tables if inspect(connection).has_table(table.name)]
+
+
+def add_column(connection: Connection, column: Column) -> None:
+    """
+    Adds a column of a model to its live table, unless the table already has it.
+    :param connection: A connection inside of the migration's transaction.
+    :param column: The column as declared on the model, e.g. `Warns.__table__.c.num_warns`.
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    if column.name in {existing["name"] for existing in inspect(connection).get_columns(column.table.name)}:
+        return
+
+    # ADD COLUMN only touches the schema on both sqlite and postgres, the rows are left where they are
+    definition = CreateColumn(column).compile(dialect=connection.dialect)
+    connection.exec_driver_sql(f"ALTER TABLE {quote(column.table.name)} ADD COLUMN {definition}")
+
+
+def create_index(connection: Connection, index: Index) -> None:
+    index.create(connection, checkfirst=True)
+
+
+# ------------------------------------------------------------------------------------------------------
+# 1 - the tables as they were declared when migrations were introduced
+
+def create_tables(connection: Connection) -> None:
+    # an existing database only gets the tables it's missing here, the ones it has are brought up to date below
+    BASE.metadata.create_all(connection)
+
+
+# ------------------------------------------------------------------------------------------------------
+# 2 - chat and user ids stored as integers, with the indexes that go with them
+
+def columns_to_convert(connection: Connection, table: Table) -> list:
+    """
+    Finds the id columns of a table that the database doesn't store as integers yet.
+    :param connection: The connection to inspect the database with.
+    :param table: The model's table.
+    :return: The names of the columns to convert.
+    """
+    existing = {column["name"]: column["type"] for column in inspect(connection).get_columns(table.name)}
+
+    # sqlite integers are always 64 bit, so only the columns declared as text need to change there
+    stored_as_integer = Integer if connection.dialect.name == "sqlite" else BigInteger
+
+    return [
+        column.name for column in table.columns
+        if isinstance(column.type, BigInteger)
+        and column.name in existing
+        and not isinstance(existing[column.name], stored_as_integer)
+    ]
+
+
+def rebuild_sqlite_table(connection: Connection, table: Table, convert: list) -> None:
+    # sqlite can't change the type of a column, so the table is copied into a new one with the current schema
+    quote = connection.dialect.identifier_preparer.quote
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    columns = [column.name for column in table.columns if column.name in existing]
+
+    # the copy has to see every other table so its foreign keys resolve
+    metadata = MetaData()
+    for other in BASE.metadata.sorted_tables:
+        other.to_metadata(metadata)
+    new_table = table.to_metadata(metadata, name=f"{table.name}_new")
+    new_table.indexes.clear() # the old table still owns the index names until it's dropped
+
+    new_table.create(connection)
+    connection.exec_driver_sql("INSERT INTO {} ({}) SELECT {} FROM {}".format(
+        quote(new_table.name),
+        ", ".join(quote(name) for name in columns),
+        ", ".join(
+            f"CAST({quote(name)} AS INTEGER)" if name in convert else quote(name) for name in columns
+        ),
+        quote(table.name),
+    ))
+    connection.exec_driver_sql(f"DROP TABLE {quote(table.name)}")
+    connection.exec_driver_sql(f"ALTER TABLE {quote(new_table.name)} RENAME TO {quote(table.name)}")
+
+
+def alter_server_table(connection: Connection, table: Table, convert: list) -> None:
+    quote = connection.dialect.identifier_preparer.quote
+    for name in convert:
+        connection.exec_driver_sql(
+            f"ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(name)} TYPE BIGINT USING {quote(name)}::bigint"
+        )
+
+
+def migrate_ids(connection: Connection) -> None:
+    tables = existing_tables(connection)
+    conversions = {table.name: columns_to_convert(connection, table) for table in tables}
+    converted = [table for table in tables if conversions[table.name]]
+
+    if connection.dialect.name == "sqlite":
+        for table in converted:
+            LOGGER.info(f"Migrations: Rebuilding {table.name} ({', '.join(conversions[table.name])}).")
+            rebuild_sqlite_table(connection, table, conversions[table.name])
+    else:
+        # foreign keys can't span two different types, so they're dropped while both sides change
+        quote = connection.dialect.identifier_preparer.quote
+        foreign_keys = [
+            (table, foreign_key)
+            for table in tables
+            for foreign_key in inspect(connection).get_foreign_keys(table.name)
+            if conversions[table.name] or conversions.get(foreign_key["referred_table"])
+        ]
+        for table, foreign_key in foreign_keys:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {quote(table.name)} DROP CONSTRAINT {quote(foreign_key['name'])}"
+            )
+
+        for table in converted:
+            LOGGER.info(f"Migrations: Altering {table.name} ({', '.join(conversions[table.name])}).")
+            alter_server_table(connection, table, conversions[table.name])
+
+        for table in {table for table, _ in foreign_keys}:
+            for constraint in table.foreign_key_constraints:
+                connection.execute(AddConstraint(constraint))
+
+    for table in tables:
+        for index in table.indexes:
+            create_index(connection, index)
+
+
+# version, description, function applying it. Append only, each one runs in its own transaction.
+MIGRATIONS = [
+    (1, "create the tables", create_tables),
+    (2, "store chat and user ids as integers", migrate_ids),
+]
+
+
+def get_schema_version() -> int:
+    with ENGINE.connect() as connection:
+        try:
+            return connection.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+        except (OperationalError, ProgrammingError):
+            # no schema_version table, so the database is either new or older than the migrations
+            return 0
+
+
+def backup_sqlite_database() -> None:
+    path = ENGINE.url.database
+    if not path or path == ":memory:":
+        return
+
+    with ENGINE.connect() as connection:
+        if not inspect(connection).get_table_names():
+            return # a brand new database, nothing to lose
+
+        backup_path = f"{path}.{int(time.time())}.bak"
+        # VACUUM INTO copies a consistent snapshot, including anything still sitting in the WAL file
+        connection.exec_driver_sql("VACUUM INTO ?", (os.path.abspath(backup_path),))
+    LOGGER.info(f"Migrations: Backed up the database to {backup_path}.")
+
+
+def run_migrations() -> None:
+    """
+    Applies every migration the database hasn't seen yet, then runs the loaders waiting on the schema.
+    Called once at startup, before any update is handled.
+    """
+    current = get_schema_version()
+    pending = [migration for migration in MIGRATIONS if migration[0] > current]
+
+    if pending:
+        if ENGINE.dialect.name == "sqlite":
+            backup_sqlite_database()
+
+        for version, description, migrate in pending:
+            LOGGER.info(f"Migrations: Applying {version} ({description}).")
+            with ENGINE.begin() as connection:
+                migrate(connection)
+                connection.execute(SchemaVersion.__table__.insert().values(
+                    version=version, description=description, applied_at=int(time.time()),
+                ))
+        current = pending[-1][0]
+
+    LOGGER.info(f"Migrations: The database schema is at version {current}.")
+
+    SCHEMA_READY.set()
+    while SCHEMA_LOADERS:
+        SCHEMA_LOADERS.pop(0)()
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -1,23 +1,38 @@
 import threading
+import sys
+from collections import OrderedDict
 
 from src import dispatcher, BOT_USERNAME
-from src.core.sql import BASE, SESSION, engine as ENGINE
+from src.core.sql import BASE, SESSION, engine as ENGINE, AsyncSQL
 from sqlalchemy import (
+    BigInteger,
     Column, 
     ForeignKey,
+    Index,
     Integer,
-    String, 
     UnicodeText,
     UniqueConstraint,
     func,
 )
+from sqlalchemy.dialects import postgresql, sqlite
 
 INSERTION_LOCK = threading.RLock()
+PENDING_LOCK = threading.Lock()
+
+# (user_id, username, chat_id, chat_name) tuples that are already in the database, most recent last
+SEEN_USERS = OrderedDict()
+SEEN_USERS_LIMIT = 50000
+UPSERT_CHUNK_SIZE = 500 # keeps each statement well under sqlite's bound parameter limit
+
+# changes waiting for the next flush
+PENDING_USERS = {} # user_id -> username
+PENDING_CHATS = {} # chat_id -> chat_name
+PENDING_MEMBERS = set() # (chat_id, user_id)
 
 class Users(BASE):
     __tablename__ = "users"
 
-    user_id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
     username = Column(UnicodeText)
 
     def __init__(self, user_id, username=None):
@@ -30,11 +45,11 @@ class Users(BASE):
 class Chats(BASE):
     __tablename__ = "chats"
 
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     chat_name = Column(UnicodeText, nullable=False)
 
     def __init__(self, chat_id, chat_name):
-        self.chat_id = str(chat_id)
+        self.chat_id = int(chat_id)
         self.chat_name = chat_name
 
     def __repr__(self):
@@ -45,18 +60,22 @@ class ChatMembers(BASE):
     private_chat_id = Column(Integer, primary_key=True)
 
     chat = Column(
-        String(14),
+        BigInteger,
         ForeignKey("chats.chat_id", onupdate="CASCADE", ondelete="CASCADE"),
         nullable=False,
     )
 
     user = Column(
-        Integer,
+        BigInteger,
         ForeignKey("users.user_id", onupdate="CASCADE", ondelete="CASCADE"),
         nullable=False,
     )
     
-    __table_args__ = (UniqueConstraint("chat", "user", name="chat_member_uc"),)
+    # the unique constraint doubles as the (chat, user) index, the user one keeps the cascades from users cheap
+    __table_args__ = (
+        UniqueConstraint("chat", "user", name="chat_member_uc"),
+        Index("ix_chat_members_user", "user"),
+    )
 
     def __init__(self, chat, user):
         self.chat = chat
@@ -70,11 +89,6 @@ class ChatMembers(BASE):
             self.chat.chat_id,
         )
 
-def create_tables():
-    Users.__table__.create(bind=ENGINE, checkfirst=True)
-    Chats.__table__.create(bind=ENGINE, checkfirst=True)
-    ChatMembers.__table__.create(bind=ENGINE, checkfirst=True)
-
 # These functions below require a re-entry lock (RLock) because they are directly editing
 # information in the database tables
 
@@ -99,9 +113,9 @@ def update_user(user_id, username, chat_id=None, chat_name=None):
             SESSION.commit()
             return
         
-        chat = SESSION.query(Chats).get(str(chat_id))
+        chat = SESSION.query(Chats).get(int(chat_id))
         if not chat:
-            chat = Chats(str(chat_id), chat_name)
+            chat = Chats(int(chat_id), chat_name)
             SESSION.add(chat)
             SESSION.flush()
         else:
@@ -119,6 +133,100 @@ def update_user(user_id, username, chat_id=None, chat_name=None):
         
         SESSION.commit()
 
+def queue_user_update(user_id, username, chat_id=None, chat_name=None) -> bool:
+    """
+    Remembers a user (and the chat they were seen in) so it can be written by the next flush.
+    Nothing is queued if the exact same details were already seen.
+    :return: True if something new was queued.
+    """
+    if not chat_id or not chat_name:
+        chat_id, chat_name = None, None
+    else:
+        chat_id = int(chat_id)
+
+    key = (user_id, username, chat_id, chat_name)
+    with PENDING_LOCK:
+        if key in SEEN_USERS:
+            SEEN_USERS.move_to_end(key)
+            return False
+
+        SEEN_USERS[key] = None
+        if len(SEEN_USERS) > SEEN_USERS_LIMIT:
+            SEEN_USERS.popitem(last=False)
+
+        PENDING_USERS[user_id] = username
+        if chat_id:
+            PENDING_CHATS[chat_id] = chat_name
+            PENDING_MEMBERS.add((chat_id, user_id))
+
+    return True
+
+def __dialect_insert(table):
+    # both dialects support ON CONFLICT, they just live in different modules
+    if ENGINE.dialect.name == "postgresql":
+        return postgresql.insert(table)
+
+    return sqlite.insert(table)
+
+def __chunks(rows):
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        yield rows[i:i + UPSERT_CHUNK_SIZE]
+
+def flush_user_updates() -> int:
+    """
+    Writes every queued user, chat and chat member with one multi-row upsert per table.
+    :return: The number of rows that were written.
+    """
+    global PENDING_USERS, PENDING_CHATS, PENDING_MEMBERS
+
+    with PENDING_LOCK:
+        users, chats, members = PENDING_USERS, PENDING_CHATS, PENDING_MEMBERS
+        PENDING_USERS, PENDING_CHATS, PENDING_MEMBERS = {}, {}, set()
+
+    if not (users or chats or members):
+        return 0
+
+    user_rows = [{"user_id": user_id, "username": username} for user_id, username in users.items()]
+    chat_rows = [{"chat_id": chat_id, "chat_name": chat_name} for chat_id, chat_name in chats.items()]
+    member_rows = [{"chat": chat_id, "user": user_id} for chat_id, user_id in members]
+
+    with INSERTION_LOCK:
+        try:
+            for rows in __chunks(user_rows):
+                statement = __dialect_insert(Users).values(rows)
+                SESSION.execute(statement.on_conflict_do_update(
+                    index_elements=[Users.user_id],
+                    set_={"username": statement.excluded.username},
+                ))
+
+            for rows in __chunks(chat_rows):
+                statement = __dialect_insert(Chats).values(rows)
+                SESSION.execute(statement.on_conflict_do_update(
+                    index_elements=[Chats.chat_id],
+                    set_={"chat_name": statement.excluded.chat_name},
+                ))
+
+            for rows in __chunks(member_rows):
+                statement = __dialect_insert(ChatMembers).values(rows)
+                SESSION.execute(statement.on_conflict_do_nothing(
+                    index_elements=[ChatMembers.chat, ChatMembers.user],
+                ))
+
+            SESSION.commit()
+        except Exception:
+            SESSION.rollback()
+
+            # put everything back so the next flush tries again, newer values win
+            with PENDING_LOCK:
+                PENDING_USERS = {**users, **PENDING_USERS}
+                PENDING_CHATS = {**chats, **PENDING_CHATS}
+                PENDING_MEMBERS |= members
+            raise
+        finally:
+            SESSION.close()
+
+    return len(user_rows) + len(chat_rows) + len(member_rows)
+
 # These functions below do not require a re-entry insertion lock because they are only querying
 # specific tables for information
 
@@ -144,7 +252,7 @@ def get_userid_by_name(username):
 
 def get_chat_members(chat_id):
     try:
-        return SESSION.query(ChatMembers).filter(ChatMembers.chat == str(chat_id)).all()
+        return SESSION.query(ChatMembers).filter(ChatMembers.chat == int(chat_id)).all()
     finally:
         SESSION.close()
 
@@ -160,6 +268,34 @@ def get_all_users():
     finally:
         SESSION.close()
 
+def get_chat_ids_after(chat_id=None, limit=500):
+    # keyset paging so callers can walk every chat without loading them all at once
+    try:
+        query = SESSION.query(Chats.chat_id).order_by(Chats.chat_id)
+        if chat_id is not None:
+            query = query.filter(Chats.chat_id > int(chat_id))
+        return [row.chat_id for row in query.limit(limit)]
+    finally:
+        SESSION.close()
+
+def get_chats_after(chat_id=None, limit=500):
+    try:
+        query = SESSION.query(Chats.chat_id, Chats.chat_name).order_by(Chats.chat_id)
+        if chat_id is not None:
+            query = query.filter(Chats.chat_id > int(chat_id))
+        return [(row.chat_id, row.chat_name) for row in query.limit(limit)]
+    finally:
+        SESSION.close()
+
+def get_user_ids_after(user_id=None, limit=500):
+    try:
+        query = SESSION.query(Users.user_id).order_by(Users.user_id)
+        if user_id is not None:
+            query = query.filter(Users.user_id > int(user_id))
+        return [row.user_id for row in query.limit(limit)]
+    finally:
+        SESSION.close()
+
 def get_num_chats():
     try:
         return SESSION.query(Chats).count()
@@ -173,19 +309,27 @@ def get_num_users():
         SESSION.close()
 
 def migrate_chat(old_chat_id, new_chat_id):
+    with PENDING_LOCK:
+        # anything still queued for the old chat belongs to the new one now
+        if int(old_chat_id) in PENDING_CHATS:
+            PENDING_CHATS[int(new_chat_id)] = PENDING_CHATS.pop(int(old_chat_id))
+        for chat_id, user_id in [member for member in PENDING_MEMBERS if member[0] == int(old_chat_id)]:
+            PENDING_MEMBERS.discard((chat_id, user_id))
+            PENDING_MEMBERS.add((int(new_chat_id), user_id))
+
     with INSERTION_LOCK:
-        chat = SESSION.query(Chats).get(str(old_chat_id))
+        chat = SESSION.query(Chats).get(int(old_chat_id))
         if chat:
-            chat.chat_id = str(new_chat_id)
+            chat.chat_id = int(new_chat_id)
         SESSION.commit()
 
         chat_members = (
             SESSION.query(ChatMembers)
-            .filter(ChatMembers.chat == str(old_chat_id))
+            .filter(ChatMembers.chat == int(old_chat_id))
             .all()
         )
         for member in chat_members:
-            member.chat = str(new_chat_id)
+            member.chat = int(new_chat_id)
         SESSION.commit()
 
-create_tables()
\ No newline at end of file
+aio = AsyncSQL(sys.modules[__name__])
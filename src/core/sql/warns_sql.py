@@ -1,19 +1,30 @@
 import threading
-from sqlalchemy import Boolean, Column, Integer, String, UnicodeText, distinct, func 
+import sys
+import time
+from collections import OrderedDict
+from sqlalchemy import BigInteger, Boolean, Column, Index, Integer, UnicodeText, distinct, func 
 from sqlalchemy.dialects import postgresql
 
-from src.core.sql import SESSION, BASE, engine as ENGINE 
+from src.core.sql import SESSION, BASE, AsyncSQL, invalidate_chat_settings, on_schema_ready
+from src.utils.string_handling import KeywordMatcher
 
-# this is a bad practice however is my only viable option at the moment for 
-# sake of simplicity.
-WARN_REASONS = {}
-WARN_FILTER_TRIGGERS = {}
+WARN_HISTORY_RETENTION = 365 * 24 * 60 * 60 # seconds a warn reason is kept for
+RECENT_WARNS_SIZE = 5000 # users whose warn reasons are kept in memory
+
+# (chat_id, user_id) -> reasons of the user's current warns, oldest first, for the users warned most recently
+RECENT_WARNS = OrderedDict()
+# chat_id -> {keyword: reply}, loaded at startup and kept in step with the database by add/remove_warn_filter
+CHAT_WARN_FILTERS = {}
+# compiled matcher for each chat -> dropped whenever that chat's warn filters change
+CHAT_WARN_MATCHERS = {}
 
 class Warns(BASE):
     __tablename__ = "warns"
+    # the primary key leads with the user, chat wide lookups and migrations go through this one
+    __table_args__ = (Index("ix_warns_chat_user", "chat_id", "user_id"),)
 
-    user_id = Column(Integer, primary_key=True)
-    chat_id = Column(String(14), primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     num_warns = Column(Integer, default=0)
 
     def __init__(self, user_id, chat_id):
@@ -30,12 +41,12 @@ class Warns(BASE):
 class WarnFilters(BASE):
     __tablename__ = "warn_filters"
 
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     keyword = Column(UnicodeText, primary_key=True)
     reply = Column(UnicodeText)
 
     def __init__(self, chat_id, keyword):
-        self.chat_id = str(chat_id) # ensure it is a string
+        self.chat_id = int(chat_id) # ensure it is an integer
         self.keyword = keyword 
     
     def __repr__(self):
@@ -48,173 +59,258 @@ class WarnFilters(BASE):
             and self.keyword == other.keyword
         )
     
+class WarnHistory(BASE):
+    __tablename__ = "warn_history"
+    __table_args__ = (
+        Index("ix_warn_history_chat_user_created", "chat_id", "user_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    reason = Column(UnicodeText)
+    created_at = Column(Integer, nullable=False) # unix time
+
+    def __init__(self, chat_id, user_id, reason=None):
+        self.chat_id = int(chat_id)
+        self.user_id = user_id
+        self.reason = reason
+        self.created_at = int(time.time())
+
+    def __repr__(self):
+        return "<Warn for {} in {}: {}>".format(self.user_id, self.chat_id, self.reason)
+
+
 class WarnSettings(BASE):
     __tablename__ = "warn_settings"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     warn_limit = Column(Integer, default=3)
     soft_warn = Column(Boolean, default=False)
 
     def __init__(self, chat_id, warn_limit=3, soft_warn=False):
-        self.chat_id = str(chat_id)
+        self.chat_id = int(chat_id)
         self.warn_limit = warn_limit
         self.soft_warn = soft_warn
 
     def __repr__(self):
         return "<{} has {} possible warns.>".format(self.chat_id, self.warn_limit)
 
-def create_tables():
-    Warns.__table__.create(bind=ENGINE, checkfirst=True)
-    WarnFilters.__table__.create(bind=ENGINE, checkfirst=True)
-    WarnSettings.__table__.create(bind=ENGINE, checkfirst=True)
-
 WARN_INSERTION_LOCK = threading.RLock()
 WARN_FILTER_INSERTION_LOCK = threading.RLock()
 WARN_SETTINGS_INSERTION_LOCK = threading.RLock()
 
+def _remember_warns(user_id, chat_id, reasons):
+    key = (int(chat_id), user_id)
+    RECENT_WARNS[key] = reasons
+    RECENT_WARNS.move_to_end(key)
+    while len(RECENT_WARNS) > RECENT_WARNS_SIZE:
+        RECENT_WARNS.popitem(last=False)
+
+def _warn_history_query(user_id, chat_id):
+    return SESSION.query(WarnHistory).filter(
+        WarnHistory.chat_id == int(chat_id),
+        WarnHistory.user_id == user_id,
+    )
+
+def _get_warn_reasons(user_id, chat_id):
+    # the reasons of a user's current warns, from memory when they were warned recently
+    reasons = RECENT_WARNS.get((int(chat_id), user_id))
+    if reasons is None:
+        reasons = [
+            warn.reason for warn in
+            _warn_history_query(user_id, chat_id).order_by(WarnHistory.created_at, WarnHistory.id).all()
+        ]
+    _remember_warns(user_id, chat_id, reasons)
+    return reasons
+
 def warn_user(user_id, chat_id, reason=None):
     with WARN_INSERTION_LOCK:
-        warned_user = SESSION.query(Warns).get((user_id, str(chat_id)))
-        if not warned_user:
-            warned_user = Warns(user_id, str(chat_id))
-        
-        warned_user.num_warns += 1
-        
-        warn_reasons = WARN_REASONS.get(str(chat_id))
-        if warn_reasons:
-            if str(user_id) in warn_reasons.keys():
-                warn_reasons[str(user_id)].append(reason)
-            else:
-                warn_reasons[str(user_id)] = [reason]
-        else:
-            WARN_REASONS[str(chat_id)] = {str(user_id): [reason]}
-
-        
-        reasons = WARN_REASONS.get(str(chat_id))[str(user_id)]
-        num_warns = warned_user.num_warns
-
-        SESSION.merge(warned_user)
-        SESSION.commit()
+        try:
+            warned_user = SESSION.query(Warns).get((user_id, int(chat_id)))
+            if not warned_user:
+                warned_user = Warns(user_id, int(chat_id))
+            
+            warned_user.num_warns += 1
+            num_warns = warned_user.num_warns
+
+            reasons = _get_warn_reasons(user_id, chat_id) + [reason]
+
+            SESSION.merge(warned_user)
+            SESSION.add(WarnHistory(chat_id, user_id, reason))
+            SESSION.commit()
+            _remember_warns(user_id, chat_id, reasons)
 
-        return num_warns, reasons
+            return num_warns, reasons
+        finally:
+            SESSION.close()
  
 def remove_warn(user_id, chat_id):
     with WARN_INSERTION_LOCK:
-        removed = False
-        warned_user = SESSION.query(Warns).get((user_id, str(chat_id)))
+        try:
+            removed = False
+            warned_user = SESSION.query(Warns).get((user_id, int(chat_id)))
+
+            if warned_user and warned_user.num_warns > 0:
+                warned_user.num_warns -= 1
+                removed = True
+
+                # the newest warn is the one taken back
+                latest = (
+                    _warn_history_query(user_id, chat_id)
+                    .order_by(WarnHistory.created_at.desc(), WarnHistory.id.desc())
+                    .first()
+                )
+                if latest:
+                    SESSION.delete(latest)
 
-        if warned_user and warned_user.num_warns > 0:
-            warned_user.num_warns -= 1
+                SESSION.add(warned_user)
+                SESSION.commit()
 
-            SESSION.add(warned_user)
-            SESSION.commit()
+                reasons = RECENT_WARNS.get((int(chat_id), user_id))
+                if reasons:
+                    _remember_warns(user_id, chat_id, reasons[:-1])
 
-        warn_reasons = WARN_REASONS.get(str(chat_id))
-        if warn_reasons:
-            warn_reasons[str(user_id)] = (warn_reasons[str(user_id)])[:-1]
-
-        removed = True
-        
-        SESSION.close()
-        return removed
+            return removed
+        finally:
+            SESSION.close()
 
 def reset_warns(user_id, chat_id):
     with WARN_INSERTION_LOCK:
-        warned_user = SESSION.query(Warns).get((user_id, str(chat_id)))
+        try:
+            warned_user = SESSION.query(Warns).get((user_id, int(chat_id)))
 
-        if warned_user:
-            warned_user.num_warns = 0
+            if warned_user:
+                warned_user.num_warns = 0
+                SESSION.add(warned_user)
 
-            SESSION.add(warned_user)
+            _warn_history_query(user_id, chat_id).delete()
             SESSION.commit()
-        
-        warn_reasons = WARN_REASONS.get(str(chat_id))
-        if warn_reasons:
-            warn_reasons[str(user_id)] = []
-        
-        SESSION.close()
+            RECENT_WARNS.pop((int(chat_id), user_id), None)
+        finally:
+            SESSION.close()
        
-def get_warns(user_id, chat_id):
+def get_warns(user_id, chat_id, offset=0, limit=None):
+    """
+    Returns how many warns a user has and the reasons for them, newest first.
+    :param user_id: The warned user.
+    :param chat_id: The chat they were warned in.
+    :param offset: How many of the newest reasons to skip.
+    :param limit: The most reasons to return, all of them if not given.
+    :return: The number of warns and the page of reasons, or None if the user has never been warned.
+    """
     try:
-        user = SESSION.query(Warns).get((user_id, str(chat_id)))
+        user = SESSION.query(Warns).get((user_id, int(chat_id)))
         if not user:
             return None
-        
-        warn_reasons = WARN_REASONS.get(str(chat_id))
-        if warn_reasons:
-            reasons = WARN_REASONS.get(str(chat_id))[str(user_id)]
-        else:
-            reasons = None
-
-        num_warns = user.num_warns
 
-        return num_warns, reasons
+        reasons = RECENT_WARNS.get((int(chat_id), user_id))
+        if reasons is not None:
+            newest_first = reasons[::-1]
+            reasons = newest_first[offset:] if limit is None else newest_first[offset:offset + limit]
+        else:
+            # paged straight off the (chat_id, user_id, created_at) index
+            query = (
+                _warn_history_query(user_id, chat_id)
+                .order_by(WarnHistory.created_at.desc(), WarnHistory.id.desc())
+                .offset(offset)
+            )
+            if limit is not None:
+                query = query.limit(limit)
+            reasons = [warn.reason for warn in query.all()]
+
+        return user.num_warns, reasons
     finally:
         SESSION.close()
 
+def purge_warn_history(max_age=WARN_HISTORY_RETENTION):
+    # reasons older than the retention period are dropped, the warn counts stay as they are
+    with WARN_INSERTION_LOCK:
+        try:
+            purged = (
+                SESSION.query(WarnHistory)
+                .filter(WarnHistory.created_at < int(time.time() - max_age))
+                .delete()
+            )
+            SESSION.commit()
+            if purged:
+                RECENT_WARNS.clear()
+            return purged
+        finally:
+            SESSION.close()
+
         
 def add_warn_filter(chat_id, keyword, reply=None):
     with WARN_FILTER_INSERTION_LOCK:
-        warn_filter = WarnFilters(str(chat_id), keyword)
+        warn_filter = WarnFilters(int(chat_id), keyword)
         warn_filter.reply = reply
 
         SESSION.merge(warn_filter)
         SESSION.commit()
 
-        warn_filter_triggers = WARN_FILTER_TRIGGERS.get(str(chat_id))
-
-        if warn_filter_triggers:
-            warn_filter_triggers.append(keyword)
-        else:
-            WARN_FILTER_TRIGGERS[str(chat_id)] = [keyword]
+        CHAT_WARN_FILTERS.setdefault(int(chat_id), {})[keyword] = reply
+        CHAT_WARN_MATCHERS.pop(int(chat_id), None)
+        invalidate_chat_settings(chat_id)
 
 
 def remove_warn_filter(chat_id, keyword):
     with WARN_FILTER_INSERTION_LOCK:
-        warn_filter = SESSION.query(WarnFilters).get((str(chat_id), keyword))
+        warn_filter = SESSION.query(WarnFilters).get((int(chat_id), keyword))
         if warn_filter:
             SESSION.delete(warn_filter)
             SESSION.commit()
 
-            warn_filter_triggers = WARN_FILTER_TRIGGERS.get(str(chat_id))
-            if warn_filter_triggers:
-                warn_filter_triggers[str(chat_id)] = (
-                    trigger.delete() for trigger 
-                    in warn_filter_triggers[str(chat_id)] 
-                    if trigger == keyword
-                )
+            chat_filters = CHAT_WARN_FILTERS.get(int(chat_id), {})
+            chat_filters.pop(keyword, None)
+            if not chat_filters:
+                CHAT_WARN_FILTERS.pop(int(chat_id), None)
 
+            CHAT_WARN_MATCHERS.pop(int(chat_id), None)
+            invalidate_chat_settings(chat_id)
             return True 
         SESSION.close()
         return False 
     
 def get_chat_warn_triggers(chat_id):
-    try:
-        if WARN_FILTER_TRIGGERS.get(str(chat_id)):
-            return WARN_FILTER_TRIGGERS[str(chat_id)]
-        else:
-            return None
-    finally:
-        SESSION.close()
+    # the setters change the per chat dict from other threads, so it's copied under their lock
+    with WARN_FILTER_INSERTION_LOCK:
+        chat_filters = list(CHAT_WARN_FILTERS.get(int(chat_id), {}))
+    if chat_filters:
+        return sorted(chat_filters)
+    else:
+        return None
+
+def get_chat_warn_matcher(chat_id):
+    # built from memory, only after add_warn_filter/remove_warn_filter has changed this chat's filters
+    matcher = CHAT_WARN_MATCHERS.get(int(chat_id))
+    if matcher is not None:
+        return matcher
+
+    # the filters are read and the matcher stored under the setters' lock, so a filter added in between
+    # can neither change the dict while it's being read nor be missed by the matcher that gets cached
+    with WARN_FILTER_INSERTION_LOCK:
+        matcher = CHAT_WARN_MATCHERS.get(int(chat_id))
+        if matcher is None:
+            matcher = KeywordMatcher(list(CHAT_WARN_FILTERS.get(int(chat_id), {})))
+            CHAT_WARN_MATCHERS[int(chat_id)] = matcher
+
+    return matcher
 
 def get_chat_warn_filters(chat_id):
     try:
         return (
-            SESSION.query(WarnFilters).filter(WarnFilters.chat_id == str(chat_id)).all()
+            SESSION.query(WarnFilters).filter(WarnFilters.chat_id == int(chat_id)).all()
         )
     finally:
         SESSION.close()
 
-def get_warn_filter(chat_id, keyword):
-    try:
-        return SESSION.query(WarnFilters).get((str(chat_id), keyword))
-    finally:
-        SESSION.close()
+def get_warn_filter_reply(chat_id, keyword):
+    return CHAT_WARN_FILTERS.get(int(chat_id), {}).get(keyword)
 
 def set_warn_limit(chat_id, warn_limit):
     with WARN_SETTINGS_INSERTION_LOCK:
-        current_setting = SESSION.query(WarnSettings).get(str(chat_id))
+        current_setting = SESSION.query(WarnSettings).get(int(chat_id))
         if not current_setting:
-            current_setting = WarnSettings(str(chat_id), warn_limit=warn_limit)
+            current_setting = WarnSettings(int(chat_id), warn_limit=warn_limit)
 
         current_setting.warn_limit = warn_limit
         SESSION.merge(current_setting)
@@ -222,9 +318,9 @@ def set_warn_limit(chat_id, warn_limit):
 
 def set_warn_severity(chat_id, soft_warn):
     with WARN_SETTINGS_INSERTION_LOCK:
-        current_setting = SESSION.query(WarnSettings).get(str(chat_id))
+        current_setting = SESSION.query(WarnSettings).get(int(chat_id))
         if not current_setting:
-            current_setting = WarnSettings(str(chat_id), soft_warn=soft_warn)
+            current_setting = WarnSettings(int(chat_id), soft_warn=soft_warn)
 
         current_setting.soft_warn = soft_warn
         SESSION.add(current_setting) # work on updating instead
@@ -232,7 +328,7 @@ def set_warn_severity(chat_id, soft_warn):
 
 def get_warn_setting(chat_id):
     try:
-        setting = SESSION.query(WarnSettings).get(str(chat_id))
+        setting = SESSION.query(WarnSettings).get(int(chat_id))
         if setting:
             return setting.warn_limit, setting.soft_warn
         else:
@@ -262,7 +358,7 @@ def num_warn_chat_filters(chat_id):
     try:
         return (
             SESSION.query(WarnFilters.chat_id)
-            .filter(WarnFilters.chat_id == str(chat_id))
+            .filter(WarnFilters.chat_id == int(chat_id))
             .count()
         )
     finally:
@@ -277,30 +373,54 @@ def num_warn_filter_chats():
 def migrate_chat(old_chat_id, new_chat_id):
     with WARN_INSERTION_LOCK:
         chat_notes = (
-            SESSION.query(Warns).filter(Warns.chat_id == str(old_chat_id)) 
+            SESSION.query(Warns).filter(Warns.chat_id == int(old_chat_id)) 
         )
         for note in chat_notes:
-            note.chat_id == str(new_chat_id)
+            note.chat_id = int(new_chat_id)
+
+        SESSION.query(WarnHistory).filter(
+            WarnHistory.chat_id == int(old_chat_id)
+        ).update({WarnHistory.chat_id: int(new_chat_id)})
         SESSION.commit()
+
+        for key in [key for key in RECENT_WARNS if key[0] == int(old_chat_id)]:
+            RECENT_WARNS.pop(key)
     
     with WARN_FILTER_INSERTION_LOCK:
         chat_filters = (
             SESSION.query(WarnFilters)
-            .filter(WarnFilters.chat_id == str(old_chat_id))
+            .filter(WarnFilters.chat_id == int(old_chat_id))
             .all()
         )
         for filter in chat_filters:
-            filter.chat_id = str(new_chat_id)
+            filter.chat_id = int(new_chat_id)
         SESSION.commit()
+
+        if int(old_chat_id) in CHAT_WARN_FILTERS:
+            CHAT_WARN_FILTERS[int(new_chat_id)] = CHAT_WARN_FILTERS.pop(int(old_chat_id))
+        CHAT_WARN_MATCHERS.pop(int(old_chat_id), None)
+        CHAT_WARN_MATCHERS.pop(int(new_chat_id), None)
     
     with WARN_SETTINGS_INSERTION_LOCK:
         chat_settings = (
             SESSION.query(WarnSettings)
-            .filter(WarnSettings.chat_id == str(old_chat_id))
+            .filter(WarnSettings.chat_id == int(old_chat_id))
             .all()
         )
         for setting in chat_settings:
-            setting.chat_id = str(new_chat_id)
+            setting.chat_id = int(new_chat_id)
         SESSION.commit()
+        invalidate_chat_settings(old_chat_id, new_chat_id)
+
+def __load_chat_warn_filters():
+    global CHAT_WARN_FILTERS
+    try:
+        CHAT_WARN_FILTERS = {}
+        for warn_filter in SESSION.query(WarnFilters).all():
+            CHAT_WARN_FILTERS.setdefault(warn_filter.chat_id, {})[warn_filter.keyword] = warn_filter.reply
+    finally:
+        SESSION.close()
+
+on_schema_ready(__load_chat_warn_filters)
 
-create_tables()
\ No newline at end of file
+aio = AsyncSQL(sys.modules[__name__])
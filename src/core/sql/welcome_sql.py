@@ -1,10 +1,11 @@
 import threading 
+import sys
 import random
 from typing import Union
 
-from sqlalchemy import BigInteger, Boolean, Column, Integer, String, UnicodeText
+from sqlalchemy import BigInteger, Boolean, Column, Index, Integer, UnicodeText
 
-from src.core.sql import BASE, SESSION, engine as ENGINE
+from src.core.sql import BASE, SESSION, AsyncSQL, invalidate_chat_settings, on_schema_ready
 from src.utils.msg_types import SendTypes
 
 
@@ -155,7 +156,7 @@ DEFAULT_GOODBYE_MESSAGES = [
 
 class Welcome(BASE):
     __tablename__ = "welcome_pref"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     should_welcome = Column(Boolean, default=True)
     should_goodbye = Column(Boolean, default=True)
     custom_content = Column(UnicodeText, default=None)
@@ -172,7 +173,7 @@ class Welcome(BASE):
     clean_goodbye = Column(BigInteger)
 
     def __init__(self, chat_id, should_welcome=True, should_goodbye=True):
-        self.chat_id = str(chat_id)
+        self.chat_id = int(chat_id)
         self.should_welcome = should_welcome
         self.should_goodbye = should_goodbye
 
@@ -183,74 +184,108 @@ class Welcome(BASE):
 
 class WelcomeButtons(BASE):
     __tablename__ = "welcome_urls"
+    __table_args__ = (Index("ix_welcome_urls_chat", "chat_id"),) # buttons are always read for a whole chat
     id = Column(Integer, primary_key=True)
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     name = Column(UnicodeText, nullable=False)
     url = Column(UnicodeText, nullable=False)
     same_line = Column(Boolean, default=False)
 
 class GoodbyeButtons(BASE):
     __tablename__ = "leave_urls"
+    __table_args__ = (Index("ix_leave_urls_chat", "chat_id"),) # buttons are always read for a whole chat
     id = Column(Integer, primary_key=True)
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     name = Column(UnicodeText, nullable=False)
     same_line = Column(Boolean, default=False)
 
     def __init__(self, chat_id, name, url, same_line=False):
-        self.chat_id = str(chat_id)
+        self.chat_id = int(chat_id)
         self.name = name
         self.url = url 
         self.same_line = same_line
 
 class WelcomeMute(BASE):
     __tablename__ = "welcome_mutes"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     welcomemutes = Column(UnicodeText, default=False)
 
     def __init__(self, chat_id, welcomemutes):
-        self.chat_id = str(chat_id)
+        self.chat_id = int(chat_id)
         self.welcomemutes = welcomemutes
 
 class WelcomeMuteUsers(BASE):
     __tablename__ = "human_checks"
-    user_id = Column(Integer, primary_key=True)
-    chat_id = Column(String(14), primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     human_check = Column(Boolean)
 
     def __init__(self, user_id, chat_id, human_check):
         self.user_id = user_id
-        self.chat_id = str(chat_id) # ensure a string 
+        self.chat_id = int(chat_id) # ensure an integer
         self.human_check = human_check
 
 class CleanServiceSetting(BASE):
     __tablename__ = "clean_service"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
     clean_service = Column(Boolean, default=True)
 
     def __init__(self, chat_id, clean_service):
-        self.chat_id = str(chat_id) # ensure a string 
+        self.chat_id = int(chat_id) # ensure an integer
         self.clean_service = clean_service
     
     def __repr__(self):
         return "<Chat used clean service ({})>".format(self.chat_id)
 
-def create_tables():
-    Welcome.__table__.create(bind=ENGINE, checkfirst=True)
-    WelcomeButtons.__table__.create(bind=ENGINE, checkfirst=True)
-    GoodbyeButtons.__table__.create(bind=ENGINE, checkfirst=True)
-    WelcomeMute.__table__.create(bind=ENGINE, checkfirst=True)
-    WelcomeMuteUsers.__table__.create(bind=ENGINE, checkfirst=True)
-    CleanServiceSetting.__table__.create(bind=ENGINE, checkfirst=True)
+class PendingVerification(BASE):
+    __tablename__ = "pending_verifications"
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    mode = Column(UnicodeText, nullable=False) # the welcome mute the check was sent for, strong or captcha
+    answer = Column(Integer) # the correct captcha answer
+    message_id = Column(BigInteger) # the check message, cleaned up when the check expires
+    should_welcome = Column(Boolean, default=False)
+    welcome_text = Column(UnicodeText) # sent once the member has proved they're human
+    expires_at = Column(Integer, nullable=False) # unix time
+
+    def __init__(self, chat_id, user_id, mode, expires_at, answer=None, should_welcome=False, welcome_text=None):
+        self.chat_id = int(chat_id)
+        self.user_id = int(user_id)
+        self.mode = mode
+        self.expires_at = int(expires_at)
+        self.answer = answer
+        self.message_id = None
+        self.should_welcome = should_welcome
+        self.welcome_text = welcome_text
+
+    def __repr__(self):
+        return "<Pending {} check for {} in {}>".format(self.mode, self.user_id, self.chat_id)
+
+    def to_dict(self):
+        return {
+            "chat_id": self.chat_id,
+            "user_id": self.user_id,
+            "mode": self.mode,
+            "answer": self.answer,
+            "message_id": self.message_id,
+            "should_welcome": self.should_welcome,
+            "welcome_text": self.welcome_text,
+            "expires_at": self.expires_at,
+        }
 
 INSERTION_LOCK = threading.RLock()
 WELC_BTN_LOCK = threading.RLock()
 LEAVE_BTN_LOCK = threading.RLock()
 WM_LOCK = threading.RLock()
 CS_LOCK = threading.RLock()
+PENDING_LOCK = threading.RLock()
+
+# (chat_id, user_id) -> every verification that hasn't been answered or expired yet
+PENDING_VERIFICATIONS = {}
 
 def welcome_mutes(chat_id):
     try:
-        welcome_mutes = SESSION.query(WelcomeMute).get(str(chat_id))
+        welcome_mutes = SESSION.query(WelcomeMute).get(int(chat_id))
         if welcome_mutes:
             return welcome_mutes.welcomemutes
         return False
@@ -259,9 +294,9 @@ def welcome_mutes(chat_id):
 
 def set_clean_welcome(chat_id, clean_welcome):
     with INSERTION_LOCK:
-        curr = SESSION.query(Welcome).get(str(chat_id))
+        curr = SESSION.query(Welcome).get(int(chat_id))
         if not curr:
-            curr = Welcome(str(chat_id))
+            curr = Welcome(int(chat_id))
         
         curr.clean_welcome = int(clean_welcome)
         
@@ -270,9 +305,9 @@ def set_clean_welcome(chat_id, clean_welcome):
 
 def set_clean_goodbye(chat_id, clean_goodbye):
     with INSERTION_LOCK:
-        curr = SESSION.query(Welcome).get(str(chat_id))
+        curr = SESSION.query(Welcome).get(int(chat_id))
         if not curr:
-            curr = Welcome(str(chat_id))
+            curr = Welcome(int(chat_id))
         
         curr.clean_goodbye = clean_goodbye
 
@@ -281,20 +316,21 @@ def set_clean_goodbye(chat_id, clean_goodbye):
 
 def set_welcome_mutes(chat_id, welcomemutes):
     with WM_LOCK:
-        welcome_mute = SESSION.query(WelcomeMute).get((str(chat_id)))
+        welcome_mute = SESSION.query(WelcomeMute).get((int(chat_id)))
         if not welcome_mute:
-            welcome_mute = WelcomeMute(str(chat_id), welcomemutes)
+            welcome_mute = WelcomeMute(int(chat_id), welcomemutes)
         else:
             welcome_mute.welcomemutes = welcomemutes
                 
         SESSION.merge(welcome_mute)
         SESSION.commit()
+        invalidate_chat_settings(chat_id)
 
 def set_human_checks(user_id, chat_id):
     with INSERTION_LOCK:
-        human_check = SESSION.query(WelcomeMuteUsers).get((user_id, str(chat_id)))
+        human_check = SESSION.query(WelcomeMuteUsers).get((user_id, int(chat_id)))
         if not human_check:
-            human_check = WelcomeMuteUsers(user_id, str(chat_id), True)
+            human_check = WelcomeMuteUsers(user_id, int(chat_id), True)
         else:
             human_check.human_check = True
         
@@ -305,7 +341,7 @@ def set_human_checks(user_id, chat_id):
     
 def get_human_checks(user_id, chat_id):
     try:
-        human_check = SESSION.query(WelcomeMuteUsers).get((user_id, str(chat_id)))
+        human_check = SESSION.query(WelcomeMuteUsers).get((user_id, int(chat_id)))
         if not human_check:
             return None 
         human_check = human_check.human_check
@@ -315,17 +351,18 @@ def get_human_checks(user_id, chat_id):
 
 def set_welc_pref(chat_id, should_welcome):
     with INSERTION_LOCK:
-        welcome_pref = SESSION.query(Welcome).get(str(chat_id))
+        welcome_pref = SESSION.query(Welcome).get(int(chat_id))
         if not welcome_pref:
-            welcome_pref = Welcome(str(chat_id), should_welcome=should_welcome)
+            welcome_pref = Welcome(int(chat_id), should_welcome=should_welcome)
         else:
             welcome_pref.should_welcome = should_welcome
         
         SESSION.merge(welcome_pref)
         SESSION.commit()
+        invalidate_chat_settings(chat_id)
 
 def get_welc_pref(chat_id):
-    welcome_pref = SESSION.query(Welcome).get(str(chat_id))
+    welcome_pref = SESSION.query(Welcome).get(int(chat_id))
     SESSION.close()
 
     if welcome_pref:
@@ -343,7 +380,7 @@ def get_welc_buttons(chat_id):
     try:
         return (
             SESSION.query(WelcomeButtons)
-            .filter(WelcomeButtons.chat_id == str(chat_id))
+            .filter(WelcomeButtons.chat_id == int(chat_id))
             .order_by(WelcomeButtons.id)
             .all()
         )
@@ -352,17 +389,18 @@ def get_welc_buttons(chat_id):
 
 def set_gdbye_pref(chat_id, should_goodbye):
     with INSERTION_LOCK:
-        gdbye_pref = SESSION.query(Welcome).get(str(chat_id))
+        gdbye_pref = SESSION.query(Welcome).get(int(chat_id))
         if not gdbye_pref:
-            gdbye_pref = Welcome(str(chat_id), should_goodbye=should_goodbye)
+            gdbye_pref = Welcome(int(chat_id), should_goodbye=should_goodbye)
         else:
             gdbye_pref.should_goodbye = should_goodbye
         
         SESSION.merge(gdbye_pref)
         SESSION.commit()
+        invalidate_chat_settings(chat_id)
 
 def get_gdbye_pref(chat_id):
-    goodbye_pref = SESSION.query(Welcome).get(str(chat_id))
+    goodbye_pref = SESSION.query(Welcome).get(int(chat_id))
     SESSION.close()
     if goodbye_pref:
         return (
@@ -377,7 +415,7 @@ def get_gdbye_buttons(chat_id):
     try:
         return (
             SESSION.query(GoodbyeButtons)
-            .filter(GoodbyeButtons.chat_id == str(chat_id))
+            .filter(GoodbyeButtons.chat_id == int(chat_id))
             .order_by(GoodbyeButtons.id)
             .all()
         )
@@ -389,9 +427,9 @@ def set_custom_welcome(chat_id, custom_content, custom_welcome, welcome_type, bu
         buttons = []
     
     with INSERTION_LOCK:
-        welcome_settings = SESSION.query(Welcome).get(str(chat_id))
+        welcome_settings = SESSION.query(Welcome).get(int(chat_id))
         if not welcome_settings:
-            welcome_settings = Welcome(str(chat_id), True)
+            welcome_settings = Welcome(int(chat_id), True)
         
         if custom_welcome or custom_content:
             welcome_settings.custom_content = custom_content
@@ -406,7 +444,7 @@ def set_custom_welcome(chat_id, custom_content, custom_welcome, welcome_type, bu
         with WELC_BTN_LOCK:
             welcome_mutes_buttons = (
                 SESSION.query(WelcomeButtons)
-                .filter(WelcomeButtons.chat_id == str(chat_id))
+                .filter(WelcomeButtons.chat_id == int(chat_id))
                 .all()
             )
             for btn in welcome_mutes_buttons:
@@ -422,15 +460,16 @@ def set_custom_welcome(chat_id, custom_content, custom_welcome, welcome_type, bu
                 SESSION.merge(button)
         
         SESSION.commit()
+        invalidate_chat_settings(chat_id)
 
 def set_custom_goodbye(chat_id, custom_goodbye, goodbye_type, buttons=None):
     if buttons is None:
         buttons = []
     
     with INSERTION_LOCK:
-        welcome_settings = SESSION.query(Welcome).get(str(chat_id))
+        welcome_settings = SESSION.query(Welcome).get(int(chat_id))
         if not welcome_settings:
-            welcome_settings = Welcome(str(chat_id), True)
+            welcome_settings = Welcome(int(chat_id), True)
         
         if custom_goodbye:
             welcome_settings.custom_leave = custom_goodbye
@@ -445,7 +484,7 @@ def set_custom_goodbye(chat_id, custom_goodbye, goodbye_type, buttons=None):
         with LEAVE_BTN_LOCK:
             welcome_mutes_buttons = (
                 SESSION.query(GoodbyeButtons)
-                .filter(GoodbyeButtons.chat_id == str(chat_id))
+                .filter(GoodbyeButtons.chat_id == int(chat_id))
                 .all()
             )
             for btn in welcome_mutes_buttons:
@@ -458,9 +497,10 @@ def set_custom_goodbye(chat_id, custom_goodbye, goodbye_type, buttons=None):
                 SESSION.merge(button)
         
         SESSION.commit()
+        invalidate_chat_settings(chat_id)
 
 def get_clean_welcome_preference(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
+    welc = SESSION.query(Welcome).get(int(chat_id))
     SESSION.close()
 
     if welc:
@@ -469,7 +509,7 @@ def get_clean_welcome_preference(chat_id):
     return False
 
 def get_clean_goodbye_preference(chat_id):
-    goodbye = SESSION.query(Welcome).get(str(chat_id))
+    goodbye = SESSION.query(Welcome).get(int(chat_id))
     SESSION.close()
 
     if goodbye:
@@ -479,7 +519,7 @@ def get_clean_goodbye_preference(chat_id):
 
 def clean_service(chat_id: Union[int, str]):
     try:
-        chat_setting = SESSION.query(CleanServiceSetting).get(str(chat_id))
+        chat_setting = SESSION.query(CleanServiceSetting).get(int(chat_id))
         if chat_setting:
             return chat_setting.clean_service 
         return False
@@ -488,38 +528,106 @@ def clean_service(chat_id: Union[int, str]):
 
 def set_clean_service(chat_id: Union[int, str], setting: bool):
     with CS_LOCK:
-        chat_setting = SESSION.query(CleanServiceSetting).get((str(chat_id)))
+        chat_setting = SESSION.query(CleanServiceSetting).get((int(chat_id)))
         if not chat_setting:
-            chat_setting = CleanServiceSetting(str(chat_id), setting)
+            chat_setting = CleanServiceSetting(int(chat_id), setting)
         
         chat_setting.clean_service = setting
         SESSION.merge(chat_setting)
         SESSION.commit()
+        invalidate_chat_settings(chat_id)
+
+def add_pending_verification(chat_id, user_id, mode, expires_at, answer=None, should_welcome=False, welcome_text=None):
+    with PENDING_LOCK:
+        try:
+            pending = PendingVerification(chat_id, user_id, mode, expires_at, answer, should_welcome, welcome_text)
+            SESSION.merge(pending)
+            SESSION.commit()
+            PENDING_VERIFICATIONS[(int(chat_id), int(user_id))] = pending.to_dict()
+        finally:
+            SESSION.close()
+
+def set_pending_message(chat_id, user_id, message_id):
+    with PENDING_LOCK:
+        try:
+            pending = SESSION.query(PendingVerification).get((int(chat_id), int(user_id)))
+            if not pending:
+                return
+
+            pending.message_id = message_id
+            SESSION.commit()
+            PENDING_VERIFICATIONS[(int(chat_id), int(user_id))] = pending.to_dict()
+        finally:
+            SESSION.close()
+
+def get_pending_verification(chat_id, user_id):
+    # in memory, nothing to scan however many checks are waiting
+    return PENDING_VERIFICATIONS.get((int(chat_id), int(user_id)))
+
+def get_all_pending_verifications():
+    return list(PENDING_VERIFICATIONS.values())
+
+def remove_pending_verification(chat_id, user_id):
+    with PENDING_LOCK:
+        # whoever takes it out of memory first gets to handle it, an answer racing the timer is only handled once
+        pending = PENDING_VERIFICATIONS.pop((int(chat_id), int(user_id)), None)
+        try:
+            SESSION.query(PendingVerification).filter(
+                PendingVerification.chat_id == int(chat_id),
+                PendingVerification.user_id == int(user_id),
+            ).delete()
+            SESSION.commit()
+        finally:
+            SESSION.close()
+
+        return pending
 
 def migrate_chat(old_chat_id, new_chat_id):
     with INSERTION_LOCK:
-        chat = SESSION.query(Welcome).get(str(old_chat_id))
+        chat = SESSION.query(Welcome).get(int(old_chat_id))
         if chat:
-            chat.chat_id = str(new_chat_id)
+            chat.chat_id = int(new_chat_id)
 
         with WELC_BTN_LOCK:
             chat_buttons = (
                 SESSION.query(WelcomeButtons)
-                .filter(WelcomeButtons.chat_id == str(old_chat_id))
+                .filter(WelcomeButtons.chat_id == int(old_chat_id))
                 .all()
             )
             for btn in chat_buttons:
-                btn.chat_id = str(new_chat_id)
+                btn.chat_id = int(new_chat_id)
 
         with LEAVE_BTN_LOCK:
             chat_buttons = (
                 SESSION.query(GoodbyeButtons)
-                .filter(GoodbyeButtons.chat_id == str(old_chat_id))
+                .filter(GoodbyeButtons.chat_id == int(old_chat_id))
                 .all()
             )
             for btn in chat_buttons:
-                btn.chat_id = str(new_chat_id)
+                btn.chat_id = int(new_chat_id)
+
+        with PENDING_LOCK:
+            pending_checks = (
+                SESSION.query(PendingVerification)
+                .filter(PendingVerification.chat_id == int(old_chat_id))
+                .all()
+            )
+            for pending in pending_checks:
+                PENDING_VERIFICATIONS.pop((int(old_chat_id), pending.user_id), None)
+                pending.chat_id = int(new_chat_id)
+                PENDING_VERIFICATIONS[(int(new_chat_id), pending.user_id)] = pending.to_dict()
 
         SESSION.commit()
-        
-create_tables()
\ No newline at end of file
+        invalidate_chat_settings(old_chat_id, new_chat_id)
+
+def __load_pending_verifications():
+    global PENDING_VERIFICATIONS
+    try:
+        all_pending = SESSION.query(PendingVerification).all()
+        PENDING_VERIFICATIONS = {(pending.chat_id, pending.user_id): pending.to_dict() for pending in all_pending}
+    finally:
+        SESSION.close()
+
+on_schema_ready(__load_pending_verifications)
+
+aio = AsyncSQL(sys.modules[__name__])
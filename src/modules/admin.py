@@ -1,39 +1,37 @@
 import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
-from time import time
+from time import monotonic
 from telegram import Update, Chat, Message, ChatPermissions, Chat, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.helpers import mention_html
-from telegram.error import BadRequest, Forbidden
-from telegram.ext import CommandHandler, CallbackQueryHandler, filters, CallbackContext
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import CommandHandler, CallbackQueryHandler, ChatMemberHandler, filters, CallbackContext
 from src import dispatcher, DEV_ID
-from src.core.decorators.chat import can_promote, bot_is_admin, user_is_admin, can_invite, can_restrict_members, can_delete_messages, is_not_blacklisted
-from src.core.sql.users_sql import get_name_by_userid 
+from src.core.decorators.chat import can_promote, bot_is_admin, user_is_admin, can_invite, can_restrict_members, can_delete_messages, is_not_blacklisted, get_admin_roster, invalidate_admin_cache
+from src.core.sql import users_sql
 from src.utils.extraction import extract_user_and_reason, extract_user_only
 from src.utils.string_handling import time_formatter
 
-admins_in_chat = {}
+ADMIN_CACHE_GROUP = 2
 
-# List the admins within a group -> check and update/change every hour.
+PURGE_CHUNK_SIZE = 100 # the most deleteMessages accepts in one call
+PURGE_CONCURRENCY = 3
+PURGE_MAX_RETRIES = 5
+PURGE_PROGRESS_INTERVAL = 3 # seconds between progress edits
+
+# List the admins within a group -> served from the shared admin roster cache.
 async def list_admins(chat: Chat, chat_id: int):
-    """Provide a list of the current admins in the chat -> updated every hour"""
-    global admins_in_chat
-    if chat_id in admins_in_chat:
-        check_interval = time() - admins_in_chat[chat_id]["last_updated_at"]
-        if check_interval < 3600: # within an hour of last checking
-            return admins_in_chat[chat_id]["data"]
-    
-    admin_list = await chat.get_administrators()
+    """Provide a list of the current admins in the chat -> refreshed once the admin cache expires"""
+    return list(await get_admin_roster(chat))
+
+# Forget the cached admins of a chat whenever someone gains or loses admin status
+async def admin_status_changed(update: Update, context: CallbackContext) -> None:
+    member_update = update.chat_member or update.my_chat_member
+    admin_statuses = ("administrator", "creator")
 
-    admins_in_chat[chat_id] = {
-        "last_updated_at": time(),
-        "data": [
-            member.user.id
-            for member in admin_list
-        ],
-    }
-    return admins_in_chat[chat_id]["data"]
+    if member_update.old_chat_member.status in admin_statuses or member_update.new_chat_member.status in admin_statuses:
+        invalidate_admin_cache(member_update.chat.id)
 
 # Completely remove a user's administration rights so they are unable to manage at all
 @bot_is_admin
@@ -73,11 +71,13 @@ async def demote(update: Update, context: CallbackContext) -> None:
             "Unable to demote. Check if I have admin privileges."
         )
         return
+    
+    invalidate_admin_cache(message.chat.id)
 
     if message.reply_to_message:
         username = previous_message.from_user.name
     else:
-        username = get_name_by_userid(user_id)
+        username = await users_sql.aio.get_name_by_userid(user_id)
         username = f"@{username[0].username}" 
     
     # select the username column of the first selected item
@@ -111,7 +111,7 @@ async def promote(update: Update, context: CallbackContext) -> None: # This need
         await update.message.reply_text("I can't promote myself.") 
         return 
 
-    bot_member = await chat.get_member(BOT_ID)
+    bot_member = (await get_admin_roster(chat))[BOT_ID] # can_promote has already checked that the bot is an admin
 
     # Give the user the same permissions as the bot member -> equivalent of admin
     if args[0] == "fullpromote":
@@ -158,11 +158,13 @@ async def promote(update: Update, context: CallbackContext) -> None: # This need
             )
             return
 
+    invalidate_admin_cache(chat.id)
+
     # Get the username according to either a replied message or retrieving the name from user id
     if message.reply_to_message:
         username = previous_message.from_user.name
     else:
-        username = get_name_by_userid(user_id)
+        username = await users_sql.aio.get_name_by_userid(user_id)
         username = f"@{username[0].username}" 
     
     # Set reason for promote/fullpromote
@@ -184,6 +186,21 @@ async def promote(update: Update, context: CallbackContext) -> None: # This need
         parse_mode=ParseMode.HTML,
     )
 
+# Delete a chunk of up to 100 messages with a single deleteMessages call, waiting out any flood limits
+async def delete_message_chunk(bot, chat_id: int, message_ids: list, semaphore: asyncio.Semaphore) -> int:
+    async with semaphore:
+        for _ in range(PURGE_MAX_RETRIES):
+            try:
+                await bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+                # messages that can't be found are skipped by telegram, so this counts the ids processed, not deleted
+                return len(message_ids)
+            except RetryAfter as excp:
+                await asyncio.sleep(excp.retry_after)
+            except BadRequest:
+                return 0
+
+    return 0
+
 # Remove all messages from replied message to newest messages or if digit specified
 # then remove that many messages from replied message.
 @bot_is_admin
@@ -216,36 +233,48 @@ async def purge(update: Update, context: CallbackContext) -> None:
         purge_to = message.id 
 
     chat_id = message.chat.id
-    purged_ids = []  
-
-    # iterate from replied message to message to purge up to and delete
-    for message_id in range(replied_message.id, purge_to):
-        purged_ids.append(message_id)
-
-        # Delete messages whilst appending if reaches max Telegram limit of 100
-        if len(purged_ids) == 100:
-            for to_delete_id in purged_ids:
-                try:
-                    await bot.delete_message(
-                        chat_id=chat_id,
-                        message_id=int(to_delete_id),
-                    )
-                except BadRequest:
-                    pass
-
-            # Start again in order to delete more than 100 messages
-            purged_ids = []
-
-    # Delete any remaining messages
-    if len(purged_ids) > 0:
-        for to_delete_id in purged_ids:
+    message_ids = list(range(replied_message.id, purge_to))
+    chunks = [
+        message_ids[i:i + PURGE_CHUNK_SIZE]
+        for i in range(0, len(message_ids), PURGE_CHUNK_SIZE)
+    ]
+    if not chunks:
+        return
+
+    status_message = None
+    if len(chunks) > 1: # only show progress when there's more than a single request to make
+        status_message = await bot.send_message(chat_id, f"🧹 Purging {len(message_ids)} messages...")
+
+    semaphore = asyncio.Semaphore(PURGE_CONCURRENCY)
+    progress = {"done": 0, "last_update": 0.0}
+    start_time = monotonic()
+
+    async def purge_chunk(chunk):
+        deleted = await delete_message_chunk(bot, chat_id, chunk, semaphore)
+        progress["done"] += deleted
+
+        # editing the status costs an API call too, so don't do it more than every few seconds
+        now = monotonic()
+        if status_message and now - progress["last_update"] >= PURGE_PROGRESS_INTERVAL:
+            progress["last_update"] = now
             try:
-                await bot.delete_message(
-                    chat_id=chat_id,
-                    message_id=int(to_delete_id),
-                )  
-            except BadRequest:
-                pass 
+                await status_message.edit_text(f"🧹 Processed {progress['done']}/{len(message_ids)} messages...")
+            except TelegramError: # e.g. a flood limit, the progress is only cosmetic so skip it rather than abort the purge
+                pass
+
+    await asyncio.gather(*(purge_chunk(chunk) for chunk in chunks))
+
+    elapsed = monotonic() - start_time
+    rate = progress["done"] / elapsed if elapsed > 0 else progress["done"]
+    report = f"🧹 Processed {progress['done']} messages in {elapsed:.2f}s ({rate:.0f} msg/s)."
+
+    if status_message:
+        try:
+            await status_message.edit_text(report)
+        except TelegramError:
+            pass
+    else:
+        await bot.send_message(chat_id, report)
 
 # Delete a replied message
 @bot_is_admin
@@ -287,7 +316,7 @@ async def mute(update: Update, context: CallbackContext) -> None:
         return await update.message.reply_text(
             "It looks like you were trying to mute the developer of me, sorry you can't do that."
         )
-    if user_id in (await chat.get_administrators()):
+    if user_id in (await list_admins(chat, chat.id)):
         return await update.message.reply_text(
             "I'm unable to mute admins - I'm afraid it's just the rules."
         )
@@ -368,7 +397,6 @@ async def unmute(update: Update, context: CallbackContext) -> None:
         user_id,
         permissions= ChatPermissions(
             can_send_messages=True,
-            can_send_media_messages=True,
             can_send_polls=True,
             can_send_other_messages=True,
             can_add_web_page_previews=True,
@@ -411,7 +439,6 @@ async def unmute_callback(update: Update, context: CallbackContext) -> None:
         user_id,
         permissions= ChatPermissions(
             can_send_messages=True,
-            can_send_media_messages=True,
             can_send_polls=True,
             can_send_other_messages=True,
             can_add_web_page_previews=True,
@@ -746,6 +773,9 @@ DELETE_HANDLER = CommandHandler(
 INVITE_HANDLER = CommandHandler(
     "invite", invite, filters=~filters.ChatType.PRIVATE,
 )
+ADMIN_CACHE_HANDLER = ChatMemberHandler(
+    admin_status_changed, ChatMemberHandler.ANY_CHAT_MEMBER,
+)
 
 dispatcher.add_handler(BAN_HANDLER)
 dispatcher.add_handler(UNBAN_HANDLER)
@@ -757,4 +787,5 @@ dispatcher.add_handler(PURGE_HANDLER)
 dispatcher.add_handler(PROMOTE_HANDLER)
 dispatcher.add_handler(DEMOTE_HANDLER)
 dispatcher.add_handler(DELETE_HANDLER)
-dispatcher.add_handler(INVITE_HANDLER)
\ No newline at end of file
+dispatcher.add_handler(INVITE_HANDLER)
+dispatcher.add_handler(ADMIN_CACHE_HANDLER, group=ADMIN_CACHE_GROUP)
\ No newline at end of file
@@ -7,6 +7,7 @@ from typing import Optional
 from src import LOGGER, dispatcher
 from src.core.decorators.chat import bot_is_admin, user_is_admin, user_admin_check, is_not_blacklisted
 from src.core.sql import antiflood_sql
+from src.core.chat_context import current_chat_settings
 from src.utils.string_handling import time_formatter
 
 from telegram import Message, Chat, User, Update, ChatPermissions
@@ -50,12 +51,12 @@ async def check_flood(update: Update, context: CallbackContext) -> None:
         antiflood_sql.update_flood(chat.id, None)
         return 
     
-    should_ban = antiflood_sql.update_flood(chat.id, user.id)
+    should_ban = antiflood_sql.update_flood(chat.id, user.id) # counters are in memory, no need for the executor
     
     if not should_ban:
         return 
     try:
-        get_mode, get_value = antiflood_sql.get_flood_setting(chat.id)
+        get_mode, get_value = (await current_chat_settings(update, context))["flood"]
 
         if get_mode == 1: # specifies a user ban
             await chat.ban_member(user.id)
@@ -171,7 +172,7 @@ async def set_flood(update: Update, context: CallbackContext) -> None:
     if len(args) >= 1:
         toggle_value = args[0].lower()
         if toggle_value in ["off", "no", "0"]:
-            antiflood_sql.set_flood(chat_id, 0)
+            await antiflood_sql.aio.set_flood(chat_id, 0)
             await message.reply_text(
                 f"🚫🌊 Antiflood has been disabled in `{chat_name}` 🚫🌊",
                 parse_mode=ParseMode.MARKDOWN,
@@ -180,7 +181,7 @@ async def set_flood(update: Update, context: CallbackContext) -> None:
             limit = int(toggle_value)
 
             if limit <= 0:
-                antiflood_sql.set_flood(chat_id, 0)
+                await antiflood_sql.aio.set_flood(chat_id, 0)
                 await message.reply_text(f"Antiflood has been disabled in `{chat_name}`", parse_mode=ParseMode.MARKDOWN,)
 
                 return (
@@ -200,7 +201,7 @@ async def set_flood(update: Update, context: CallbackContext) -> None:
                 )
                 return 
             else:
-                antiflood_sql.set_flood(chat_id, limit)
+                await antiflood_sql.aio.set_flood(chat_id, limit)
 
                 await message.reply_text(
                     f"🌊 Antiflood has been set to `{limit}` in `{chat_name}`. 🌊",
@@ -239,7 +240,8 @@ async def getflood(update: Update, context: CallbackContext) -> None:
     chat_id = chat.id
     chat_name = message.chat.title 
 
-    severity, limit = antiflood_sql.get_flood_setting(chat_id)
+    severity, _ = await antiflood_sql.aio.get_flood_setting(chat_id)
+    limit = await antiflood_sql.aio.get_flood_limit(chat_id)
     severity_type = ""
 
     if severity == 1:
@@ -285,13 +287,13 @@ async def set_flood_mode(update: Update, context: CallbackContext):
     if args:
         if args[0].lower() == "ban":
             type_flood = "🚫 ban 🚫"
-            antiflood_sql.set_flood_severity(chat.id, 1, "0")
+            await antiflood_sql.aio.set_flood_severity(chat.id, 1, "0")
         elif args[0].lower() == "kick":
             type_flood = "⚠️ kick ⚠️"
-            antiflood_sql.set_flood_severity(chat.id, 2, "0")
+            await antiflood_sql.aio.set_flood_severity(chat.id, 2, "0")
         elif args[0].lower() == "mute":
             type_flood = "🔇 mute 🔇"
-            antiflood_sql.set_flood_severity(chat.id, 3, "0")
+            await antiflood_sql.aio.set_flood_severity(chat.id, 3, "0")
         elif args[0].lower() == "tban":
             if len(args) == 1: # no time specified
                 await context.bot.send_message(
@@ -302,7 +304,7 @@ Examples of time values: 5m = 5 minutes, 6h = 6 hours, 3d = 3 days.""",
                 )
                 return 
             type_flood= f"⌚🚫 temp ban for {str(args[1])} ⌚🚫"
-            antiflood_sql.set_flood_severity(chat.id, 4, str(args[1]))
+            await antiflood_sql.aio.set_flood_severity(chat.id, 4, str(args[1]))
         elif args[0].lower() == "tmute":
             if len(args) == 1: # no time specified
                 await context.bot.send_message(
@@ -313,7 +315,7 @@ Examples of time values: 5m = 5 minutes, 6h = 6 hours, 3d = 3 days.""",
                 )
                 return
             type_flood = f"⌚🔇 temp mute for {str(args[1])} ⌚🔇"
-            antiflood_sql.set_flood_severity(chat.id, 5, str(args[1]))
+            await antiflood_sql.aio.set_flood_severity(chat.id, 5, str(args[1]))
         else:
             await context.bot.send_message(
                 chat_id,
@@ -337,7 +339,7 @@ Examples of time values: 5m = 5 minutes, 6h = 6 hours, 3d = 3 days.""",
             )
         ) 
     else:
-        get_mode, get_value = antiflood_sql.get_flood_setting(chat_id)
+        get_mode, get_value = await antiflood_sql.aio.get_flood_setting(chat_id)
         if get_mode == 1:
             type_flood = "🚫 ban 🚫"
         elif get_mode == 2:
@@ -1,6 +1,5 @@
 import html
 import asyncio
-import re
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -11,6 +10,7 @@ from telegram.helpers import mention_html
 from telegram.constants import ParseMode
 
 import src.core.sql.blacklist_sql as blacklist_sql
+from src.core.chat_context import current_chat_settings
 from src import dispatcher, LOGGER
 from src.modules.warns import warn
 from src.core.decorators.chat import user_is_admin, user_is_not_admin, bot_is_admin, is_not_blacklisted
@@ -35,7 +35,7 @@ async def get_blacklist(update: Update, context: CallbackContext) -> None:
     chat_name = chat.title
 
     filter_list = "Current blacklisted words in <b>{}</b>:\n".format(chat_name)
-    all_blacklisted = blacklist_sql.get_chat_blacklist(chat_id)
+    all_blacklisted = await blacklist_sql.aio.get_chat_blacklist(chat_id)
 
     for trigger in all_blacklisted:
         filter_list += " - <code>{}</code>\n".format(html.escape(trigger.trigger))
@@ -74,7 +74,7 @@ async def add_blacklist(update: Update, context: CallbackContext) -> None:
             {trigger.strip() for trigger in triggers.split(",") if trigger.strip()},
         )
         for trigger in words_to_blacklist:
-            blacklist_sql.add_to_blacklist(chat_id, trigger.lower())
+            await blacklist_sql.aio.add_to_blacklist(chat_id, trigger.lower())
 
         if len(words_to_blacklist) == 1:
             await context.bot.send_message(
@@ -119,7 +119,7 @@ async def unblacklist(update: Update, context: CallbackContext) -> None:
         )
         successful = 0
         for trigger in words_to_unblacklist:
-            success = blacklist_sql.remove_from_blacklist(chat_id, trigger.lower())
+            success = await blacklist_sql.aio.remove_from_blacklist(chat_id, trigger.lower())
             if success:
                 successful += 1
 
@@ -186,22 +186,22 @@ async def blacklist_mode(update: Update, context: CallbackContext) -> None:
     if args:
         if args[0].lower() in ["off", "nothing", "no"]:
             set_blacklist_type = "do nothing"
-            blacklist_sql.set_blacklist_severity(chat_id, 0, "0")
+            await blacklist_sql.aio.set_blacklist_severity(chat_id, 0, "0")
         elif args[0].lower() in ["del", "delete"]:
             set_blacklist_type = "🛑 delete blacklisted message 🛑"
-            blacklist_sql.set_blacklist_severity(chat_id, 1, "0")
+            await blacklist_sql.aio.set_blacklist_severity(chat_id, 1, "0")
         elif args[0].lower() == "warn":
             set_blacklist_type = "🚨 warn the sender of the message 🚨"
-            blacklist_sql.set_blacklist_severity(chat_id, 2, "0")
+            await blacklist_sql.aio.set_blacklist_severity(chat_id, 2, "0")
         elif args[0].lower() == "mute":
             set_blacklist_type = "🔇 mute the sender of the message 🔇"
-            blacklist_sql.set_blacklist_severity(chat_id, 3, "0")
+            await blacklist_sql.aio.set_blacklist_severity(chat_id, 3, "0")
         elif args[0].lower() == "kick":
             set_blacklist_type = "⚠️ kick the sender of the message ⚠️"
-            blacklist_sql.set_blacklist_severity(chat_id, 4, "0")
+            await blacklist_sql.aio.set_blacklist_severity(chat_id, 4, "0")
         elif args[0].lower() == "ban":
             set_blacklist_type = "🚫 ban the sender of the message 🚫"
-            blacklist_sql.set_blacklist_severity(chat_id, 5, "0")
+            await blacklist_sql.aio.set_blacklist_severity(chat_id, 5, "0")
         elif args[0].lower() == "tban":
             if len(args) == 1:
                 await context.bot.send_message(
@@ -222,7 +222,7 @@ Examples of time values: 5m = 5 minutes, 6h = 6 hours, 3d = 3 days.""",
                 )
                 return 
             set_blacklist_type = "⌚🚫 temporarily ban for {} ⌚🚫".format(args[1])
-            blacklist_sql.set_blacklist_severity(chat_id, 6, str(args[1]))
+            await blacklist_sql.aio.set_blacklist_severity(chat_id, 6, str(args[1]))
         elif args[0].lower() == "tmute":
             if len(args) == 1:
                 await context.bot.send_message(
@@ -243,7 +243,7 @@ Examples of time values: 5m = 5 minutes, 6h = 6 hours, 3d = 3 days.""",
                 )
                 return
             set_blacklist_type = "⌚🔇 temporarily mute for {} ⌚🔇".format(args[1])
-            blacklist_sql.set_blacklist_severity(chat_id, 7, str(args[1]))
+            await blacklist_sql.aio.set_blacklist_severity(chat_id, 7, str(args[1]))
         else:
             await context.bot.send_message(
                 chat_id,
@@ -262,7 +262,7 @@ Examples of time values: 5m = 5 minutes, 6h = 6 hours, 3d = 3 days.""",
             )
         )
     else:
-        get_mode, get_value = blacklist_sql.get_blacklist_setting(chat_id)
+        get_mode, get_value = await blacklist_sql.aio.get_blacklist_setting(chat_id)
         if get_mode == 0:
             set_blacklist_type = "do nothing"
         elif get_mode == 1:
@@ -302,161 +302,161 @@ async def delete_blacklist(update: Update, context: CallbackContext) -> None:
     if args[0][0] == "/": # for the timebeing to check if it's a command -> later can add giant list of all commands to check
         return
     
-    get_mode, get_value = blacklist_sql.get_blacklist_setting(chat.id)
-    chat_filters = blacklist_sql.get_chat_blacklist(chat.id)
-    for trigger in chat_filters:
-        pattern = r"( |^|[^\w])" + re.escape(trigger.trigger) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
+    settings = await current_chat_settings(update, context)
+    trigger = settings["blacklist_matcher"].search(to_match)
+    if not trigger:
+        return
+
+    get_mode, get_value = settings["blacklist"]
+    try:
+        if get_mode == 0:
+            return
+        elif get_mode == 1:
             try:
-                if get_mode == 0:
-                    return
-                elif get_mode == 1:
-                    try:
-                        await message.delete()
-                    except BadRequest:
-                        pass
-                    await context.bot.send_message(
-                        chat_id,
-                        f"🛑 Please don't use that blacklisted word again {mention_html(user_id, html.escape(user.first_name))}. 🛑",
-                        parse_mode=ParseMode.HTML,
-                    )
-                    return
-                elif get_mode == 2:
-                    try:
-                        await message.delete()
-                    except BadRequest:
-                        pass 
-                    await warn(
-                        update, context,
-                        user, chat,
-                        "User has violated server rules from blacklist.", message,
-                        user 
-                    )
-                    return 
-                elif get_mode == 3:
-                    try:
-                        await message.delete()
-                    except BadRequest:
-                        pass 
-                        
-                    await chat.restrict_member(
-                        user.id,
-                        permissions=ChatPermissions(can_send_messages=False),
-                    )
+                await message.delete()
+            except BadRequest:
+                pass
+            await context.bot.send_message(
+                chat_id,
+                f"🛑 Please don't use that blacklisted word again {mention_html(user_id, html.escape(user.first_name))}. 🛑",
+                parse_mode=ParseMode.HTML,
+            )
+            return
+        elif get_mode == 2:
+            try:
+                await message.delete()
+            except BadRequest:
+                pass 
+            await warn(
+                update, context,
+                user, chat,
+                "User has violated server rules from blacklist.", message,
+                user 
+            )
+            return 
+        elif get_mode == 3:
+            try:
+                await message.delete()
+            except BadRequest:
+                pass 
+                
+            await chat.restrict_member(
+                user.id,
+                permissions=ChatPermissions(can_send_messages=False),
+            )
 
+            await context.bot.send_message(
+                chat_id,
+                f"🔇 Muted {mention_html(user_id, html.escape(user.first_name))} for using a blacklisted word. 🔇",
+                parse_mode=ParseMode.HTML,
+            )
+            return 
+        elif get_mode == 4:
+            try:
+                await message.delete()
+            except BadRequest:
+                pass 
+
+            await message.chat.ban_member(user_id)
+            await asyncio.sleep(1)
+            await message.chat.unban_member(user_id)
+
+            if chat.type in [chat.GROUP, chat.SUPERGROUP]:
+                link = (await bot.get_chat(chat.id)).invite_link
+                if not link:
+                    link = await bot.export_chat_invite_link(chat.id)
+                text = f"⚠️ You have been kicked from `{update.effective_chat.title}`. ⚠️\n\nHere is the invite link if you'd wish to rejoin: {link}"
+                
+                try:
                     await context.bot.send_message(
-                        chat_id,
-                        f"🔇 Muted {mention_html(user_id, html.escape(user.first_name))} for using a blacklisted word. 🔇",
-                        parse_mode=ParseMode.HTML,
-                    )
-                    return 
-                elif get_mode == 4:
-                    try:
-                        await message.delete()
-                    except BadRequest:
-                        pass 
-
-                    await message.chat.ban_member(user_id)
-                    await asyncio.sleep(1)
-                    await message.chat.unban_member(user_id)
-
-                    if chat.type in [chat.GROUP, chat.SUPERGROUP]:
-                        link = (await bot.get_chat(chat.id)).invite_link
-                        if not link:
-                            link = await bot.export_chat_invite_link(chat.id)
-                        text = f"⚠️ You have been kicked from `{update.effective_chat.title}`. ⚠️\n\nHere is the invite link if you'd wish to rejoin: {link}"
-                        
-                        try:
-                            await context.bot.send_message(
-                                chat_id=user_id, 
-                                text=text,
-                                parse_mode=ParseMode.MARKDOWN,
-                                disable_web_page_preview=True, 
-                            )
-                        except Forbidden:
-                            pass
-                    await context.bot.send_message(
-                        chat_id,
-                        f"⚠️ Kicked `{user.first_name}` for using a blacklisted word. ⚠️",
+                        chat_id=user_id, 
+                        text=text,
                         parse_mode=ParseMode.MARKDOWN,
+                        disable_web_page_preview=True, 
                     )
+                except Forbidden:
+                    pass
+            await context.bot.send_message(
+                chat_id,
+                f"⚠️ Kicked `{user.first_name}` for using a blacklisted word. ⚠️",
+                parse_mode=ParseMode.MARKDOWN,
+            )
 
-                    return
-                elif get_mode == 5:
-                    try:
-                        await message.delete()
-                    except BadRequest:
-                        pass 
-                    await message.chat.ban_member(user_id)
-                    
-                    await context.bot.send_message(
-                        chat_id,
-                        f"🚫 Banned `{user.first_name}` for using a blacklisted word. 🚫",
-                        parse_mode=ParseMode.MARKDOWN,
-                    )
-                    return 
-                elif get_mode == 6:
-                    try:
-                        await message.delete()
-                    except BadRequest:
-                        pass
-                    
-                    bantime = await time_formatter(message, get_value)
-                    await chat.ban_member(
-                        user_id,
-                        until_date=bantime,
-                    )
-                    
-                    await context.bot.send_message(
-                        chat_id,
-                        f"⌚🚫 Banned `{user.first_name}` for `{get_value}` for using blacklisted word: `{trigger.trigger}!` ⌚🚫",
-                        parse_mode=ParseMode.MARKDOWN,
-                    )
+            return
+        elif get_mode == 5:
+            try:
+                await message.delete()
+            except BadRequest:
+                pass 
+            await message.chat.ban_member(user_id)
+            
+            await context.bot.send_message(
+                chat_id,
+                f"🚫 Banned `{user.first_name}` for using a blacklisted word. 🚫",
+                parse_mode=ParseMode.MARKDOWN,
+            )
+            return 
+        elif get_mode == 6:
+            try:
+                await message.delete()
+            except BadRequest:
+                pass
+            
+            bantime = await time_formatter(message, get_value)
+            await chat.ban_member(
+                user_id,
+                until_date=bantime,
+            )
+            
+            await context.bot.send_message(
+                chat_id,
+                f"⌚🚫 Banned `{user.first_name}` for `{get_value}` for using blacklisted word: `{trigger}!` ⌚🚫",
+                parse_mode=ParseMode.MARKDOWN,
+            )
 
-                    if get_value[-1] == "m":
-                        time_later = datetime.now() + timedelta(minutes=int(get_value[:-1]))
-                    elif get_value[-1] == "h":
-                        time_later = datetime.now() + timedelta(hours=int(get_value[:-1]))
-                    elif get_value[-1] == "d":
-                        time_later = datetime.now() + timedelta(days=int(get_value[:-1]))
+            if get_value[-1] == "m":
+                time_later = datetime.now() + timedelta(minutes=int(get_value[:-1]))
+            elif get_value[-1] == "h":
+                time_later = datetime.now() + timedelta(hours=int(get_value[:-1]))
+            elif get_value[-1] == "d":
+                time_later = datetime.now() + timedelta(days=int(get_value[:-1]))
 
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=f"""⌚🚫 You have been temporarily banned! ⌚🚫
+            try:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=f"""⌚🚫 You have been temporarily banned! ⌚🚫
 
 You will be able to rejoin the group via the invite link: {chat.export_invite_link()}
 
 The time you'll be unbanned after is:\n\n `{datetime.strftime(time_later, "%d %B %Y %H:%M")}`.
-                            """,
-                            parse_mode=ParseMode.MARKDOWN,
-                        )
-                    except Exception in (BadRequest, Forbidden):
-                        pass
-                    return
-                elif get_mode == 7:
-                    try:
-                        await message.delete()
-                    except BadRequest:
-                        pass
-                    
-                    mutetime = await time_formatter(message, get_value)
-                    await chat.restrict_member(
-                        user.id,
-                        until_date=mutetime,
-                        permissions=ChatPermissions(can_send_messages=False),
-                    )
+                    """,
+                    parse_mode=ParseMode.MARKDOWN,
+                )
+            except Exception in (BadRequest, Forbidden):
+                pass
+            return
+        elif get_mode == 7:
+            try:
+                await message.delete()
+            except BadRequest:
+                pass
+            
+            mutetime = await time_formatter(message, get_value)
+            await chat.restrict_member(
+                user.id,
+                until_date=mutetime,
+                permissions=ChatPermissions(can_send_messages=False),
+            )
 
-                    await context.bot.send_message(
-                        chat_id,
-                        f"⌚🔇 Muted `{user.first_name}` until `{get_value}` for using blacklisted word: `{trigger}`! ⌚🔇",
-                        parse_mode=ParseMode.MARKDOWN,
-                    )
-                    return
-            except BadRequest as excp:
-                if excp.message != "Message to delete not found":
-                    LOGGER.exception("Error while deleting blacklist message.")
-            break
+            await context.bot.send_message(
+                chat_id,
+                f"⌚🔇 Muted `{user.first_name}` until `{get_value}` for using blacklisted word: `{trigger}`! ⌚🔇",
+                parse_mode=ParseMode.MARKDOWN,
+            )
+            return
+    except BadRequest as excp:
+        if excp.message != "Message to delete not found":
+            LOGGER.exception("Error while deleting blacklist message.")
 
 def __migrate__(old_chat_id, new_chat_id):
     blacklist_sql.migrate_chat(old_chat_id, new_chat_id)
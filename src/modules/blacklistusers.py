@@ -43,7 +43,7 @@ async def blacklist_user(update: Update, context: CallbackContext) -> str:
         else:
             raise
     
-    user_blacklist_sql.blacklist_user(chat.id, user_id, reason)
+    await user_blacklist_sql.aio.blacklist_user(chat.id, user_id, reason)
     await message.reply_text(
         f"🔇🧑 I will strengthen my defences to ignore `{target_user.user.first_name}` 🔇🧑",
         parse_mode=ParseMode.MARKDOWN,
@@ -85,8 +85,8 @@ async def unblacklist_user(update: Update, context: CallbackContext) -> str:
         else:
             raise
 
-    if user_blacklist_sql.is_user_blacklisted(chat.id, user_id):
-        user_blacklist_sql.unblacklist_user(chat.id, user_id)
+    if await user_blacklist_sql.aio.is_user_blacklisted(chat.id, user_id):
+        await user_blacklist_sql.aio.unblacklist_user(chat.id, user_id)
         await message.reply_text("🧑 I will now begin to notice this user again. 🧑")
         log_message = (
             f"#UNBLACKLIST\n"
@@ -107,9 +107,9 @@ async def blacklist_users(update: Update, context: CallbackContext) -> None:
     bot = context.bot
     chat: Optional[Chat] = update.effective_chat
 
-    for each_user in user_blacklist_sql.list_blacklisted_users(chat.id):
+    for each_user in await user_blacklist_sql.aio.list_blacklisted_users(chat.id):
         current_user = await chat.get_member(each_user.user_id)
-        reason = user_blacklist_sql.get_reason(chat.id, current_user.user.id)
+        reason = await user_blacklist_sql.aio.get_reason(chat.id, current_user.user.id)
 
         if reason:
             users.append(
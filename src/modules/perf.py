@@ -0,0 +1,115 @@
+from typing import Optional
+
+from aiohttp import web
+
+from src import dispatcher, LOGGER, OWNER_ID, METRICS_HOST, METRICS_PORT
+from src.core.metrics import HANDLER_STATS, GROUP_STATS, CACHE_STATS, render_prometheus
+
+from telegram import Update, Message
+from telegram.ext import CallbackContext, CommandHandler
+from telegram.constants import ParseMode
+
+PERF_TOP_HANDLERS = 20 # the handlers with the most total time shown by /perf
+PERF_NAME_WIDTH = 30
+
+# kept so the endpoint isn't garbage collected while the bot runs
+METRICS_RUNNER = None
+
+LOGGER.info("Perf: Started initialisation.")
+
+async def metrics_page(request: web.Request) -> web.Response:
+    return web.Response(
+        body=render_prometheus().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+async def start_metrics_server(context: CallbackContext) -> None:
+    global METRICS_RUNNER
+    if not METRICS_PORT:
+        return
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_page)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as excp:
+        LOGGER.error(f"Perf: Unable to serve metrics on {METRICS_HOST}:{METRICS_PORT}. {excp}")
+        await runner.cleanup()
+        return
+
+    METRICS_RUNNER = runner
+    LOGGER.info(f"Perf: Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+def format_stats_row(name: str, stats) -> str:
+    latency = stats.latency
+    calls = latency.count or 1 # db and api time are shown per call
+    return "{} {:>6} {:>7.1f} {:>7.1f} {:>7.1f} {:>4} {:>6.1f} {:>6.1f}".format(
+        name[:PERF_NAME_WIDTH].ljust(PERF_NAME_WIDTH),
+        latency.count,
+        latency.quantile(0.5) * 1000,
+        latency.quantile(0.95) * 1000,
+        latency.quantile(0.99) * 1000,
+        stats.exceptions,
+        stats.db_seconds / calls * 1000,
+        stats.api_seconds / calls * 1000,
+    )
+
+def render_perf_summary() -> str:
+    header = "{} {:>6} {:>7} {:>7} {:>7} {:>4} {:>6} {:>6}".format(
+        "handler".ljust(PERF_NAME_WIDTH), "calls", "p50", "p95", "p99", "err", "db", "api",
+    )
+
+    called = [(key, stats) for key, stats in HANDLER_STATS.items() if stats.latency.count]
+    called.sort(key=lambda item: item[1].latency.sum, reverse=True)
+
+    lines = [header]
+    lines += [format_stats_row(f"{name} [{group}]", stats) for (name, group), stats in called[:PERF_TOP_HANDLERS]]
+    lines += ["", header.replace("handler", "group  ", 1)]
+    lines += [
+        format_stats_row(f"group {group}", stats)
+        for group, stats in sorted(GROUP_STATS.items()) if stats.latency.count
+    ]
+
+    if CACHE_STATS:
+        lines += ["", "{} {:>6} {:>6} {:>6} {:>5} {:>6}".format(
+            "cache".ljust(PERF_NAME_WIDTH), "hits", "coal", "miss", "hit%", "size",
+        )]
+        for name, cache_stats in sorted(CACHE_STATS.items()):
+            stats = cache_stats()
+            lines.append("{} {:>6} {:>6} {:>6} {:>4.0f}% {:>6}".format(
+                name[:PERF_NAME_WIDTH].ljust(PERF_NAME_WIDTH),
+                stats["hits"], stats["coalesced"], stats["misses"], stats["hit_rate"] * 100, stats["size"],
+            ))
+
+    return "\n".join(lines)
+
+async def perf(update: Update, context: CallbackContext) -> None:
+    message: Optional[Message] = update.effective_message
+    if message.from_user.id != OWNER_ID:
+        return
+
+    if not any(stats.latency.count for stats in HANDLER_STATS.values()) and not CACHE_STATS:
+        await message.reply_text("No handler has been called yet.")
+        return
+
+    await message.reply_text(
+        "*Handler performance* (ms, db and api are per call)\n```\n" + render_perf_summary() + "\n```",
+        parse_mode=ParseMode.MARKDOWN,
+    )
+
+__module_name__ = "Perf"
+__help__ = """
+*Owner only*
+• `/perf` - Show the call count, p50/p95/p99 latency, errors and database and bot api time of the busiest handlers and of every handler group, followed by the hits, coalesced lookups and misses of the response caches.
+
+The same numbers are served in the prometheus format on the local metrics endpoint (`METRICS_HOST`:`METRICS_PORT`/metrics).
+"""
+
+PERF_HANDLER = CommandHandler("perf", perf)
+
+dispatcher.add_handler(PERF_HANDLER)
+
+dispatcher.job_queue.run_once(start_metrics_server, when=0)
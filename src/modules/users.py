@@ -1,25 +1,42 @@
+import asyncio
+import csv
 from typing import Optional
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 
 from telegram import Update, Chat, Message
-from telegram.error import BadRequest, TelegramError
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (
     CallbackContext,
+    ChatMemberHandler,
     CommandHandler,
     MessageHandler,
     filters,
     CallbackContext,
 )
 import src.core.sql.users_sql as users_sql
+import src.core.sql.broadcast_sql as broadcast_sql
 from src import LOGGER, DEV_ID, dispatcher
 from src.core.decorators.chat import is_not_blacklisted
+from src.utils.cache import TTLCache
+from src.utils.broadcast import run_broadcast, resume_broadcasts
 
 USERS_GROUP = 4
 CHAT_GROUP = 5
+USERS_FLUSH_INTERVAL = 10 # seconds between writing queued users to the database
+CHAT_PERMISSIONS_TTL = 3600 # seconds before a chat's default permissions are fetched again
+
+CHATS_EXPORT_CONCURRENCY = 10
+CHATS_EXPORT_PAGE_SIZE = 200
+
+# chat_id -> whether members (and so the bot) can send messages by default
+CHAT_PERMISSIONS = TTLCache(CHAT_PERMISSIONS_TTL, maxsize=10000)
+# chat_id -> member count, or None if the bot can't see the chat anymore
+CHAT_INVENTORY = TTLCache(600, maxsize=10000)
+MISSING = object()
 
 LOGGER.info("Users: Started initialisation.")
 
-def get_user_id(username, chat_id):
+async def get_user_id(username, chat_id):
     LOGGER.info("Users: Retrieving the user id given username.")
 
     if username.startswith("@"):
@@ -29,7 +46,7 @@ def get_user_id(username, chat_id):
         return None
 
     LOGGER.info("Users: Querying users_sql for userid given username")
-    users = users_sql.get_userid_by_name(username)
+    users = await users_sql.aio.get_userid_by_name(username)
     
 
     if not users: # No users are present
@@ -41,7 +58,7 @@ def get_user_id(username, chat_id):
         # We are going to loop through the list of users and find the username given the user_id
         for user_object in users:
             try:
-                user_data = dispatcher.bot.get_chat(chat_id)
+                user_data = await dispatcher.bot.get_chat(user_object.user_id)
                 if user_data.username == username:
                     return user_data.id
             except BadRequest as excp:
@@ -61,73 +78,80 @@ async def broadcast(update: Update, context: CallbackContext):
     to_send = message.text.split(None, 1)
 
     if len(to_send) >= 2:
-        group_broadcast = False
-        user_broadcast = False
-
         if to_send[0] == "/broadcastgroups":
-            group_broadcast = True
+            phases = ["groups"]
         elif to_send[0] == "/broadcastusers":
-            user_broadcast = True
-        elif to_send[0] == "/broadcastall":
-            group_broadcast = user_broadcast = True
-
-        all_chats = users_sql.get_all_chats() or []
-        all_users = users_sql.get_all_users() or []
-        failed_groups = 0
-        failed_users = 0
-
-        if group_broadcast:
-            LOGGER.info("Users: Sending out a group broadcast.")
-            for group in all_chats:
-                try:
-                    context.bot.sendMessage(
-                        int(group.chat_id),
-                        to_send[1],
-                        parse_mode = "MARKDOWN",
-                        disable_web_page_preview = True,
-                    )
-                except TelegramError: 
-                    failed_groups += 1
-        
-        if user_broadcast:
-            LOGGER.info("Users: Sending out a user broadcast.")
-            for user in all_users:
-                try:
-                    context.bot.sendMessage(
-                        int(user.user_id),
-                        to_send[1],
-                        parse_mode = "MARKDOWN",
-                        disable_web_page_preview = True,
-                    )
-                except TelegramError:
-                    failed_users += 1
-        
-        update.effective_message.reply_text(
-            f"📡 Broadcast message complete. \nGroups failed `{failed_groups}` \nFailed users `{failed_users}` 📡 "
-        )
+            phases = ["users"]
+        else:
+            phases = ["groups", "users"]
+
+        # the engine saves its progress as it goes, so a restart resumes rather than starting over
+        broadcast_id = await broadcast_sql.aio.start_broadcast(message.chat.id, to_send[1], phases)
+        context.application.create_task(run_broadcast(context.bot, broadcast_id))
+
+        await message.reply_text("📡 Broadcast started, I'll let you know here when it's done. 📡")
+
+async def resume_unfinished_broadcasts(context: CallbackContext):
+    await resume_broadcasts(context.application)
+
+async def chat_member_count(bot, chat_id, semaphore: asyncio.Semaphore) -> Optional[int]:
+    # one API call per chat, it fails if the bot is no longer a member so that doubles as the membership check
+    cached = CHAT_INVENTORY.get(chat_id, MISSING)
+    if cached is not MISSING:
+        return cached
+
+    async with semaphore:
+        for _ in range(2):
+            try:
+                count = await bot.get_chat_member_count(chat_id)
+                break
+            except RetryAfter as excp:
+                await asyncio.sleep(excp.retry_after)
+            except TelegramError:
+                count = None
+                break
+        else:
+            return None # still rate limited, try again next time rather than caching it
+
+    CHAT_INVENTORY.set(chat_id, count)
+    return count
 
 @is_not_blacklisted
 async def chats(update: Update, context: CallbackContext):
-    all_chats = users_sql.get_all_chats() or []
-    chatfile = "List of chats.\n0. Chat name | Chat ID | Members count\n"
-    P = 1
-    for chat in all_chats:
-        try:
-            curr_chat = await context.bot.getChat(chat.chat_id)
-            bot_member = await curr_chat.get_member(context.bot.id)
-            chat_members = await curr_chat.get_members_count(context.bot.id)
-            chatfile += "{}. {} | {} | {}\n".format(
-                P, chat.chat_name, chat.chat_id, chat_members,
-            )
-            P = P + 1
-        except:
-            pass
-
-    with BytesIO(str.encode(chatfile)) as output:
-        output.name = "groups_list.txt"
+    semaphore = asyncio.Semaphore(CHATS_EXPORT_CONCURRENCY)
+    output = BytesIO()
+    # write the csv straight into the document buffer a page at a time
+    text_output = TextIOWrapper(output, encoding="utf-8", newline="")
+    writer = csv.writer(text_output)
+    writer.writerow(["#", "Chat name", "Chat ID", "Members count"])
+
+    position = 1
+    cursor = None
+    while True:
+        page = await users_sql.aio.get_chats_after(cursor, limit=CHATS_EXPORT_PAGE_SIZE)
+        if not page:
+            break
+
+        counts = await asyncio.gather(*(
+            chat_member_count(context.bot, chat_id, semaphore) for chat_id, _ in page
+        ))
+        for (chat_id, chat_name), count in zip(page, counts):
+            if count is None: # the bot isn't in this chat anymore
+                continue
+            writer.writerow([position, chat_name, chat_id, count])
+            position += 1
+
+        cursor = page[-1][0]
+
+    text_output.flush()
+    text_output.detach() # hand the buffer back without closing it
+    output.seek(0)
+    output.name = "groups_list.csv"
+
+    with output:
         await update.effective_message.reply_document(
             document=output,
-            filename="groups_list.txt",
+            filename="groups_list.csv",
             caption="Here be the list of groups in my database.",
         ) 
 
@@ -135,9 +159,9 @@ async def log_user(update: Update, context: CallbackContext):
     chat: Optional[Chat] = update.effective_chat
     message: Optional[Message] = update.effective_message
 
+    # only queues changes, flush_users writes them in bulk
     if message.reply_to_message:
-        LOGGER.info("Users: User is being logged from a replied message.")
-        users_sql.update_user(
+        users_sql.queue_user_update(
             message.reply_to_message.from_user.id,
             message.reply_to_message.from_user.username,
             chat.id,
@@ -146,26 +170,45 @@ async def log_user(update: Update, context: CallbackContext):
         return
     
     if message.forward_from:
-        LOGGER.info("Users: User is being logged from a forwarded message.")
-        users_sql.update_user(
+        users_sql.queue_user_update(
             message.forward_from.id,
             message.forward_from.username,  
         )
         return
 
-    LOGGER.info("Users: User is being logged from a standard message.")
-    users_sql.update_user(message.from_user.id, message.from_user.username, chat.id, chat.title)
+    users_sql.queue_user_update(message.from_user.id, message.from_user.username, chat.id, chat.title)
+
+async def flush_users(context: CallbackContext):
+    try:
+        written = await users_sql.aio.flush_user_updates()
+    except Exception as excp:
+        LOGGER.error(f"Users: Unable to write queued users, retrying on the next flush. {excp}")
+        return
+
+    if written:
+        LOGGER.info(f"Users: Wrote {written} queued user/chat rows.")
 
 async def chat_checker(update: Update, context: CallbackContext):
     chat: Optional[Chat] = update.effective_chat
     bot = context.bot 
+    can_send_messages = CHAT_PERMISSIONS.get(chat.id)
+
     try:
-        bot_member = await dispatcher.bot.get_chat(chat.id)
-        if bot_member.permissions.can_send_messages is False: # These are only the default chat permissions
+        if can_send_messages is None: # not cached or expired, fetch it once for this chat
+            full_chat = await bot.get_chat(chat.id)
+            can_send_messages = full_chat.permissions.can_send_messages # These are only the default chat permissions
+            CHAT_PERMISSIONS.set(chat.id, can_send_messages)
+
+        if can_send_messages is False:
+            CHAT_PERMISSIONS.pop(chat.id)
             await bot.leave_chat(chat.id)
     except BadRequest:
         pass  
 
+async def bot_member_changed(update: Update, context: CallbackContext):
+    # the bot's own status changed in this chat, the cached permissions may no longer be right
+    CHAT_PERMISSIONS.pop(update.my_chat_member.chat.id)
+
 def __migrate__(old_chat_id, new_chat_id):
     users_sql.migrate_chat(old_chat_id, new_chat_id)
 
@@ -183,8 +226,13 @@ BROADCAST_HANDLER = CommandHandler(
 )
 CHAT_CHECKER_HANDLER = MessageHandler(filters.ALL & ~filters.ChatType.PRIVATE, chat_checker)
 CHATLIST_HANDLER = CommandHandler("groups", chats)
+BOT_MEMBER_HANDLER = ChatMemberHandler(bot_member_changed, ChatMemberHandler.MY_CHAT_MEMBER)
 
 dispatcher.add_handler(USER_LOG_HANDLER, USERS_GROUP)
 dispatcher.add_handler(BROADCAST_HANDLER)
 dispatcher.add_handler(CHATLIST_HANDLER)
-dispatcher.add_handler(CHAT_CHECKER_HANDLER, CHAT_GROUP)
\ No newline at end of file
+dispatcher.add_handler(CHAT_CHECKER_HANDLER, CHAT_GROUP)
+dispatcher.add_handler(BOT_MEMBER_HANDLER, CHAT_GROUP)
+
+dispatcher.job_queue.run_repeating(flush_users, interval=USERS_FLUSH_INTERVAL, first=USERS_FLUSH_INTERVAL)
+dispatcher.job_queue.run_once(resume_unfinished_broadcasts, when=0)
\ No newline at end of file
@@ -1,9 +1,10 @@
 import html
 import re
-from typing import Optional
+from typing import Optional, Tuple
 
 from src import dispatcher, LOGGER, OWNER_ID, DEV_ID
 from src.core.sql import warns_sql
+from src.core.chat_context import current_chat_settings
 from src.core.decorators.chat import (
     bot_is_admin,
     user_is_admin, 
@@ -14,7 +15,6 @@ from src.core.decorators.chat import (
 )
 
 from src.utils.extraction import extract_text, extract_user_only, extract_user_and_reason
-from src.utils.misc import split_message
 from src.utils.string_handling import remove_quotes
 from src.core.sql import warns_sql
 from telegram import (
@@ -41,6 +41,9 @@ from telegram.error import BadRequest
 from telegram.constants import ParseMode, MessageLimit
 
 WARN_HANDLER_GROUP = 9
+WARNS_PAGE_SIZE = 10 # warn reasons shown on each page of /warns
+WARN_REASON_PREVIEW_LENGTH = 300 # longer reasons are cut short so a page fits in one message
+WARN_HISTORY_PURGE_INTERVAL = 24 * 60 * 60
 
 async def warn(update: Update, context: CallbackContext,
     user: User, chat: Chat, reason: str, 
@@ -58,10 +61,10 @@ async def warn(update: Update, context: CallbackContext,
     else:
         warner_tag = "Automated warn filter."
     
-    limit, soft_warn = warns_sql.get_warn_setting(chat.id)
-    num_warns, reasons = warns_sql.warn_user(user_id, chat.id, reason)
+    limit, soft_warn = await warns_sql.aio.get_warn_setting(chat.id)
+    num_warns, reasons = await warns_sql.aio.warn_user(user_id, chat.id, reason)
     if num_warns >= limit: #limit has been reached or exceeded
-        warns_sql.reset_warns(user_id, chat.id)
+        await warns_sql.aio.reset_warns(user_id, chat.id)
         if soft_warn: # the user will not be banned
             await chat.restrict_member(
                 user_id,
@@ -150,9 +153,9 @@ async def button(update: Update, context: CallbackContext) -> str:
     await query.answer()
     match = re.match(r"rm_warn\((.+?)\)", query.data)
     if match:
-        user_id = match.group(1)
+        user_id = int(match.group(1))
         chat: Optional[Chat] = update.effective_chat
-        warn_remove = warns_sql.remove_warn(user_id, chat.id)
+        warn_remove = await warns_sql.aio.remove_warn(user_id, chat.id)
         if warn_remove:
             await update.effective_message.reply_text(
                 "Warn removed by {}".format(mention_html(user.id, user.first_name)),
@@ -222,7 +225,7 @@ async def reset_warns(update: Update, context: CallbackContext) -> str:
     user_id = await extract_user_only(update, message)
 
     if user_id:
-        warns_sql.reset_warns(user_id, chat.id)
+        await warns_sql.aio.reset_warns(user_id, chat.id)
         await message.reply_text("Warns have been reset")
         warned_user = await chat.get_member(user_id)
         return (
@@ -235,34 +238,78 @@ async def reset_warns(update: Update, context: CallbackContext) -> str:
         await message.reply_text("No user has been designated!")
     return ""
 
+async def render_warns_page(chat_id: int, user_id: int, page: int) -> Optional[Tuple[str, Optional[InlineKeyboardMarkup]]]:
+    """
+    Builds one page of a user's warn reasons, newest first.
+    :param chat_id: The chat the user was warned in.
+    :param user_id: The warned user.
+    :param page: The page to show, starting at 0.
+    :return: The text and the page buttons, or None if the user has no warns.
+    """
+    # one extra reason is fetched to know whether there's a next page
+    warns_result = await warns_sql.aio.get_warns(user_id, chat_id, offset=page * WARNS_PAGE_SIZE, limit=WARNS_PAGE_SIZE + 1)
+    if not warns_result or warns_result[0] == 0: # Ensures that the user has warns
+        return None
+
+    num_warns, reasons = warns_result
+    limit, soft_warn = await warns_sql.aio.get_warn_setting(chat_id)
+    has_next = len(reasons) > WARNS_PAGE_SIZE
+    reasons = reasons[:WARNS_PAGE_SIZE]
+
+    if not reasons and page == 0:
+        return f"🚨 User has {num_warns}/{limit} warns, but no reasons for any of these. 🚨", None
+
+    text = f"🚨 This user has {num_warns}/{limit} warns 🚨. Below are the following reasons why:\n"
+    for reason in reasons:
+        if reason and len(reason) > WARN_REASON_PREVIEW_LENGTH:
+            reason = reason[:WARN_REASON_PREVIEW_LENGTH] + "…"
+        text += f"\n - {reason}"
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Newer", callback_data=f"warns_page({user_id},{page - 1})"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Older ➡️", callback_data=f"warns_page({user_id},{page + 1})"))
+
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
 @is_not_blacklisted
 async def get_warns(update: Update, context: CallbackContext) -> None:
     message: Optional[Message] = update.effective_message 
     chat: Optional[Chat] = update.effective_chat
     user_id = await extract_user_only(update, message)
-    warns_result = warns_sql.get_warns(user_id, chat.id)
+    warns_page = await render_warns_page(chat.id, user_id, 0)
 
-    if warns_result and warns_result[0] != 0: # Ensures that the user has warns
-        num_warns, reasons = warns_result
-        limit, soft_warn = warns_sql.get_warn_setting(chat.id)
-        
-        if reasons:
-            text = (
-                f"🚨 This user has {num_warns}/{limit} warns 🚨. Below are the following reasons why:\n"
-            )
-            for reason in reasons:
-                text += f"\n - {reason}"
-            
-            messages = split_message(text)
-            for msg in messages:
-                await update.message.reply_text(msg)
-        else:
-            await update.message.reply_text(
-                f"🚨 User has {num_warns}/{limit} warns, but no reasons for any of these. 🚨"
-            )
+    if warns_page:
+        text, keyboard = warns_page
+        await update.message.reply_text(text, reply_markup=keyboard)
     else:
         await message.reply_text("This user does not have any warns!")
 
+async def warns_page_button(update: Update, context: CallbackContext) -> None:
+    query: Optional[CallbackQuery] = update.callback_query
+    chat: Optional[Chat] = update.effective_chat
+
+    match = re.match(r"warns_page\((.+?),(.+?)\)", query.data)
+    user_id, page = int(match.group(1)), int(match.group(2))
+    warns_page = await render_warns_page(chat.id, user_id, page)
+    await query.answer()
+
+    if not warns_page:
+        await query.edit_message_text("This user does not have any warns!")
+        return
+
+    text, keyboard = warns_page
+    try:
+        await query.edit_message_text(text, reply_markup=keyboard)
+    except BadRequest: # pressed twice, nothing changed
+        pass
+
+async def purge_warn_history(context: CallbackContext) -> None:
+    purged = await warns_sql.aio.purge_warn_history()
+    if purged:
+        LOGGER.info(f"Purged {purged} expired warn reasons.")
+
 @bot_is_admin
 @user_is_admin
 @is_not_blacklisted
@@ -287,7 +334,7 @@ async def add_warn_filter(update: Update, context: CallbackContext) -> None:
         except IndexError:
             content = None
 
-    warns_sql.add_warn_filter(chat.id, keyword, content)
+    await warns_sql.aio.add_warn_filter(chat.id, keyword, content)
 
     await update.effective_message.reply_text("🚨 Warn handler added for {} 🚨".format(keyword))
 
@@ -310,7 +357,7 @@ async def remove_warn_filter(update: Update, context: CallbackContext) -> None:
     if len(extracted_message) < 1:
         return
     
-    to_remove = extracted_message[0]
+    to_remove = extracted_message[0].lower() # keywords are stored in lower case
 
     chat_filters = warns_sql.get_chat_warn_triggers(chat.id)
 
@@ -319,8 +366,8 @@ async def remove_warn_filter(update: Update, context: CallbackContext) -> None:
         return 
     
     for filter in chat_filters:
-        if filter[0] == to_remove:
-            warns_sql.remove_warn_filter(chat.id, to_remove)
+        if filter == to_remove:
+            await warns_sql.aio.remove_warn_filter(chat.id, to_remove)
             await message.reply_text(
                 f"Keyword `{to_remove}` has been successfully removed.",
                 parse_mode=ParseMode.HTML,
@@ -363,18 +410,18 @@ async def reply_filter(update: Update, context: CallbackContext) -> str:
     if user.id in [OWNER_ID, DEV_ID]:
         return 
     
-    chat_warn_filters = warns_sql.get_chat_warn_triggers(chat.id)
+    warn_matcher = (await current_chat_settings(update, context))["warn_filters"]
+    if not warn_matcher:
+        return ""
+
     to_match = extract_text(message)
     if not to_match:
         return 
     
-    if chat_warn_filters:
-        for keyword in chat_warn_filters:
-            pattern = r"( |^|[^\w])" + re.escape(keyword) + r"( |$|[^\w])"
-            if re.search(pattern, to_match, flags=re.IGNORECASE):
-                user: Optional[User] = update.effective_user
-                warn_filter = warns_sql.get_warn_filter(chat.id, keyword)
-                return await warn(update, context, user, chat, warn_filter.reply, message)
+    # one scan for every keyword, and the reply comes from memory
+    keyword = warn_matcher.search(to_match)
+    if keyword:
+        return await warn(update, context, user, chat, warns_sql.get_warn_filter_reply(chat.id, keyword), message)
     return ""
 
 @bot_is_admin
@@ -391,7 +438,7 @@ async def set_warn_limit(update: Update, context: CallbackContext) -> str:
             if int(args[0]) < 3:
                 await message.reply_text("🚨 The minimum warn limit is 3. 🚨")
             else:
-                warns_sql.set_warn_limit(chat.id, warn_limit=int(args[0]))
+                await warns_sql.aio.set_warn_limit(chat.id, warn_limit=int(args[0]))
                 await message.reply_text("🚨 Updated the warn limit to {} 🚨".format(args[0]))
                 return (
                     f"<b>{html.escape(chat.title)}:</b>\n"
@@ -402,7 +449,7 @@ async def set_warn_limit(update: Update, context: CallbackContext) -> str:
         else:
             await message.reply_text("Ensure that the argument you give is a number!")
     else:
-        limit, soft_warn = warns_sql.get_warn_setting(chat.id)
+        limit, soft_warn = await warns_sql.aio.get_warn_setting(chat.id)
 
         await message.reply_text(
             "🚨 The current warn limit is {} 🚨\n\nPlease ensure that you specify a warn limit.".format(
@@ -422,7 +469,7 @@ async def set_warn_severity(update: Update, context: CallbackContext) -> str:
 
     if args:
         if args[0].lower() in ("on", "yes"):
-            warns_sql.set_warn_severity(chat.id, False)
+            await warns_sql.aio.set_warn_severity(chat.id, False)
             await message.reply_text("🚫 Too many warns will now result in a ban! 🚫")
 
             return (
@@ -431,7 +478,7 @@ async def set_warn_severity(update: Update, context: CallbackContext) -> str:
                 f"Has enabled strong warns. This means users will be banned upon reaching the limit."
             )
         elif args[0].lower() in ("off", "no"):
-            warns_sql.set_warn_severity(chat.id, True)
+            await warns_sql.aio.set_warn_severity(chat.id, True)
             await message.reply_text(
                 "🔇 Too many warns will result in a mute. 🔇"
             )
@@ -447,7 +494,7 @@ async def set_warn_severity(update: Update, context: CallbackContext) -> str:
                 parse_mode=ParseMode.MARKDOWN,
             )
     else:
-        limit, soft_warn = warns_sql.get_warn_setting(chat.id)
+        limit, soft_warn = await warns_sql.aio.get_warn_setting(chat.id)
         
         if soft_warn:
             await message.reply_text(
@@ -517,6 +564,7 @@ RM_WARN_HANDLER = CommandHandler(
     ["nowarn", "stopwarn"], remove_warn_filter, filters=~filters.ChatType.PRIVATE,
 )
 CALLBACK_QUERY_HANDLER = CallbackQueryHandler(button, pattern=r"rm_warn")
+WARNS_PAGE_HANDLER = CallbackQueryHandler(warns_page_button, pattern=r"warns_page")
 WARN_FILTER_HANDLER = MessageHandler(
     filters.TEXT & ~filters.ChatType.PRIVATE, reply_filter,
 )
@@ -532,6 +580,9 @@ dispatcher.add_handler(RESET_WARN_HANDLER)
 dispatcher.add_handler(ADD_WARN_HANDLER)
 dispatcher.add_handler(RM_WARN_HANDLER)
 dispatcher.add_handler(CALLBACK_QUERY_HANDLER)
+dispatcher.add_handler(WARNS_PAGE_HANDLER)
 dispatcher.add_handler(WARN_FILTER_HANDLER, WARN_HANDLER_GROUP)
 dispatcher.add_handler(WARN_LIMIT_HANDLER)
 dispatcher.add_handler(WARN_SEVERITY_HANDLER)
+
+dispatcher.job_queue.run_repeating(purge_warn_history, interval=WARN_HISTORY_PURGE_INTERVAL, first=60)
@@ -1,9 +1,7 @@
-import pyowm
-import json
 import math
 import re
 
-from src import LOGGER, OWM_API_TOKEN, dispatcher
+from src import LOGGER, dispatcher
 import src.utils.weather_managers as manager
 from src.core.decorators.chat import is_not_blacklisted
 
@@ -66,7 +64,7 @@ async def receive_location_parameter(update: Update, context: CallbackContext) -
 
     # retrieve city registry given location
     try:
-        await retrieve_city_registries(update, context, OWM_API_TOKEN)
+        await retrieve_city_registries(update, context)
         LOGGER.info("Weather: Called functions for city registries.")
     except:
         LOGGER.error("Weather: Unable to call functions for city registries.")
@@ -74,7 +72,7 @@ async def receive_location_parameter(update: Update, context: CallbackContext) -
     return ConversationHandler.END
     
 
-async def retrieve_city_registries(update: Update, context: CallbackContext, api_key: str) -> None:
+async def retrieve_city_registries(update: Update, context: CallbackContext) -> None:
     """retrieve all the registries with cities that have the same name across the world"""
 
     try:
@@ -90,18 +88,15 @@ async def retrieve_city_registries(update: Update, context: CallbackContext, api
         )
         return   
     
-    # initialise pyowm manager
-    global owm_manager, OWM
-    LOGGER.info("Weather: Initialising manager.")
-    owm_manager = manager.OWM_API_Manager(api_key)
-    OWM = owm_manager.initialise_manager()
-
-    # initialise registry manager
-    global registry_manager
-    registry_manager = manager.RegistryManager(OWM, location)
-    
-    # retrieve and store the city registries
-    city_registries = registry_manager.get_city_ids()
+    # retrieve and store the city registries -> the registry is loaded once and shared by everyone
+    city_registries = await manager.CITY_REGISTRY.get_city_ids(location, matching="prefix")
+    if not city_registries:
+        await update.message.reply_text(
+            reply_to_message_id = context.user_data.get("message_id", "not found"),
+            text = "I couldn't find a location with that name."
+        )
+        return
+
     context.chat_data[location] = city_registries
     LOGGER.info("Weather: Retrieving city registries from chat data.")
     
@@ -131,12 +126,12 @@ async def parse_city_registry_information(update: Update, context: CallbackConte
         return
     
     """if the location only exists in one place then the location"""
-    if registry_manager.is_one_location_result(city_registries): # check to see how many returned results are provided.
+    if manager.CITY_REGISTRY.is_one_location_result(city_registries): # check to see how many returned results are provided.
         LOGGER.info("Weather: Only one location found in registry.")
         city_id = city_registries[0][0]
         name = city_registries[0][1]
         country = city_registries[0][2]   
-        if registry_manager.is_state_available(city_registries, 0): 
+        if manager.CITY_REGISTRY.is_state_available(city_registries, 0): 
             state = city_registries[0][3] 
         else:
             state = ''
@@ -144,11 +139,8 @@ async def parse_city_registry_information(update: Update, context: CallbackConte
         lon = city_registries[0][5]    
         
         # create payload for location information
-        global payload_user_id
-        payload_user_id = update.effective_user.id
-
         payload = {
-            payload_user_id: {
+            update.effective_user.id: {
                 "city_id": city_id,
                 "name": name,
                 "country": country,
@@ -169,7 +161,7 @@ async def parse_city_registry_information(update: Update, context: CallbackConte
             name = city_registries[i][1]
             country = city_registries[i][2]
 
-            if registry_manager.is_state_available(city_registries, i): 
+            if manager.CITY_REGISTRY.is_state_available(city_registries, i): 
                 state = city_registries[i][3] 
             else:
                 state = ''
@@ -253,10 +245,8 @@ async def collect_callback_registry_data(update: Update, context: CallbackContex
     # create payload for location information
     
     try:
-        global payload_user_id
-        payload_user_id = update.callback_query.from_user.id
         payload = {
-            payload_user_id: {
+            update.callback_query.from_user.id: {
                 "city_id": city_id,
                 "name": name,
                 "country": country,
@@ -322,7 +312,7 @@ async def receive_current_forecast_data(update: Update, context: CallbackContext
     """retrieve the data for the current weather forecast"""
 
     try:
-        location_dict = context.user_data.get(payload_user_id)
+        location_dict = context.user_data.get(update.effective_user.id)
         LOGGER.info("Weather: The location payload has been retrieved from user data.")
     except KeyError:
         LOGGER.error("Weather: The location payload was unable to be retrieved from user data.")
@@ -337,12 +327,10 @@ async def receive_current_forecast_data(update: Update, context: CallbackContext
     lat, lon = location_dict['lat'], location_dict['lon']
     weather_manager = manager.WeatherManager(lat, lon)
     
-    response = weather_manager.request_weather()
+    forecast_json_data = await weather_manager.request_weather()
 
     try:
-        if response is not None: # valid response
-            # parse the json data
-            forecast_json_data = json.loads(response.text)
+        if forecast_json_data is not None: # valid response
             main_data = forecast_json_data["main"]
             description = forecast_json_data["weather"][0]["description"] 
             description += f" {weather_manager.return_description_emoji(description)}"
@@ -437,7 +425,7 @@ async def receive_daily_forecast_data(update: Update, context: CallbackContext)
 
     # we'll start by attempting to receive the location information that was parsed into a payload earlier
     try:
-        location_information = context.user_data.get(payload_user_id)
+        location_information = context.user_data.get(update.effective_user.id)
         LOGGER.info("Weather: The location payload has been retrieved from user data.")
     except KeyError:
         LOGGER.error("Weather: The location payload was unable to be retrieved from user data.")
@@ -459,20 +447,17 @@ async def receive_daily_forecast_data(update: Update, context: CallbackContext)
         )
 
     # retrieve the location information
-    location_info = registry_manager.get_location_information(location_information)
+    location_info = manager.CITY_REGISTRY.get_location_information(location_information)
     name, country, state, lat, lon = location_info[0], location_info[1], location_info[2], location_info[3], location_info[4]
     
     if command == "/dayForecast":
         cnt = 8 * duration
     elif command == "/hourForecast":
         cnt = duration
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&units=metric&cnt={cnt}&appid={OWM_API_TOKEN}"
-    response = owm_manager.request_api(url)
+    forecast_json_data = await manager.WeatherManager(lat, lon).request_forecast(cnt)
     
     try:
-        if response is not None:
-            # parse the json data
-            forecast_json_data = json.loads(response.text)
+        if forecast_json_data is not None:
             forecast_list = forecast_json_data["list"]
             forecast_payload = {}
 
@@ -634,6 +619,13 @@ async def cancel_weather(update: Update, context: CallbackContext) -> None:
     return ConversationHandler.END # return the end of the conversation
 
 
+def __stats__():
+    stats = manager.WEATHER_CACHE.stats()
+    return (
+        f"• 🌦️ {stats['size']} cached weather responses, {stats['hits']} hits, {stats['coalesced']} coalesced "
+        f"and {stats['misses']} misses ({stats['hit_rate']:.0%} served without a new request). 🌦️"
+    )
+
 __module_name__ = "Weather"
 __help__ = """
 • `/currentForecast` - Get the current weather forecast for a location
@@ -1,25 +1,26 @@
+import asyncio
 import html
 import random
 import time
 import re
-from functools import partial
-from io import BytesIO
-from typing import Optional
+from collections import deque
+from typing import Optional, Tuple
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ChatPermissions, Chat, User, Message
 from telegram.ext import CallbackContext, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from telegram.constants import ParseMode
 from telegram.helpers import escape_markdown, mention_html, mention_markdown
 
-from src.core.sql import welcome_sql as welcome_sql
-from src import dispatcher, LOGGER, OWNER_ID, DEV_ID
+from src.core.sql import welcome_sql as welcome_sql, CHAT_SETTINGS_GENERATIONS
+from src.core.chat_context import current_chat_settings, get_chat_settings
+from src import dispatcher, LOGGER, OWNER_ID, DEV_ID, RAID_JOIN_THRESHOLD, RAID_JOIN_WINDOW, RAID_BATCH_DELAY
 from src.core.decorators.chat import bot_is_admin, user_is_admin, user_is_ban_protected, is_not_blacklisted
 from src.utils.misc import revert_buttons, build_keyboard
 from src.utils.msg_types import get_welcome_type
-from src.utils.string_handling import markdown_parser, escape_invalid_curly_brackets
-
-from multicolorcaptcha import CaptchaGenerator
+from src.utils.string_handling import markdown_parser, MessageTemplate
+from src.utils.cache import TTLCache
+from src.utils.captcha import CAPTCHA_POOL
 
 VALID_WELCOME_FORMATTERS = [
     "first",
@@ -43,12 +44,59 @@ ENUM_SEND_MAP = {
     welcome_sql.SendTypes.VIDEO.value: dispatcher.bot.send_video,
 }
 
-VERIFIED_USER_WAITLIST = {}
-CAPTCHA_ANS_DICT = {}
+HUMAN_CHECK_TIMEOUT = 120 # seconds a strong welcome mute check can be answered in before the member is kicked
+CAPTCHA_TIMEOUT = 24 * 60 * 60 # seconds an unanswered captcha is kept around for
+
+# chat_id -> [member count, when it was last fetched, when it was last used], only for chats whose messages use {count}
+MEMBER_COUNTS = {}
+MEMBER_COUNT_RESYNC = 60 * 60 # seconds between fetching a tracked count again, joins and leaves keep it current in between
+MEMBER_COUNT_RESYNC_INTERVAL = 10 * 60
+MEMBER_COUNT_IDLE = 24 * 60 * 60 # chats that haven't needed their count for this long stop being tracked
+
+# (chat_id, "welcome" or "goodbye") -> (settings generation, message, compiled message and keyboard)
+MESSAGE_TEMPLATES = TTLCache(3600, maxsize=10000)
+
+SOFT_MUTE_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_audios=False,
+    can_send_documents=False,
+    can_send_photos=False,
+    can_send_videos=False,
+    can_send_video_notes=False,
+    can_send_voice_notes=False,
+    can_send_other_messages=False,
+    can_invite_users=False,
+    can_pin_messages=False,
+    can_send_polls=False,
+    can_change_info=False,
+    can_add_web_page_previews=False,
+)
+FULL_MUTE_PERMISSIONS = ChatPermissions(
+    can_send_messages=False,
+    can_send_audios=False,
+    can_send_documents=False,
+    can_send_photos=False,
+    can_send_videos=False,
+    can_send_video_notes=False,
+    can_send_voice_notes=False,
+    can_send_other_messages=False,
+    can_invite_users=False,
+    can_pin_messages=False,
+    can_send_polls=False,
+    can_change_info=False,
+    can_add_web_page_previews=False,
+)
+
+# join bursts (raids) are welcomed and restricted in one batch instead of member by member
+RAID_JOINS = {} # chat_id -> times of the last RAID_JOIN_THRESHOLD joins
+RAID_BURSTS = {} # chat_id -> the members waiting to be welcomed together
+RAID_CONCURRENCY = 5 # restricts and checks sent at the same time while handling a burst
+RAID_MAX_RETRIES = 5
+RAID_WELCOME_MENTIONS = 20 # members mentioned by name in a burst welcome, the rest are counted
 
 async def send(update, message, keyboard, backup_message):
     chat: Optional[Chat] = update.effective_chat 
-    should_clean = welcome_sql.clean_service(chat.id)   
+    should_clean = await welcome_sql.aio.clean_service(chat.id)   
     reply = update.message.message_id
     
     if should_clean:
@@ -117,21 +165,441 @@ async def send(update, message, keyboard, backup_message):
             LOGGER.exception()
     return msg
 
+def verification_job_name(chat_id, user_id) -> str:
+    return f"verification_{int(chat_id)}_{int(user_id)}"
+
+def arm_verification_timer(job_queue, chat_id, user_id, expires_at) -> None:
+    # a member who left and rejoined before answering still has the old timer, which would expire the new check early
+    cancel_verification_timer(job_queue, chat_id, user_id)
+    job_queue.run_once(
+        verification_expired,
+        max(0, expires_at - time.time()),
+        chat_id=int(chat_id),
+        user_id=int(user_id),
+        name=verification_job_name(chat_id, user_id),
+    )
+
+def cancel_verification_timer(job_queue, chat_id, user_id) -> None:
+    for job in job_queue.get_jobs_by_name(verification_job_name(chat_id, user_id)):
+        job.schedule_removal()
+
+async def send_human_check(chat: Chat, new_member: User, should_welc: bool, res: Optional[str], job_queue, reply=None) -> None:
+    # strong welcome mutes: the member has to press the button in time or they get kicked
+    expires_at = int(time.time() + HUMAN_CHECK_TIMEOUT)
+    await welcome_sql.aio.add_pending_verification(
+        chat.id, new_member.id, "strong", expires_at, should_welcome=should_welc, welcome_text=res,
+    )
+    arm_verification_timer(job_queue, chat.id, new_member.id, expires_at)
+
+    new_join_member = f'<a href="tg://user?id={new_member.id}">{html.escape(new_member.first_name)}</a>'
+    check_message = await call_with_retries(
+        chat.send_message,
+        f"{new_join_member}, click the button below to prove you're human.\nYou have {HUMAN_CHECK_TIMEOUT} seconds.",
+        reply_markup=InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(
+                        text="Yes. I'm human.👨‍⚕️",
+                        callback_data=f"user_join_({new_member.id})"
+                    )
+                ]
+            ]
+        ),
+        parse_mode=ParseMode.HTML,
+        reply_to_message_id=reply or None,
+    )
+    await welcome_sql.aio.set_pending_message(chat.id, new_member.id, check_message.message_id)
+
+async def send_captcha_check(chat: Chat, new_member: User, should_welc: bool, res: Optional[str], job_queue, reply=None) -> None:
+    btn = []
+    # Take a pre-rendered captcha from the pool
+    image, characters = await CAPTCHA_POOL.get()
+
+    expires_at = int(time.time() + CAPTCHA_TIMEOUT)
+    await welcome_sql.aio.add_pending_verification(
+        chat.id, new_member.id, "captcha", expires_at,
+        answer=int(characters), should_welcome=should_welc, welcome_text=res,
+    )
+    arm_verification_timer(job_queue, chat.id, new_member.id, expires_at)
+
+    nums = [random.randint(1000, 9999) for i in range(7)]
+    nums.append(characters)
+    random.shuffle(nums)
+    to_append = []
+
+    for a in nums:
+        to_append.append(
+            InlineKeyboardButton(
+                text=str(a),
+                callback_data=f"user_captchajoin_({chat.id},{new_member.id})_({a})"
+            )
+        )
+        if len(to_append) > 2:
+            btn.append(to_append)
+            to_append = []
+    if to_append:
+        btn.append(to_append)
+
+    captcha_message = await call_with_retries(
+        chat.send_photo,
+        image, # raw bytes rather than a file object, so a retry doesn't send an already read file
+        filename=f"captcha_{new_member.id}.png",
+        caption=f"Welcome [{escape_markdown(new_member.first_name)}](tg://user?id={new_member.id}). "
+        f"Click the correct button to get unmuted!",
+        reply_markup=InlineKeyboardMarkup(btn),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_to_message_id=reply or None,
+    )
+    await welcome_sql.aio.set_pending_message(chat.id, new_member.id, captcha_message.message_id)
+
+async def verification_expired(context: CallbackContext) -> None:
+    bot, job = context.bot, context.job
+    pending = await welcome_sql.aio.remove_pending_verification(job.chat_id, job.user_id)
+    if not pending: # answered in time
+        return
+
+    if pending["mode"] == "strong":
+        try:
+            await bot.unban_chat_member(job.chat_id, job.user_id)
+        except BadRequest:
+            pass
+
+        if pending["message_id"]:
+            try:
+                await bot.edit_message_text(
+                    "*kicks user*\nThey can always rejoin and try.",
+                    chat_id=job.chat_id,
+                    message_id=pending["message_id"],
+                )
+            except BadRequest:
+                pass
+    elif pending["message_id"]:
+        # an old captcha nobody answered, they stay muted until an admin lets them in
+        try:
+            await bot.delete_message(job.chat_id, pending["message_id"])
+        except BadRequest:
+            pass
+
+async def rearm_verifications(context: CallbackContext) -> None:
+    # checks that were still waiting when the bot stopped get their timers back, overdue ones expire straight away
+    pending_checks = welcome_sql.get_all_pending_verifications()
+    for pending in pending_checks:
+        arm_verification_timer(context.job_queue, pending["chat_id"], pending["user_id"], pending["expires_at"])
+
+    if pending_checks:
+        LOGGER.info(f"Re-armed {len(pending_checks)} pending welcome verifications.")
+
+async def send_welcome(bot, chat_id, res, keyboard, welc_type, cust_content, backup_message) -> Optional[Message]:
+    try:
+        if welc_type not in (welcome_sql.SendTypes.TEXT, welcome_sql.SendTypes.BUTTON_TEXT) and cust_content:
+            if welc_type == welcome_sql.SendTypes.STICKER.value:
+                return await ENUM_SEND_MAP[welc_type](chat_id, cust_content, reply_markup=keyboard)
+
+            return await ENUM_SEND_MAP[welc_type](
+                chat_id,
+                cust_content,
+                caption=res,
+                reply_markup=keyboard,
+                parse_mode=ParseMode.MARKDOWN,
+            )
+
+        return await bot.send_message(chat_id, res, parse_mode=ParseMode.MARKDOWN, reply_markup=keyboard)
+    except BadRequest:
+        return await bot.send_message(chat_id, backup_message, parse_mode=ParseMode.MARKDOWN)
+
+async def replace_clean_welcome(bot, chat_id, sent: Optional[Message]) -> None:
+    prev_welc = await welcome_sql.aio.get_clean_welcome_preference(chat_id)
+    if prev_welc:
+        try:
+            await bot.delete_message(chat_id, prev_welc)
+        except BadRequest:
+            pass
+
+        if sent:
+            await welcome_sql.aio.set_clean_welcome(chat_id, sent.message_id)
+
+async def send_verified_welcome(bot, chat: Chat, user: User, res: Optional[str]) -> None:
+    # the welcome held back until the member proved they're human
+    settings = await get_chat_settings(chat.id)
+    _, cust_welcome, cust_content, welc_type = settings["welcome"]
+    keyboard = (await get_message_template(chat.id, "welcome", cust_welcome))[1] if cust_welcome else InlineKeyboardMarkup([])
+    backup_message = random.choice(welcome_sql.DEFAULT_WELCOME_MESSAGES).format(
+        first=escape_markdown(user.first_name or "PersonWithNoName")
+    )
+
+    sent = await send_welcome(bot, chat.id, res or backup_message, keyboard, welc_type, cust_content, backup_message)
+    await replace_clean_welcome(bot, chat.id, sent)
+
+async def get_member_count(chat: Chat) -> int:
+    """
+    Returns the member count of a chat from the tracker, only asking telegram the first time it's needed.
+    :param chat: The chat to get the member count of.
+    :return: The number of members in the chat.
+    """
+    tracked = MEMBER_COUNTS.get(chat.id)
+    if tracked is None:
+        count = await chat.get_member_count()
+        MEMBER_COUNTS[chat.id] = [count, time.monotonic(), time.monotonic()]
+        return count
+
+    tracked[2] = time.monotonic()
+    return tracked[0]
+
+def adjust_member_count(chat_id: int, change: int) -> None:
+    # joins and leaves only move counts that are already being tracked
+    tracked = MEMBER_COUNTS.get(chat_id)
+    if tracked is not None:
+        tracked[0] = max(0, tracked[0] + change)
+
+async def resync_member_counts(context: CallbackContext) -> None:
+    # service messages can be missed (or hidden in big groups), so every tracked count is fetched again now and then
+    now = time.monotonic()
+    for chat_id, (count, synced_at, used_at) in list(MEMBER_COUNTS.items()):
+        if now - used_at > MEMBER_COUNT_IDLE:
+            MEMBER_COUNTS.pop(chat_id, None)
+            continue
+
+        if now - synced_at < MEMBER_COUNT_RESYNC:
+            continue
+
+        try:
+            count = await context.bot.get_chat_member_count(chat_id)
+        except (BadRequest, Forbidden): # the bot isn't in the chat any more
+            MEMBER_COUNTS.pop(chat_id, None)
+            continue
+        except TelegramError:
+            continue
+
+        tracked = MEMBER_COUNTS.get(chat_id)
+        if tracked is not None:
+            tracked[0], tracked[1] = count, time.monotonic()
+
+async def get_message_template(chat_id, kind: str, text: str) -> Tuple[MessageTemplate, InlineKeyboardMarkup]:
+    """
+    Returns a chat's welcome or goodbye message and buttons, compiling them the first time they're needed.
+    They're compiled again once a welcome setter has invalidated the chat's settings.
+    :param chat_id: The chat the message belongs to.
+    :param kind: Either "welcome" or "goodbye".
+    :param text: The chat's custom message.
+    :return: The compiled message and its keyboard.
+    """
+    key = (int(chat_id), kind)
+    generation = CHAT_SETTINGS_GENERATIONS.get(int(chat_id), 0)
+
+    cached = MESSAGE_TEMPLATES.get(key)
+    if cached is not None and cached[0] == generation and cached[1] == text:
+        return cached[2]
+
+    get_buttons = welcome_sql.aio.get_welc_buttons if kind == "welcome" else welcome_sql.aio.get_gdbye_buttons
+    compiled = (
+        MessageTemplate(text, VALID_WELCOME_FORMATTERS),
+        InlineKeyboardMarkup(build_keyboard(await get_buttons(chat_id))),
+    )
+    MESSAGE_TEMPLATES.set(key, (generation, text, compiled))
+    return compiled
+
+def member_template_values(chat: Chat, member: User, count) -> dict:
+    first_name = member.first_name or "PersonWithNoName"
+    if member.last_name:
+        fullname = escape_markdown(f"{first_name} {member.last_name}")
+    else:
+        fullname = escape_markdown(first_name)
+
+    mention = mention_markdown(member.id, escape_markdown(first_name))
+    if member.username:
+        username = "@" + escape_markdown(member.username)
+    else:
+        username = mention
+
+    return {
+        "first": escape_markdown(first_name),
+        "last": escape_markdown(member.last_name or first_name),
+        "fullname": escape_markdown(fullname),
+        "username": username,
+        "mention": mention,
+        "count": count,
+        "chatname": escape_markdown(chat.title),
+        "id": member.id,
+    }
+
+def is_join_burst(chat_id: int, joined: int) -> bool:
+    """
+    Records joins in a chat and checks whether they're coming in fast enough to be a raid.
+    :param chat_id: The chat the members joined.
+    :param joined: How many members joined.
+    :return: True if the chat is in the middle of a join burst.
+    """
+    now = time.monotonic()
+    joins = RAID_JOINS.get(chat_id)
+    if joins is None:
+        joins = RAID_JOINS[chat_id] = deque(maxlen=RAID_JOIN_THRESHOLD)
+    joins.extend([now] * joined)
+
+    if chat_id in RAID_BURSTS:
+        return True
+
+    # only the last RAID_JOIN_THRESHOLD joins are kept, so it's a burst if the oldest is still in the window
+    return len(joins) == RAID_JOIN_THRESHOLD and now - joins[0] <= RAID_JOIN_WINDOW
+
+def queue_join_burst(chat: Chat, members: list, message_id: int, job_queue) -> None:
+    # the first joins of a burst schedule the batch, everyone joining before it runs is added to it
+    burst = RAID_BURSTS.get(chat.id)
+    if burst is None:
+        LOGGER.info(f"Join burst detected in {chat.id}, welcoming new members in a batch.")
+        burst = RAID_BURSTS[chat.id] = {"chat": chat, "members": {}, "service_messages": []}
+        job_queue.run_once(welcome_join_burst, RAID_BATCH_DELAY, chat_id=chat.id, name=f"join_burst_{chat.id}")
+
+    for member in members:
+        burst["members"][member.id] = member
+    burst["service_messages"].append(message_id)
+
+async def call_with_retries(func, *args, **kwargs):
+    """
+    Makes a single bot api call, waiting out flood limits and trying again up to RAID_MAX_RETRIES times.
+    Only wrap one call in this, a function that does more would repeat the rest of its work on every retry.
+    :return: Whatever the call returns.
+    """
+    for attempt in range(1, RAID_MAX_RETRIES + 1):
+        try:
+            return await func(*args, **kwargs)
+        except RetryAfter as excp:
+            if attempt == RAID_MAX_RETRIES:
+                raise
+            await asyncio.sleep(excp.retry_after)
+
+async def call_throttled(semaphore: asyncio.Semaphore, func, *args, retry: bool = True, **kwargs) -> bool:
+    # a failure for one member is logged and skipped, so it doesn't abort the rest of the burst
+    async with semaphore:
+        try:
+            if retry:
+                await call_with_retries(func, *args, **kwargs)
+            else:
+                await func(*args, **kwargs)
+            return True
+        except TelegramError as excp:
+            LOGGER.warning(f"Join burst: {func.__name__} failed: {excp.message}")
+            return False
+        except Exception:
+            # e.g. the database failing to store a member's pending check
+            LOGGER.exception(f"Join burst: {func.__name__} failed.")
+            return False
+
+def format_burst_welcome(chat: Chat, members: list, template: Optional[MessageTemplate], count) -> str:
+    mentions = [
+        mention_markdown(member.id, escape_markdown(member.first_name or "PersonWithNoName"))
+        for member in members[:RAID_WELCOME_MENTIONS]
+    ]
+    if len(members) > RAID_WELCOME_MENTIONS:
+        mentions.append(f"{len(members) - RAID_WELCOME_MENTIONS} others")
+    names = ", ".join(mentions)
+
+    if not template:
+        return random.choice(welcome_sql.DEFAULT_WELCOME_MESSAGES).format(first=names)
+
+    return template.render(
+        first=names,
+        last=names,
+        fullname=names,
+        username=names,
+        mention=names,
+        count=count,
+        chatname=escape_markdown(chat.title),
+        id=", ".join(str(member.id) for member in members),
+    )
+
+async def welcome_join_burst(context: CallbackContext) -> None:
+    """
+    Welcomes every member that joined during a burst with a single message, after restricting
+    them all at once. The chat's welcome settings are only looked up once for the whole burst.
+    """
+    bot = context.bot
+    burst = RAID_BURSTS.pop(context.job.chat_id, None)
+    if not burst:
+        return
+
+    chat, members = burst["chat"], list(burst["members"].values())
+    settings = await get_chat_settings(chat.id)
+    should_welc, cust_welcome, cust_content, welc_type = settings["welcome"]
+    welc_mutes = (settings["welcome_mutes"] or "").lower()
+    semaphore = asyncio.Semaphore(RAID_CONCURRENCY)
+    LOGGER.info(f"Join burst: welcoming {len(members)} new members in {chat.id}.")
+
+    # Clean service welcome
+    if settings["clean_service"]:
+        service_messages = burst["service_messages"]
+        await asyncio.gather(*(
+            call_throttled(semaphore, bot.delete_messages, chat.id, service_messages[i:i + 100])
+            for i in range(0, len(service_messages), 100)
+        ))
+
+    # admins and bots are never muted, the admin roster is cached so this is one lookup for the whole burst
+    to_mute = [
+        member for member in members
+        if not member.is_bot and not await user_is_ban_protected(chat, member.id)
+    ]
+
+    if to_mute and welc_mutes == "soft":
+        until_date = int(time.time() + 24 * 60 * 60)
+        await asyncio.gather(*(
+            call_throttled(semaphore, chat.restrict_member, member.id, permissions=SOFT_MUTE_PERMISSIONS, until_date=until_date)
+            for member in to_mute
+        ))
+    elif to_mute and welc_mutes in ("strong", "captcha"):
+        await asyncio.gather(*(
+            call_throttled(semaphore, chat.restrict_member, member.id, permissions=FULL_MUTE_PERMISSIONS)
+            for member in to_mute
+        ))
+
+        # everyone still has to prove they're human on their own, but the whole burst shares the welcome below
+        # instead of being welcomed one by one once they're verified.
+        # the checks retry their own message, retrying the whole check would arm its timer again
+        send_check = send_human_check if welc_mutes == "strong" else send_captcha_check
+        await asyncio.gather(*(
+            call_throttled(semaphore, send_check, chat, member, False, None, context.job_queue, retry=False)
+            for member in to_mute
+        ))
+
+    if not should_welc:
+        return
+
+    template, keyboard = None, InlineKeyboardMarkup([])
+    if cust_welcome and cust_welcome != welcome_sql.DEFAULT_WELCOME:
+        template, keyboard = await get_message_template(chat.id, "welcome", cust_welcome)
+
+    count = await get_member_count(chat) if template and "count" in template.fields else None
+    res = format_burst_welcome(chat, members, template, count)
+
+    sent = await send_welcome(
+        bot, chat.id, res, keyboard, welc_type, cust_content, format_burst_welcome(chat, members, None, count),
+    )
+    await replace_clean_welcome(bot, chat.id, sent)
+
 async def new_member(update: Update, context: CallbackContext):
     bot, job_queue = context.bot, context.job_queue
     chat: Optional[Chat] = update.effective_chat
     user: Optional[User] = update.effective_user
     message: Optional[Message] = update.effective_message
 
-    should_welc, cust_welcome, cust_content, welc_type = welcome_sql.get_welc_pref(chat.id)
-    welc_mutes = welcome_sql.welcome_mutes(chat.id)
+    new_members = update.effective_message.new_chat_members
+    adjust_member_count(chat.id, len(new_members))
+
+    # during a raid the regular joins are handed over to the burst batch, only the special welcomes happen here
+    if is_join_burst(chat.id, len(new_members)):
+        burst_members = [member for member in new_members if member.id not in (OWNER_ID, DEV_ID, bot.id)]
+        if burst_members:
+            queue_join_burst(chat, burst_members, message.message_id, job_queue)
+            new_members = [member for member in new_members if member.id in (OWNER_ID, DEV_ID, bot.id)]
+            if not new_members:
+                return ""
+
+    settings = await current_chat_settings(update, context)
+    should_welc, cust_welcome, cust_content, welc_type = settings["welcome"]
+    welc_mutes = settings["welcome_mutes"]
     
     if bool(welc_mutes):
         welc_mutes = welc_mutes.lower()
 
-    human_checks = welcome_sql.get_human_checks(user.id, chat.id)
-
-    new_members = update.effective_message.new_chat_members
+    human_checks = await welcome_sql.aio.get_human_checks(user.id, chat.id)
 
     for new_member in new_members:
         welcome_log = None
@@ -143,7 +611,7 @@ async def new_member(update: Update, context: CallbackContext):
 
         if should_welc:
             reply = update.message.message_id
-            should_clean = welcome_sql.clean_service(chat.id)
+            should_clean = settings["clean_service"]
 
             # Clean service welcome 
             if should_clean:
@@ -208,9 +676,6 @@ async def new_member(update: Update, context: CallbackContext):
                 continue
             
             else:
-                buttons = welcome_sql.get_welc_buttons(chat.id)
-                keyb = build_keyboard(buttons)
-
                 if welc_type not in (welcome_sql.SendTypes.TEXT, welcome_sql.SendTypes.BUTTON_TEXT):
                     media_wel = True 
                 
@@ -219,47 +684,25 @@ async def new_member(update: Update, context: CallbackContext):
                 )
 
                 if cust_welcome:
+                    template, keyboard = await get_message_template(chat.id, "welcome", cust_welcome)
+
                     if cust_welcome == welcome_sql.DEFAULT_WELCOME:
-                        cust_welcome = random.choice(
+                        # a different default every time, nothing to fill in apart from the name
+                        res = random.choice(
                             welcome_sql.DEFAULT_WELCOME_MESSAGES
                         ).format(first=escape_markdown(first_name))
-
-                    if new_member.last_name:
-                        fullname = escape_markdown(f"{first_name} {new_member.last_name}")
-                    else:
-                        fullname = escape_markdown(first_name)
-                    
-                    count = await chat.get_member_count()
-                    mention = mention_markdown(new_member.id, escape_markdown(first_name))
-
-                    if new_member.username:
-                        username = "@" + escape_markdown(new_member.username)
                     else:
-                        username = mention
-
-                    valid_format = escape_invalid_curly_brackets(
-                        cust_welcome, VALID_WELCOME_FORMATTERS
-                    )
-                    res = valid_format.format(
-                        first=escape_markdown(first_name),
-                        last=escape_markdown(new_member.last_name or first_name),
-                        fullname=escape_markdown(fullname),
-                        username=username,
-                        mention=mention,
-                        count=count,
-                        chatname=escape_markdown(chat.title),
-                        id=new_member.id,
-                    )
+                        count = await get_member_count(chat) if "count" in template.fields else None
+                        res = template.render(**member_template_values(chat, new_member, count))
                 else:
                     res = random.choice(welcome_sql.DEFAULT_WELCOME_MESSAGES).format(
                         first=escape_markdown(first_name)
                     )
-                    keyb = []
+                    keyboard = InlineKeyboardMarkup([])
 
                 backup_message = random.choice(welcome_sql.DEFAULT_WELCOME_MESSAGES).format(
                     first=escape_markdown(first_name)
                 )
-                keyboard = InlineKeyboardMarkup(keyb)
         else:
             welcome_bool = False
             res = None 
@@ -284,176 +727,26 @@ async def new_member(update: Update, context: CallbackContext):
                     LOGGER.info("WELCOME MUTES ARE SOFT SO WILL RESTRICT")
                     await chat.restrict_member(
                         new_member.id,
-                        permissions=ChatPermissions(
-                            can_send_messages=True,
-                            can_send_media_messages=False,
-                            can_send_other_messages=False,
-                            can_invite_users=False,
-                            can_pin_messages=False,
-                            can_send_polls=False,
-                            can_change_info=False,
-                            can_add_web_page_previews=False,
-                        ),
+                        permissions=SOFT_MUTE_PERMISSIONS,
                         until_date=(int(time.time() + 24 * 60 * 60)),
                     )
                     LOGGER.info("CHAT MEMBER RESTRICTED UNDER SOFT MUTE")
                 if welc_mutes == "strong":
                     LOGGER.info("WELCOME MUTES ARE STRONG SO WILL HEAVILY RESTRICT")
                     welcome_bool = False
-                    if not media_wel:
-                        VERIFIED_USER_WAITLIST.update(
-                            {
-                                new_member.id: {
-                                    "should_welc": should_welc,
-                                    "media_wel": False,
-                                    "status": False,
-                                    "update": update,
-                                    "res": res,
-                                    "keyboard": keyboard,
-                                    "backup_message": backup_message
-                                }
-                            }
-                        )
-                    else:
-                        VERIFIED_USER_WAITLIST.update(
-                            {
-                                new_member.id: {
-                                    "should_welc": should_welc,
-                                    "chat_id": chat.id,
-                                    "media_wel": True,
-                                    "status": False,
-                                    "cust_content": cust_content,
-                                    "welc_type": welc_type,
-                                    "res": res,
-                                    "keyboard": keyboard,
-                                }
-                            }
-                        )
-                    new_join_member = f'<a href="tg://user?id={user.id}">{html.escape(new_member.first_name)}</a>'
-                    check_message = await message.reply_text(
-                        f"{new_join_member}, click the button below to prove you're human.\nYou have 120 seconds.",
-                        reply_markup=InlineKeyboardMarkup(
-                            [
-                                [
-                                    InlineKeyboardButton(
-                                        text="Yes. I'm human.👨‍⚕️",
-                                        callback_data=f"user_join_({new_member.id})"
-                                    )
-                                ]
-                            ]
-                        ),
-                        parse_mode=ParseMode.HTML,
-                        reply_to_message_id=reply,
-                    )
+                    await send_human_check(chat, new_member, should_welc, res, job_queue, reply)
                     await chat.restrict_member(
                         new_member.id,
-                        permissions=ChatPermissions(
-                            can_send_messages=False,
-                            can_send_media_messages=False,
-                            can_send_other_messages=False,
-                            can_invite_users=False,
-                            can_pin_messages=False,
-                            can_send_polls=False,
-                            can_change_info=False,
-                            can_add_web_page_previews=False,
-                        )
-                    )
-                    job_queue.run_once(
-                        partial(check_not_bot, new_member, chat.id, check_message.message_id),
-                        120,
-                        name="welcomemute"
+                        permissions=FULL_MUTE_PERMISSIONS,
                     )
             if welc_mutes == "captcha":
                 LOGGER.info("WELCOME MUTE IS CAPTCHA")
-                btn = []
-                # Captcha image size number (2 -> 640x360)
-                CAPTCHA_SIZE_NUM = 2
-
-                # Create Captcha Generator object of specified size 
-                generator = CaptchaGenerator(CAPTCHA_SIZE_NUM)
-
-                # Generate a captcha image 
-                captcha = generator.gen_captcha_image(difficult_level=3)
-                # Get information 
-                image = captcha["image"]
-                characters = captcha["characters"]
-                fileobj = BytesIO()
-                fileobj.name = f"captcha_{new_member.id}.png"
-                image.save(fp=fileobj)
-                fileobj.seek(0)
-                CAPTCHA_ANS_DICT[(chat.id, new_member.id)] = int(characters)
                 welcome_bool = False 
-                if not media_wel:
-                    VERIFIED_USER_WAITLIST.update(
-                        {
-                            (chat.id, new_member.id): {
-                                "should_welc": should_welc,
-                                "media_wel": False,
-                                "status": False,
-                                "update": update,
-                                "res": res,
-                                "keyboard": keyboard,
-                                "backup_message": backup_message,
-                                "captcha_correct": characters,
-                            }
-                        }
-                    )
-                else:
-                    VERIFIED_USER_WAITLIST.update(
-                        {
-                            (chat.id, new_member.id): {
-                                "should_welc": should_welc,
-                                "chat_id": chat.id,
-                                "status": False,
-                                "media_wel": True,
-                                "cust_content": cust_content,
-                                "welc_type": welc_type,
-                                "res": res,
-                                "keyboard": keyboard,
-                                "captcha_correct": characters,
-                            }
-                        }
-                    )
-                
-                nums = [random.randint(1000, 9999) for i in range(7)]
-                nums.append(characters)
-                random.shuffle(nums)
-                to_append = []
-
-                for a in nums:
-                    to_append.append(
-                        InlineKeyboardButton(
-                            text=str(a),
-                            callback_data=f"user_captchajoin_({chat.id},{new_member.id})_({a})"
-                        )
-                    )
-                    if len(to_append) > 2:
-                        btn.append(to_append)
-                        to_append = []
-                if to_append:
-                    btn.append(to_append)
-
-                await message.reply_photo(
-                    fileobj,
-                    caption=f"Welcome [{escape_markdown(new_member.first_name)}](tg://user?id={new_member.id}). "
-                    f"Click the correct button to get unmuted!",
-                    reply_markup=InlineKeyboardMarkup(btn),
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_to_message_id=reply,
-                )
+                await send_captcha_check(chat, new_member, should_welc, res, job_queue, reply)
 
                 await chat.restrict_member(
                     new_member.id, 
-                    permissions=ChatPermissions(
-                        can_send_messages=False,
-                        can_send_media_messages=False,
-                        can_send_other_messages=False,
-                        can_invite_users=False,
-                        can_pin_messages=False,
-                        can_send_polls=False,
-                        can_change_info=False,
-                        can_add_web_page_previews=False,
-                    ),
+                    permissions=FULL_MUTE_PERMISSIONS,
                 )
         
         if welcome_bool:
@@ -476,7 +769,7 @@ async def new_member(update: Update, context: CallbackContext):
                     )
             else:
                 sent = await send(update, res, keyboard, backup_message)
-            prev_welc = welcome_sql.get_clean_welcome_preference(chat.id)
+            prev_welc = await welcome_sql.aio.get_clean_welcome_preference(chat.id)
             if prev_welc:
                 try:
                     await bot.delete_message(chat.id, prev_welc)
@@ -484,7 +777,7 @@ async def new_member(update: Update, context: CallbackContext):
                     pass
 
                 if sent:
-                    welcome_sql.set_clean_welcome(chat.id, sent.message_id)
+                    await welcome_sql.aio.set_clean_welcome(chat.id, sent.message_id)
             
         if welcome_log:
             return welcome_log 
@@ -497,37 +790,22 @@ async def new_member(update: Update, context: CallbackContext):
         )
     return ""
 
-async def check_not_bot(member, chat_id, message_id, context):
-    bot = context.bot
-    member_dict = VERIFIED_USER_WAITLIST.pop(member.id)
-    member_status = member_dict.get("status")
-    if not member_status:
-        try:
-            await bot.unban_chat_member(chat_id, member.id)
-        except:
-            pass 
-
-        try:
-            await bot.edit_message_text(
-                "*kicks user*\nThey can always rejoin and try.",
-                chat_id=chat_id,
-                message_id=message_id,
-            )
-        except:
-            pass
-
 async def left_member(update: Update, context: CallbackContext):
     bot = context.bot 
     chat: Optional[Chat] = update.effective_chat
     user: Optional[User] = update.effective_user 
-    should_goodbye, cust_goodbye, goodbye_type = welcome_sql.get_gdbye_pref(chat.id)
+    settings = await current_chat_settings(update, context)
+    should_goodbye, cust_goodbye, goodbye_type = settings["goodbye"]
+
+    if update.effective_message.left_chat_member:
+        adjust_member_count(chat.id, -1)
 
     if user.id == bot.id:
         return 
     
     if should_goodbye:
         reply = update.effective_message.message_id 
-        should_clean = welcome_sql.clean_service(chat.id)
+        should_clean = settings["clean_service"]
 
         # Clean service welcome 
         if should_clean:
@@ -566,51 +844,27 @@ async def left_member(update: Update, context: CallbackContext):
             )
 
             if cust_goodbye:
+                template, keyboard = await get_message_template(chat.id, "goodbye", cust_goodbye)
+
                 if cust_goodbye == welcome_sql.DEFAULT_GOODBYE:
-                    cust_goodbye = random.choice(welcome_sql.DEFAULT_GOODBYE_MESSAGES).format(
+                    res = random.choice(welcome_sql.DEFAULT_GOODBYE_MESSAGES).format(
                         first=escape_markdown(first_name)
                     )
-                if left_member.last_name:
-                    fullname = escape_markdown(f"{first_name} {left_member.last_name}")
                 else:
-                    fullname = escape_markdown(first_name)
-                    
-                count = await chat.get_member_count()
-                mention = mention_markdown(left_member.id, escape_markdown(first_name))
-                if left_member.username:
-                    username = "@" + escape_markdown(left_member.username)
-                else:
-                    username = mention
-                
-                valid_format = escape_invalid_curly_brackets(
-                    cust_goodbye, VALID_WELCOME_FORMATTERS
-                )
-                res = valid_format.format(
-                    first=escape_markdown(first_name),
-                    last=escape_markdown(left_member.last_name or first_name),
-                    fullname=escape_markdown(fullname),
-                    username=username,
-                    mention=mention,
-                    count=count,
-                    chatname=escape_markdown(chat.title),
-                    id=left_member.id,
-                )
-                buttons = welcome_sql.get_gdbye_buttons(chat.id)
-                keyb = build_keyboard(buttons)
+                    count = await get_member_count(chat) if "count" in template.fields else None
+                    res = template.render(**member_template_values(chat, left_member, count))
             else:
                 res = random.choice(welcome_sql.DEFAULT_GOODBYE_MESSAGES).format(
                     first=first_name,
                 )
-                keyb = []
-            
-            keyboard = InlineKeyboardMarkup(keyb)
+                keyboard = InlineKeyboardMarkup([])
 
             sent = await send(
                 update, res, keyboard, 
                 random.choice(welcome_sql.DEFAULT_GOODBYE_MESSAGES).format(first=first_name),
             )
 
-            prev_goodbye = welcome_sql.get_clean_goodbye_preference(chat.id)
+            prev_goodbye = await welcome_sql.aio.get_clean_goodbye_preference(chat.id)
 
             if prev_goodbye:
                 try:
@@ -619,7 +873,7 @@ async def left_member(update: Update, context: CallbackContext):
                     pass 
 
                 if sent:
-                    welcome_sql.set_clean_goodbye(chat.id, sent.message_id)
+                    await welcome_sql.aio.set_clean_goodbye(chat.id, sent.message_id)
 
 @bot_is_admin
 @user_is_admin
@@ -630,7 +884,7 @@ async def welcome(update: Update, context: CallbackContext):
 
     if not args or args[0].lower() == "noformat":
         noformat = True
-        pref, welcome_m, cust_content, welcome_type = welcome_sql.get_welc_pref(chat.id)
+        pref, welcome_m, cust_content, welcome_type = await welcome_sql.aio.get_welc_pref(chat.id)
         
         await update.effective_message.reply_text(
             f"This chat has its welcome setting set to: `{pref}`.\n"
@@ -639,7 +893,7 @@ async def welcome(update: Update, context: CallbackContext):
         )
 
         if welcome_type == welcome_sql.SendTypes.TEXT or welcome_type == welcome_sql.SendTypes.BUTTON_TEXT:
-            buttons = welcome_sql.get_welc_buttons(chat.id)
+            buttons = await welcome_sql.aio.get_welc_buttons(chat.id)
             if noformat:
                 welcome_m += revert_buttons(buttons)
                 await update.effective_message.reply_text(welcome_m)
@@ -649,7 +903,7 @@ async def welcome(update: Update, context: CallbackContext):
 
                 await send(update, welcome_m, keyboard, welcome_sql.DEFAULT_WELCOME)
         else:
-            buttons = welcome_sql.get_welc_buttons(chat.id)
+            buttons = await welcome_sql.aio.get_welc_buttons(chat.id)
             if noformat:
                 welcome_m += revert_buttons(buttons)
                 await ENUM_SEND_MAP[welcome_type](chat.id, cust_content, caption=welcome_m)
@@ -666,13 +920,13 @@ async def welcome(update: Update, context: CallbackContext):
                 )
     elif len(args) >= 1:
         if args[0].lower() in ("on", "yes"):
-            welcome_sql.set_welc_preference(chat.id, True)
+            await welcome_sql.aio.set_welc_preference(chat.id, True)
             await update.effective_message.reply_text(
                 "Great! I will now greet members when they join."
             )
         elif args[0].lower() in ("off", "no"):
             LOGGER.info("WELCOME WILL BE DISABLED")
-            welcome_sql.set_welc_preference(chat.id, False)
+            await welcome_sql.aio.set_welc_preference(chat.id, False)
             await update.effective_message.reply_text(
                 "Okay! I will not greet users when they join the group"
             )
@@ -690,7 +944,7 @@ async def goodbye(update: Update, context: CallbackContext):
 
     if not args or args[0] == "noformat":
         noformat = True
-        pref, goodbye_m, goodbye_type = welcome_sql.get_gdbye_pref(chat.id)
+        pref, goodbye_m, goodbye_type = await welcome_sql.aio.get_gdbye_pref(chat.id)
 
         await update.effective_message.reply_text(
             f"This chat has its goodbye setting to: `{pref}`.\n"
@@ -699,7 +953,7 @@ async def goodbye(update: Update, context: CallbackContext):
         )
 
         if goodbye_type == welcome_sql.SendTypes.BUTTON_TEXT:
-            buttons = welcome_sql.get_gdbye_buttons(chat.id)
+            buttons = await welcome_sql.aio.get_gdbye_buttons(chat.id)
             if noformat:
                 goodbye_m += revert_buttons(buttons)
                 await update.effective_message.reply_text(goodbye_m)
@@ -717,12 +971,12 @@ async def goodbye(update: Update, context: CallbackContext):
                 )
     elif len(args) >= 1:
         if args[0].lower() in ("on", "yes"):
-            welcome_sql.set_gdbye_pref(chat.id, True)
+            await welcome_sql.aio.set_gdbye_pref(chat.id, True)
             await update.effective_message.reply_text(
                 "Great! I'll say goodbye to members when they leave."
             )
         elif args[0].lower() in ("off", "no"):
-            welcome_sql.set_gdbye_pref(chat.id, False)
+            await welcome_sql.aio.set_gdbye_pref(chat.id, False)
             await update.effective_message.reply_text(
                 "Okay! I won't say goodbye to members when they leave."
             )
@@ -746,7 +1000,7 @@ async def set_welcome(update: Update, context: CallbackContext) -> str:
         await message.reply_text("You didn't specify what to reply with!")
         return 
 
-    welcome_sql.set_custom_welcome(chat.id, content, text, data_type, buttons)
+    await welcome_sql.aio.set_custom_welcome(chat.id, content, text, data_type, buttons)
     await message.reply_text("Successfully set custom welcome message!")
 
     return (
@@ -763,7 +1017,7 @@ async def reset_welcome(update: Update, context: CallbackContext) -> str:
     chat: Optional[Chat] = update.effective_chat
     user: Optional[User] = update.effective_user
 
-    welcome_sql.set_custom_welcome(chat.id, None, welcome_sql.DEFAULT_WELCOME, welcome_sql.SendTypes.TEXT)
+    await welcome_sql.aio.set_custom_welcome(chat.id, None, welcome_sql.DEFAULT_WELCOME, welcome_sql.SendTypes.TEXT)
     await update.effective_message.reply_text(
         "Successfully reset welcome message to default!"
     )
@@ -791,7 +1045,7 @@ async def set_goodbye(update: Update, context: CallbackContext) -> str:
             await message.reply_text("You didn't specify what to reply with!")
             return ""
         
-        welcome_sql.set_custom_goodbye(chat.id, content or text, data_type, buttons)
+        await welcome_sql.aio.set_custom_goodbye(chat.id, content or text, data_type, buttons)
         await message.reply_text("Successfully set custom goodbye message!")
 
         return (
@@ -812,7 +1066,7 @@ async def reset_goodbye(update: Update, context: CallbackContext) -> str:
     chat: Optional[Chat] = update.effective_chat
     user: Optional[User] = update.effective_user
 
-    welcome_sql.set_custom_goodbye(chat.id, welcome_sql.DEFAULT_GOODBYE, welcome_sql.SendTypes.TEXT)
+    await welcome_sql.aio.set_custom_goodbye(chat.id, welcome_sql.DEFAULT_GOODBYE, welcome_sql.SendTypes.TEXT)
     await update.effective_message.reply_text(
         "Successfully reset goodbye message to default!"
     )
@@ -835,7 +1089,7 @@ async def welcomemute(update: Update, context: CallbackContext) -> str:
 
     if len(args) >= 1:
         if args[0].lower() in ("off", "no"):
-            welcome_sql.set_welcome_mutes(chat.id, False)
+            await welcome_sql.aio.set_welcome_mutes(chat.id, False)
             await message.reply_text(
                 "I will no longer mute people on joining!"
             )
@@ -847,7 +1101,7 @@ async def welcomemute(update: Update, context: CallbackContext) -> str:
                 f"Has toggled welcome mute to <b>OFF</b>."
             )
         elif args[0].lower() in ["soft"]:
-            welcome_sql.set_welcome_mutes(chat.id, "soft")
+            await welcome_sql.aio.set_welcome_mutes(chat.id, "soft")
             await message.reply_text(
                 "I will restrict users' permissions to send media for 24 hours."
             )
@@ -859,7 +1113,7 @@ async def welcomemute(update: Update, context: CallbackContext) -> str:
                 f"Has toggled welcome mute to <b>SOFT</b>."
             )
         elif args[0].lower() in ["strong"]:
-            welcome_sql.set_welcome_mutes(chat.id, "strong")
+            await welcome_sql.aio.set_welcome_mutes(chat.id, "strong")
             await message.reply_text(
                 "I will now mute people when they join until they prove they're a human.\nThey'll have 120 seconds otherwise they'll be kicked."
             )
@@ -872,7 +1126,7 @@ async def welcomemute(update: Update, context: CallbackContext) -> str:
             )
     
         elif args[0].lower() in ["captcha"]:
-            welcome_sql.set_welcome_mutes(chat.id, "captcha")
+            await welcome_sql.aio.set_welcome_mutes(chat.id, "captcha")
             await message.reply_text(
                 "I will now mute people when they join until they prove they're not a bot.\nThey have to solve a captcha to get unmuted."
             )
@@ -889,7 +1143,7 @@ async def welcomemute(update: Update, context: CallbackContext) -> str:
                 parse_mode=ParseMode.MARKDOWN,
             )
     else:
-        current_setting = welcome_sql.welcome_mutes(chat.id)
+        current_setting = await welcome_sql.aio.welcome_mutes(chat.id)
         if current_setting == "0":
             current_setting = "false"
         reply = (
@@ -908,7 +1162,7 @@ async def clean_welcome(update: Update, context: CallbackContext) -> str:
     user: Optional[User] = update.effective_user
 
     if not args:
-        welcome_clean_pref = welcome_sql.get_clean_welcome_preference(chat.id)
+        welcome_clean_pref = await welcome_sql.aio.get_clean_welcome_preference(chat.id)
         if welcome_clean_pref:
             await update.effective_message.reply_text(
                 "I should be deleting welcome messages up to two days old."
@@ -920,7 +1174,7 @@ async def clean_welcome(update: Update, context: CallbackContext) -> str:
         return ""
     
     if args[0].lower() in ("on", "yes"):
-        welcome_sql.set_clean_welcome(chat.id, True)
+        await welcome_sql.aio.set_clean_welcome(chat.id, True)
         await update.effective_message.reply_text("I'll try to delete old welcome messages.")
 
         return (
@@ -930,7 +1184,7 @@ async def clean_welcome(update: Update, context: CallbackContext) -> str:
             f"Has toggled clean welcomes to <code>ON</code>."
         )
     elif args[0].lower() in ("off", "no"):
-        welcome_sql.set_clean_welcome(chat.id, False)
+        await welcome_sql.aio.set_clean_welcome(chat.id, False)
         await update.effective_message.reply_text("I won't delete old welcome messages.")
 
         return (
@@ -952,7 +1206,7 @@ async def clean_goodbye(update: Update, context: CallbackContext) -> str:
     user: Optional[User] = update.effective_user
 
     if not args:
-        goodbye_clean_pref = welcome_sql.get_clean_goodbye_preference(chat.id)
+        goodbye_clean_pref = await welcome_sql.aio.get_clean_goodbye_preference(chat.id)
         if goodbye_clean_pref:
             await update.effective_message.reply_text(
                 "I should be deleting goodbye messages up to two days old."
@@ -964,7 +1218,7 @@ async def clean_goodbye(update: Update, context: CallbackContext) -> str:
         return ""
 
     if args[0].lower() in ("on", "yes"):
-        welcome_sql.set_clean_goodbye(chat.id, True)
+        await welcome_sql.aio.set_clean_goodbye(chat.id, True)
         await update.effective_message.reply_text("I'll try to delete old goodbye messages.")
 
         return (
@@ -974,7 +1228,7 @@ async def clean_goodbye(update: Update, context: CallbackContext) -> str:
             f"Has toggled clean goodbyes to <code>ON</code>"
         )
     elif args[0].lower() in ("off", "no"):
-        welcome_sql.set_clean_goodbye(chat.id, False)
+        await welcome_sql.aio.set_clean_goodbye(chat.id, False)
         await update.effective_message.reply_text("I won't delete old goodbye messages.")
 
         return (
@@ -993,13 +1247,13 @@ async def cleanservice(update: Update, context: CallbackContext) -> str:
 
     if len(args) >= 1:
         if args[0].lower() in ("off", "no"):
-            welcome_sql.set_clean_service(chat.id, False)
+            await welcome_sql.aio.set_clean_service(chat.id, False)
             await update.effective_message.reply_text(
                 "Welcome clean service is `off`",
                 parse_mode=ParseMode.MARKDOWN,
             )
         elif args[0].lower() in ("on", "yes"):
-            welcome_sql.set_clean_service(chat.id, True)
+            await welcome_sql.aio.set_clean_service(chat.id, True)
             await update.effective_message.reply_text(
                 "Welcome clean service is `on`",
                 parse_mode=ParseMode.MARKDOWN,
@@ -1010,7 +1264,7 @@ async def cleanservice(update: Update, context: CallbackContext) -> str:
                 parse_mode=ParseMode.MARKDOWN,
             )
     else:
-        current_setting = welcome_sql.clean_service(chat.id)
+        current_setting = await welcome_sql.aio.clean_service(chat.id)
         if current_setting:
             await update.effective_message.reply_text(
                 "Current clean service setting is set to: `on`",
@@ -1033,10 +1287,13 @@ async def user_button(update: Update, context: CallbackContext):
     join_user = int(match.group(1))
 
     if join_user == user.id:
-        welcome_sql.set_human_checks(user.id, chat.id)
-        member_dict = VERIFIED_USER_WAITLIST.pop(user.id)
-        member_dict["status"] = True 
-        VERIFIED_USER_WAITLIST.update({user.id: member_dict})
+        pending = await welcome_sql.aio.remove_pending_verification(chat.id, user.id)
+        if not pending:
+            await query.answer("This check has expired.")
+            return
+
+        cancel_verification_timer(context.job_queue, chat.id, user.id)
+        await welcome_sql.aio.set_human_checks(user.id, chat.id)
         await query.answer(text="Nice! You're a human, unmuted!")
 
         await chat.restrict_member(
@@ -1047,7 +1304,12 @@ async def user_button(update: Update, context: CallbackContext):
                 can_pin_messages=True,
                 can_send_polls=True,
                 can_change_info=True,
-                can_send_media_messages=True,
+                can_send_audios=True,
+                can_send_documents=True,
+                can_send_photos=True,
+                can_send_videos=True,
+                can_send_video_notes=True,
+                can_send_voice_notes=True,
                 can_send_other_messages=True,
                 can_add_web_page_previews=True,
             ),
@@ -1057,44 +1319,12 @@ async def user_button(update: Update, context: CallbackContext):
         except BadRequest:
             pass 
 
-        if member_dict["should_welc"]:
+        if pending["should_welcome"]:
             await bot.send_message(
                 chat.id,
                 "You've proved you're a human. Welcome to the group!"
             )
-
-            if member_dict["media_wel"]:
-                if member_dict["welc_type"] == welcome_sql.SendTypes.STICKER.value:
-                    sent = await ENUM_SEND_MAP[member_dict["welc_type"]](
-                        member_dict["chat_id"],
-                        member_dict["cust_content"],
-                        reply_markup=member_dict["keyboard"],
-                    )
-                else:
-                    sent = await ENUM_SEND_MAP[member_dict["welc_type"]](
-                        member_dict["chat_id"],
-                        member_dict["cust_content"],
-                        caption=member_dict["res"],
-                        reply_markup=member_dict["keyboard"],
-                        parse_mode=ParseMode.MARKDOWN,
-                    )
-            else:
-                sent = await send(
-                    member_dict["update"],
-                    member_dict["res"],
-                    member_dict["keyboard"],
-                    member_dict["backup_message"]
-                )
-            
-            prev_welc = welcome_sql.get_clean_welcome_preference(chat.id)
-            if prev_welc:
-                try:
-                    await dispatcher.bot.delete_message(chat.id, prev_welc)
-                except BadRequest:
-                    pass 
-
-                if sent:
-                    welcome_sql.set_clean_welcome(chat.id, sent.message_id)
+            await send_verified_welcome(bot, chat, user, pending["welcome_text"])
     else:
         await query.answer("You're not allowed to do this!")
 
@@ -1109,14 +1339,17 @@ async def user_captcha_button(update: Update, context: CallbackContext):
     join_chat = int(match.group(1))
     join_user = int(match.group(2))
     captcha_ans = int(match.group(3))
-    join_usr_data = await bot.get_chat(join_user)
 
     if join_user == user.id:
-        corr_captcha_ans = CAPTCHA_ANS_DICT.pop((join_chat, join_user))
-        if corr_captcha_ans == captcha_ans:
-            welcome_sql.set_human_checks(user.id, chat.id)
-            member_dict = VERIFIED_USER_WAITLIST[(chat.id, user.id)]
-            member_dict["status"] = True 
+        # one try per captcha, the check is gone whether the answer is right or not
+        pending = await welcome_sql.aio.remove_pending_verification(join_chat, join_user)
+        if not pending:
+            await query.answer("This captcha has expired.")
+            return
+
+        cancel_verification_timer(context.job_queue, join_chat, join_user)
+        if pending["answer"] == captcha_ans:
+            await welcome_sql.aio.set_human_checks(user.id, chat.id)
             await context.bot.send_message(
                 chat.id,
                 "Nice! You're a human. Unmuted!"
@@ -1130,7 +1363,12 @@ async def user_captcha_button(update: Update, context: CallbackContext):
                     can_pin_messages=True,
                     can_send_polls=True,
                     can_change_info=True,
-                    can_send_media_messages=True,
+                    can_send_audios=True,
+                    can_send_documents=True,
+                    can_send_photos=True,
+                    can_send_videos=True,
+                    can_send_video_notes=True,
+                    can_send_voice_notes=True,
                     can_send_other_messages=True,
                     can_add_web_page_previews=True,
                 ),
@@ -1140,46 +1378,15 @@ async def user_captcha_button(update: Update, context: CallbackContext):
             except BadRequest:
                 pass 
 
-            if member_dict["should_welc"]:
-                if member_dict["media_wel"]:
-                    if member_dict["welc_type"] == welcome_sql.SendTypes.STICKER.value:
-                        sent = await ENUM_SEND_MAP[member_dict["welc_type"]](
-                            member_dict["chat_id"],
-                            member_dict["cust_content"],
-                            reply_markup=member_dict["keyboard"],
-                        )
-                    else:
-                        sent = await ENUM_SEND_MAP[member_dict["welc_type"]](
-                            member_dict["chat_id"],
-                            member_dict["cust_content"],
-                            caption=member_dict["res"],
-                            reply_markup=member_dict["keyboard"],
-                            parse_mode=ParseMode.MARKDOWN,
-                        )
-                else:
-                    sent = await send(
-                        member_dict["update"],
-                        member_dict["res"],
-                        member_dict["keyboard"],
-                        member_dict["backup_message"],
-                    )
-                
-                prev_welc = welcome_sql.get_clean_welcome_preference(chat.id)
-                if prev_welc:
-                    try:
-                        await dispatcher.bot.delete_message(chat.id, prev_welc)
-                    except BadRequest:
-                        pass 
-                        
-                    if sent:
-                        welcome_sql.set_clean_welcome(chat.id, sent.message_id)
+            if pending["should_welcome"]:
+                await send_verified_welcome(bot, chat, user, pending["welcome_text"])
         else:
             try:
                 await dispatcher.bot.delete_message(chat.id, message.message_id)
             except BadRequest:
                 pass
             kicked_message = f"""
-            ❌ [{escape_markdown(join_usr_data.first_name)}](tg://user?id={join_user}) failed the captcha and was kicked.
+            ❌ [{escape_markdown(user.first_name)}](tg://user?id={join_user}) failed the captcha and was kicked.
             """
             await context.bot.send_message(
                 chat.id,
@@ -1199,6 +1406,10 @@ async def user_captcha_button(update: Update, context: CallbackContext):
             "You're not allowed to do this!"
         )
 
+async def fill_captcha_pool(context: CallbackContext) -> None:
+    # start rendering captchas in the background so the first joiner doesn't wait on one
+    CAPTCHA_POOL.start()
+
 def __migrate__(old_chat_id, new_chat_id):
     welcome_sql.migrate_chat(old_chat_id, new_chat_id)
 
@@ -1266,4 +1477,8 @@ dispatcher.add_handler(CLEAN_SERVICE_HANDLER)
 dispatcher.add_handler(CLEAN_WELCOME)
 dispatcher.add_handler(CLEAN_GOODBYE)
 dispatcher.add_handler(BUTTON_VERIFY_HANDLER)
-dispatcher.add_handler(CAPTCHA_BUTTON_VERIFY_HANDLER)
\ No newline at end of file
+dispatcher.add_handler(CAPTCHA_BUTTON_VERIFY_HANDLER)
+
+dispatcher.job_queue.run_once(fill_captcha_pool, when=0)
+dispatcher.job_queue.run_once(rearm_verifications, when=0)
+dispatcher.job_queue.run_repeating(resync_member_counts, interval=MEMBER_COUNT_RESYNC_INTERVAL, first=MEMBER_COUNT_RESYNC_INTERVAL)
@@ -0,0 +1,170 @@
+import asyncio
+from time import monotonic
+
+from telegram import Bot
+from telegram.ext import Application
+from telegram.constants import ParseMode
+from telegram.error import RetryAfter, TimedOut, NetworkError, TelegramError
+
+from src import LOGGER
+from src.core.metrics import CURRENT_CALL
+from src.core.sql import UPDATE_SCOPE, broadcast_sql, users_sql
+
+BROADCAST_WORKERS = 8
+BROADCAST_RATE = 25 # messages per second, kept just under telegram's global limit of 30
+BROADCAST_PAGE_SIZE = 200 # recipients read (and checkpointed) at a time
+BROADCAST_MAX_ATTEMPTS = 3
+
+# a broadcast only ever sends one message to each chat, so the per-chat limits can't be hit
+# by a single run. the global limit is what the bucket below protects.
+RUNNING_BROADCASTS = set()
+
+
+class TokenBucket:
+    """
+    Hands out tokens at a fixed rate, with bursts of up to `capacity` tokens.
+    Every send takes a token, and a RetryAfter pauses the whole bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+    def pause(self, seconds: float) -> None:
+        # telegram told us to back off, nobody sends until it's over
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+        self._tokens = 0
+
+
+async def send_to_recipient(bot: Bot, bucket: TokenBucket, recipient_id, text: str) -> bool:
+    """
+    Sends the broadcast to one chat or user.
+    :return: True if the message was delivered.
+    """
+    attempts = 0
+    while attempts < BROADCAST_MAX_ATTEMPTS:
+        await bucket.acquire()
+        try:
+            await bot.send_message(
+                int(recipient_id),
+                text,
+                parse_mode=ParseMode.MARKDOWN,
+                disable_web_page_preview=True,
+            )
+            return True
+        except RetryAfter as excp: # doesn't count as an attempt, the recipient is fine
+            bucket.pause(excp.retry_after)
+        except (TimedOut, NetworkError):
+            attempts += 1
+            await asyncio.sleep(1)
+        except TelegramError: # blocked, kicked, chat not found...
+            return False
+
+    return False
+
+
+async def run_broadcast(bot: Bot, broadcast_id: int) -> None:
+    """
+    Sends a broadcast to every recipient it hasn't reached yet, saving progress after every page
+    so a restart picks up from the last page instead of the beginning.
+    :param bot: The bot to send the messages with.
+    :param broadcast_id: The broadcast to run.
+    """
+    # this task outlives the /broadcast update that started it, so it must not share that update's
+    # database sessions or have its time charged to that handler
+    UPDATE_SCOPE.set(None)
+    CURRENT_CALL.set(None)
+
+    if broadcast_id in RUNNING_BROADCASTS:
+        return
+    RUNNING_BROADCASTS.add(broadcast_id)
+
+    try:
+        progress = await broadcast_sql.aio.get_broadcast(broadcast_id)
+        if not progress or progress.finished:
+            return
+
+        phases = progress.phases.split(",")
+        phase, cursor = progress.phase, progress.cursor
+        sent, failed = progress.sent, {"groups": progress.failed_groups, "users": progress.failed_users}
+        bucket = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+        start_time = monotonic()
+
+        for phase in phases[phases.index(phase):]:
+            fetch_page = users_sql.aio.get_chat_ids_after if phase == "groups" else users_sql.aio.get_user_ids_after
+
+            while True:
+                page = await fetch_page(cursor, limit=BROADCAST_PAGE_SIZE)
+                if not page:
+                    break
+
+                queue = asyncio.Queue()
+                for recipient_id in page:
+                    queue.put_nowait(recipient_id)
+
+                async def worker():
+                    nonlocal sent
+                    while not queue.empty():
+                        recipient_id = queue.get_nowait()
+                        if await send_to_recipient(bot, bucket, recipient_id, progress.text):
+                            sent += 1
+                        else:
+                            failed[phase] += 1
+
+                await asyncio.gather(*(worker() for _ in range(min(BROADCAST_WORKERS, len(page)))))
+
+                cursor = page[-1]
+                await broadcast_sql.aio.save_broadcast_progress(
+                    broadcast_id, phase, cursor, sent, failed["groups"], failed["users"],
+                )
+
+            cursor = None # the next phase starts from the beginning of its own table
+            if phase != phases[-1]:
+                await broadcast_sql.aio.save_broadcast_progress(
+                    broadcast_id, phases[phases.index(phase) + 1], None, sent, failed["groups"], failed["users"],
+                )
+
+        await broadcast_sql.aio.finish_broadcast(broadcast_id)
+
+        elapsed = monotonic() - start_time
+        LOGGER.info(f"Broadcast {broadcast_id}: {sent} sent in {elapsed:.1f}s.")
+        try:
+            await bot.send_message(
+                int(progress.origin_chat_id),
+                f"📡 Broadcast message complete. \nSent `{sent}` \nGroups failed `{failed['groups']}` \nFailed users `{failed['users']}` 📡",
+                parse_mode=ParseMode.MARKDOWN,
+            )
+        except TelegramError:
+            pass
+    finally:
+        RUNNING_BROADCASTS.discard(broadcast_id)
+
+
+async def resume_broadcasts(application: Application) -> None:
+    # pick up any broadcast that was still running when the bot last stopped
+    for (broadcast_id,) in await broadcast_sql.aio.get_unfinished_broadcasts():
+        LOGGER.info(f"Resuming broadcast {broadcast_id}.")
+        application.create_task(run_broadcast(application.bot, broadcast_id))
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    A small in-memory cache where every entry expires after a fixed number of seconds.
+    When a maximum size is given the least recently used entries are dropped first.
+    Safe to share between the event loop and the database threads.
+    """
+
+    def __init__(self, ttl: float, maxsize: Optional[int] = None) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock() # get reorders the dict too, so every access takes it
+
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the cached value for a key if it hasn't expired yet.
+        :param key: The key to look up.
+        :param default: The value returned when the key is missing or expired.
+        :return: The cached value or the default.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            expires_at, value = item
+            if expires_at <= monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Stores a value for a key, replacing anything that was there before.
+        :param key: The key to store the value under.
+        :param value: The value to cache.
+        :param ttl: An optional lifetime in seconds to use instead of the cache default.
+        """
+        with self._lock:
+            self._data[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+        if item is None:
+            return default
+
+        return item[1]
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
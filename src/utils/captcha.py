@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Optional, Tuple
+
+from src import LOGGER
+
+CAPTCHA_SIZE_NUM = 2 # captcha image size number (2 -> 640x360)
+CAPTCHA_DIFFICULTY = 3
+CAPTCHA_POOL_SIZE = 20 # ready captchas kept around for the next joiners
+CAPTCHA_WORKERS = 2 # processes rendering captchas, each one keeps a core busy while it renders
+CAPTCHA_RETRY_DELAY = 5 # seconds to wait before rendering again after a failure
+
+
+def render_captcha() -> Tuple[bytes, str]:
+    # runs in a worker process, so it has to stay a top level function that only returns picklable values.
+    # the generator is imported here so only the worker processes pay for loading it and its fonts
+    from multicolorcaptcha import CaptchaGenerator
+
+    captcha = CaptchaGenerator(CAPTCHA_SIZE_NUM).gen_captcha_image(difficult_level=CAPTCHA_DIFFICULTY)
+
+    fileobj = BytesIO()
+    captcha["image"].save(fp=fileobj, format="PNG")
+    return fileobj.getvalue(), captcha["characters"]
+
+
+class CaptchaPool:
+    """
+    Keeps a pool of captcha images rendered ahead of time by a process pool, so a new member
+    gets their captcha straight away instead of waiting for one to be drawn on the event loop.
+    """
+
+    def __init__(self, size: int, workers: int) -> None:
+        self.size = size
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._ready: Optional[asyncio.Queue] = None
+        self._refill_tasks = []
+
+
+    def start(self) -> None:
+        # the queue belongs to the loop that's running, so this can't happen at import
+        if self._refill_tasks:
+            return
+
+        self._ready = asyncio.Queue(maxsize=self.size)
+        self._refill_tasks = [asyncio.create_task(self._refill()) for _ in range(self.workers)]
+        LOGGER.info(f"Captcha: Filling a pool of {self.size} captchas with {self.workers} workers.")
+
+
+    async def _render(self) -> Tuple[bytes, str]:
+        if self._executor is None:
+            # forking would copy the bot's threads, locks and open connections into the workers, so they're
+            # started fresh instead. each one imports the src package once when it starts.
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        executor = self._executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, render_captcha)
+        except BrokenProcessPool:
+            # a worker died, start over with fresh processes next time. the other refill tasks see the same
+            # broken pool, so only the first one to get here shuts it down.
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+    async def _refill(self) -> None:
+        while True:
+            try:
+                captcha = await self._render()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                LOGGER.exception("Captcha: Failed to render a captcha for the pool.")
+                await asyncio.sleep(CAPTCHA_RETRY_DELAY)
+                continue
+
+            # blocks while the pool is full and wakes up as soon as a captcha is taken
+            await self._ready.put(captcha)
+
+
+    async def get(self) -> Tuple[bytes, str]:
+        """
+        Takes a ready captcha from the pool, only rendering one on the spot if the pool has run dry.
+        :return: The png image as bytes and the characters it shows.
+        """
+        self.start()
+
+        try:
+            return self._ready.get_nowait()
+        except asyncio.QueueEmpty:
+            return await self._render()
+
+
+    def __len__(self) -> int:
+        return self._ready.qsize() if self._ready is not None else 0
+
+
+CAPTCHA_POOL = CaptchaPool(CAPTCHA_POOL_SIZE, CAPTCHA_WORKERS)
@@ -25,9 +25,9 @@ async def extract_user_id(update: Update, message, text: str) -> int:
     entity = (entities[0] if entities else None)
      
     if entity == None:
-        return get_user_id(text, update.effective_chat.id)
+        return await get_user_id(text, update.effective_chat.id)
     elif entity.type == MessageEntity.MENTION: 
-        return get_user_id(text, update.effective_chat.id)
+        return await get_user_id(text, update.effective_chat.id)
     elif entity.type == MessageEntity.TEXT_MENTION:
         return entity.user.id
     
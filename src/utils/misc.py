@@ -1,5 +1,4 @@
 from random import randint, choice
-from PIL import Image, ImageDraw, ImageFilter, ImageFont
 from datetime import datetime, timedelta
 
 from src import aiohttpsession as aiosession # Comment and uncomment this in order to sort out an issue
@@ -1,11 +1,13 @@
-import speedtest # need to install this module via pip
-import psutil
 import time
 
 from src import LOGGER, BOT_START_TIME, BOT_USERNAME, OWNER_USERNAME
 from src.utils.misc import get_readable_time
 
+# speedtest and psutil are imported where they're used so they're only loaded for the commands that need them
+
 async def test_speedtest():
+    import speedtest # need to install this module via pip
+
     def speed_convert(size):
         power = 2**10
         zero = 0
@@ -23,6 +25,8 @@ async def test_speedtest():
 
 
 async def sys_status():
+    import psutil
+
     program_uptime = int(time.time() - BOT_START_TIME)
     cpu_usage = psutil.cpu_percent()
     mem_usage = psutil.virtual_memory().percent
@@ -1,5 +1,6 @@
 import re
-from typing import List, Dict
+from string import Formatter
+from typing import Iterable, List, Dict, Optional
 
 from telegram import Message, MessageEntity
 from telegram.helpers import escape_markdown
@@ -52,6 +53,48 @@ def _calc_emoji_offset(to_calc) -> int:
 
 VALID_STARTING_QUOTES = ("'", '"', "”")
 
+class KeywordMatcher:
+    """
+    Matches a whole set of keywords against a message in a single regex scan.
+    Every keyword is combined into one case-insensitive alternation that only
+    matches on word boundaries, so the cost per message no longer grows with
+    the number of keywords in a chat.
+    """
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        # longest keywords first so that a phrase wins over a word it starts with
+        keywords = sorted(set(keywords), key=len, reverse=True)
+        self.keywords = {keyword.lower(): keyword for keyword in keywords}
+
+        if keywords:
+            self.pattern = re.compile(
+                r"(?:^|[^\w])(?P<keyword>"
+                + "|".join(re.escape(keyword) for keyword in keywords)
+                + r")(?=$|[^\w])",
+                flags=re.IGNORECASE,
+            )
+        else:
+            self.pattern = None
+
+    def __bool__(self) -> bool:
+        return self.pattern is not None
+
+    def search(self, text: str) -> Optional[str]:
+        """
+        Search the text for any of the keywords
+        :param text: text to search
+        :return: the keyword that matched, or None if no keyword was found
+        """
+        if not self.pattern or not text:
+            return None
+
+        match = self.pattern.search(text)
+        if not match:
+            return None
+
+        found = match.group("keyword")
+        return self.keywords.get(found.lower(), found)
+
 def remove_escapes(text: str) -> str:
     formatted_message = ""
     is_escaped = False
@@ -215,6 +258,20 @@ def escape_invalid_curly_brackets(text: str, valids: List[str]) -> str:
     
     return new_text
 
+class MessageTemplate:
+    """
+    A custom welcome or goodbye message with its invalid curly brackets escaped once,
+    so rendering it for a member is a single format call.
+    """
+
+    def __init__(self, text: str, valids: List[str]) -> None:
+        self.text = escape_invalid_curly_brackets(text, valids)
+        # the placeholders the message actually uses, so values that are costly to get can be skipped
+        self.fields = {field for _, field, _, _ in Formatter().parse(self.text) if field}
+
+    def render(self, **values) -> str:
+        return self.text.format(**values)
+
 async def time_formatter(message: Message, time_value: str) -> str:
     if any(time_value.endswith(unit) for unit in ("m", "h", "d")):
         unit = time_value[-1]
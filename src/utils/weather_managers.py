@@ -1,10 +1,112 @@
-import requests
-import pyowm
-import json
-import pyowm
+import asyncio
+import random
+from bisect import bisect_left
+from collections import OrderedDict
 from typing import Tuple, Optional
 
-from src import LOGGER, OWM_API_TOKEN
+from aiohttp import ClientError, ClientTimeout
+
+from src import LOGGER, OWM_API_TOKEN, aiohttpsession
+from src.core.metrics import register_cache
+from src.utils.cache import TTLCache
+
+OWM_TIMEOUT = ClientTimeout(total=10, connect=3)
+OWM_MAX_RETRIES = 3
+OWM_RETRY_BACKOFF = 0.5 # seconds, doubled on each retry before jitter is applied
+OWM_MAX_CONCURRENT_REQUESTS = 10
+
+# limits how many requests we have open against OWM at once, across every user
+OWM_SEMAPHORE = asyncio.Semaphore(OWM_MAX_CONCURRENT_REQUESTS)
+
+# how long each kind of response stays fresh, current weather changes a lot faster than a forecast
+WEATHER_CACHE_TTLS = {
+    "weather": 10 * 60,
+    "forecast": 60 * 60,
+}
+WEATHER_CACHE_SIZE = 1000
+WEATHER_CACHE_PRECISION = 2 # decimal places lat/lon are rounded to, roughly a 1km square
+
+CITY_LOOKUP_CACHE_SIZE = 2048
+CITY_PREFIX_RESULTS = 10 # a prefix can match thousands of cities, only offer the first few
+
+
+class WeatherResponseCache:
+    """
+    Caches OWM responses by endpoint, rounded coordinates and period count so that nearby lookups
+    for the same thing share one response. Identical requests that arrive while one is already
+    running wait for it instead of making their own.
+    """
+
+    def __init__(self, ttls: dict, maxsize: int) -> None:
+        self.ttls = ttls
+        self._responses = TTLCache(max(ttls.values()), maxsize=maxsize)
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+
+    def make_key(self, endpoint: str, lat, lon, cnt=None) -> tuple:
+        return (
+            endpoint,
+            round(float(lat), WEATHER_CACHE_PRECISION),
+            round(float(lon), WEATHER_CACHE_PRECISION),
+            cnt,
+        )
+
+
+    async def get_or_fetch(self, endpoint: str, lat, lon, cnt, fetch) -> Optional[dict]:
+        """
+        Returns the cached response for a request, or runs the fetch coroutine function to get it.
+        :param endpoint: The OWM endpoint, one of the WEATHER_CACHE_TTLS keys.
+        :param lat: The latitude of the location.
+        :param lon: The longitude of the location.
+        :param cnt: The number of forecast periods, None for endpoints without one.
+        :param fetch: A coroutine function that requests the API.
+        :return: The parsed JSON response, or None if the request was unsuccessful.
+        """
+        key = self.make_key(endpoint, lat, lon, cnt)
+
+        response = self._responses.get(key)
+        if response is not None:
+            self.hits += 1
+            return response
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._store(key, endpoint, done))
+
+        # shielded so one caller giving up doesn't cancel the request for everyone else waiting on it
+        return await asyncio.shield(task)
+
+
+    def _store(self, key: tuple, endpoint: str, task: asyncio.Future) -> None:
+        self._in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        if task.result() is not None: # failures aren't cached so the next lookup tries again
+            self._responses.set(key, task.result(), ttl=self.ttls[endpoint])
+
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "size": len(self._responses),
+        }
+
+
+WEATHER_CACHE = WeatherResponseCache(WEATHER_CACHE_TTLS, WEATHER_CACHE_SIZE)
+register_cache("weather", WEATHER_CACHE.stats)
 
 
 class OWM_API_Manager:
@@ -16,24 +118,38 @@ class OWM_API_Manager:
     def initialise_manager(self) -> str:
         # initialise the manager with the api key 
         # -> NOTE: this is used instead of directly requesting the API as it returns more results per location
+        import pyowm # only loaded once a manager is actually needed, it's slow to import
 
         return pyowm.OWM(self.api_key)
     
 
-    def request_api(self, request_url) -> str:
+    async def request_api(self, request_url) -> Optional[dict]:
         """
-        Requests the OpenWeatherMap API.
-        :param query_string: The query string to request the API with.
-        :return: The API data.
+        Requests the OpenWeatherMap API over the shared aiohttp session, retrying timeouts,
+        connection errors, rate limits and server errors with jittered backoff.
+        :param request_url: The url to request the API with.
+        :return: The parsed JSON data, or None if the request was unsuccessful.
         """
-        # perform request on API url
-        response = requests.get(request_url)
+        for attempt in range(OWM_MAX_RETRIES):
+            try:
+                async with OWM_SEMAPHORE:
+                    async with aiohttpsession.get(request_url, timeout=OWM_TIMEOUT) as response:
+                        if response.status == 200:
+                            return await response.json(content_type=None)
 
-        if response.status_code != 200:
-            LOGGER.error("The request was unsuccessful. Status code: " + str(response.status_code))
-            return None
-        
-        return response
+                        if response.status != 429 and response.status < 500: # retrying won't fix a bad request
+                            LOGGER.error("The request was unsuccessful. Status code: " + str(response.status))
+                            return None
+
+                        LOGGER.warning("The request was unsuccessful, retrying. Status code: " + str(response.status))
+            except (ClientError, asyncio.TimeoutError) as excp:
+                LOGGER.warning(f"The request failed, retrying. {excp!r}")
+
+            if attempt < OWM_MAX_RETRIES - 1:
+                await asyncio.sleep(random.uniform(0, OWM_RETRY_BACKOFF * 2 ** attempt))
+
+        LOGGER.error("The request was unsuccessful after " + str(OWM_MAX_RETRIES) + " attempts.")
+        return None
 
 # child classes
 
@@ -48,7 +164,7 @@ class LocationManager(OWM_API_Manager):
         self.state_code = state_code
 
 
-    def request_geocodes(self, city_name, country_code, state_code) -> str:
+    async def request_geocodes(self, city_name, country_code, state_code) -> Optional[list]:
         """
         Requests the geocode data from the OpenWeatherMap API.
         :param city_name: The city name to request the geocode data for.
@@ -60,19 +176,14 @@ class LocationManager(OWM_API_Manager):
         
         url = f"{self.geocode_url}q={city_name},{state_code},{country_code}&appid={self.api_key}"
 
-        geocode_data = self.request_api(url) # request the API -> method from parent class
-
-        if geocode_data is None:
-            return geocode_data
-        
-        return json.loads(geocode_data)
+        return await self.request_api(url) # request the API -> method from parent class
     
 
-    def get_geocodes(self, city_name, country_code, state_code: str, update) -> None: # I prefer getting the geocodes from the API instead of from the pyOWM module as it's more accurate
+    async def get_geocodes(self, city_name, country_code, state_code: str, update) -> None: # I prefer getting the geocodes from the API instead of from the pyOWM module as it's more accurate
         # retrieve url data using the request geocode method   
-        geocode_data = self.request_geocodes(city_name, country_code, state_code)
+        geocode_data = await self.request_geocodes(city_name, country_code, state_code)
 
-        if geocode_data != None: # successful API response
+        if geocode_data: # successful API response
 
             geocode_data = geocode_data[0] # get the first result from the list -> as we have provided the exact location name, there should only be one result
             
@@ -82,21 +193,22 @@ class LocationManager(OWM_API_Manager):
             return False
         
 
-    def get_population(self) -> int:
+    async def get_population(self) -> int:
         complete_url = f"{self.base_url}{self.forecast_query_string}q={self.city_name},{self.state_code},{self.country_code}&appid={self.api_key}"
 
-        location_data = self.request_api(complete_url) # request the API -> method from parent class
+        location_data = await self.request_api(complete_url) # request the API -> method from parent class
 
         if location_data is None:
             return location_data
         
-        return location_data["population"]
+        return location_data["city"]["population"]
 
 
 class WeatherManager(OWM_API_Manager):
     def __init__(self, lat, lon) -> None:
         OWM_API_Manager.__init__(self, OWM_API_TOKEN)
         self.weather_query_string = "weather?"
+        self.forecast_query_string = "forecast?"
         self.lat = lat 
         self.lon = lon
         self.descriptions = {
@@ -112,19 +224,35 @@ class WeatherManager(OWM_API_Manager):
         }
 
 
-    def request_weather(self) -> str:
+    async def request_weather(self) -> Optional[dict]:
         """
         Requests the weather data from the OpenWeatherMap API.
 
-        :param city_name: The name of the city to get the weather data for.
         :return: The weather data.
         """
 
         complete_url = f"{self.base_url}{self.weather_query_string}lat={self.lat}&lon={self.lon}&appid={self.api_key}&units={self.units}"
         # check to see whether the request was successful
-        weather_data = self.request_api(complete_url) # request the API -> method from parent class
+        weather_data = await WEATHER_CACHE.get_or_fetch(
+            "weather", self.lat, self.lon, None, lambda: self.request_api(complete_url), # request the API -> method from parent class
+        )
 
         return weather_data
+
+
+    async def request_forecast(self, cnt: int) -> Optional[dict]:
+        """
+        Requests the 3 hour step forecast data from the OpenWeatherMap API.
+
+        :param cnt: The number of 3 hour periods to request.
+        :return: The forecast data.
+        """
+
+        complete_url = f"{self.base_url}{self.forecast_query_string}lat={self.lat}&lon={self.lon}&units={self.units}&cnt={cnt}&appid={self.api_key}"
+
+        return await WEATHER_CACHE.get_or_fetch(
+            "forecast", self.lat, self.lon, cnt, lambda: self.request_api(complete_url),
+        )
     
     def return_description_emoji(self, description) -> str:
         # returns the emoji corresponding to the description
@@ -137,20 +265,80 @@ class WeatherManager(OWM_API_Manager):
 
 class RegistryManager(OWM_API_Manager):
     """
-    This class is used to store a list of cities and their corresponding weather data.
+    This class is used to look up cities, and their coordinates, by name.
+    pyowm decompresses its whole city registry every time one is created, so the registry is only
+    loaded once, on first use, into an index keyed by normalised city name that every user shares.
     """
 
-    def __init__(self, owm, location_name) -> None:
+    def __init__(self) -> None:
         OWM_API_Manager.__init__(self, OWM_API_TOKEN)
-        self.owm = owm
-        self.location_name = location_name
+        self._cities = None # normalised name -> tuple of (city_id, name, country, state, lat, lon)
+        self._sorted_names = [] # for prefix lookups
+        self._load_lock = asyncio.Lock()
+        self._lookups = OrderedDict() # memoised results per normalised name and matching
+
+
+    @staticmethod
+    def normalise_name(location_name: str) -> str:
+        return " ".join(location_name.split()).casefold()
+
+
+    def _build_index(self) -> Tuple[dict, list]:
+        # blocking, the registry's sqlite connection only works on the thread that made it so it's all done here
+        registry = self.initialise_manager().city_id_registry()
+        try:
+            rows = registry.connection.execute(
+                "SELECT city_id, name, country, state, lat, lon FROM city"
+            ).fetchall()
+        finally:
+            registry.connection.close()
+
+        cities = {}
+        for row in rows:
+            cities.setdefault(self.normalise_name(row[1]), []).append(tuple(row))
 
+        return {name: tuple(matches) for name, matches in cities.items()}, sorted(cities)
 
-    def get_city_ids(self) -> list:
-        # obtain complete registry with city id's
-        registry = self.owm.city_id_registry()
 
-        return registry.ids_for(self.location_name, matching='exact') # exact match for now
+    async def load(self) -> None:
+        if self._cities is not None:
+            return
+
+        async with self._load_lock:
+            if self._cities is None:
+                LOGGER.info("Weather: Loading the city registry.")
+                self._cities, self._sorted_names = await asyncio.get_running_loop().run_in_executor(None, self._build_index)
+                LOGGER.info(f"Weather: Loaded {len(self._sorted_names)} city names into the registry index.")
+
+
+    async def get_city_ids(self, location_name: str, matching: str = "exact") -> list:
+        """
+        Returns the registry entries for every city with the given name.
+        :param location_name: The name of the city, case and extra whitespace are ignored.
+        :param matching: 'exact' for the name only, or 'prefix' to also fall back to names starting with it.
+        :return: A list of (city_id, name, country, state, lat, lon) tuples.
+        """
+        key = (self.normalise_name(location_name), matching)
+        if key in self._lookups:
+            self._lookups.move_to_end(key)
+            return self._lookups[key]
+
+        await self.load()
+
+        name = key[0]
+        results = list(self._cities.get(name, ()))
+        if not results and matching == "prefix":
+            index = bisect_left(self._sorted_names, name)
+            while index < len(self._sorted_names) and self._sorted_names[index].startswith(name) and len(results) < CITY_PREFIX_RESULTS:
+                results.extend(self._cities[self._sorted_names[index]])
+                index += 1
+            results = results[:CITY_PREFIX_RESULTS]
+
+        self._lookups[key] = results
+        if len(self._lookups) > CITY_LOOKUP_CACHE_SIZE:
+            self._lookups.popitem(last=False)
+
+        return results
 
 
     def get_location_information(self, location_dict) -> Tuple[str, str, Optional[str], str, str]:
@@ -174,4 +362,7 @@ class RegistryManager(OWM_API_Manager):
         if registry[iteration][3] != None:
             return True
         
-        return False
\ No newline at end of file
+        return False
+
+
+CITY_REGISTRY = RegistryManager()